@@ -1,13 +1,27 @@
 import csv
 
+from allauth.socialaccount.models import SocialAccount
 from django.contrib import admin
-from django.http import HttpResponse
+from django.db.models import Exists, OuterRef
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from django.utils.text import slugify
-from time import strftime
 
 # Register your models here.
-from events.models import Event, SeatingRoom, EventSignup, Tournament, Ticket, TournamentSignup
+from events.forms import SeatingRoomForm
+from events.models import Event, SeatingRoom, EventSignup, Tournament, Ticket, TournamentSignup, SocietyMembership, \
+    SignupReservation, StripeWebhookEvent
+from seating.models import SeatingRevision
+from uwcs_auth.models import WarwickGGUser
+
+
+class Echo:
+    """
+    A file-like object for csv.writer that hands back each row it's given, so a CSV can be streamed line by line
+    """
+
+    def write(self, value):
+        return value
 
 
 @admin.register(Tournament)
@@ -23,37 +37,62 @@ class TournamentAdmin(admin.ModelAdmin):
 
 @admin.register(SeatingRoom)
 class SeatingRoomAdmin(admin.ModelAdmin):
-    list_display = ('name', 'seating_plan_svg')
+    form = SeatingRoomForm
+    list_display = ('name', 'seating_plan_svg', 'capacity')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+
+        if hasattr(form, 'seat_map'):
+            obj.index_seats(form.seat_map)
 
 
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
     date_hierarchy = 'start'
-    list_display = ('title', 'location', 'start', 'end', 'hosted_by', 'is_ongoing')
+    list_display = ('title', 'location', 'start', 'end', 'hosted_by', 'signup_count', 'is_ongoing')
     list_filter = (
         'hosted_by', 'cost_member', 'cost_non_member', 'has_photography', 'has_livestream', 'seating_location')
     search_fields = ('title', 'location')
     actions = ['export_signups']
 
     def export_signups(self, request, queryset):
-        columns = ['event_title', 'start', 'end', 'nick']
-        entries = []
-
-        for event in queryset:
-            signups = EventSignup.objects.filter(event=event, is_unsigned_up=False).all()
-            entries = entries + list(map(lambda x: (
-                event.title, event.start.strftime('%d/%m/%y %H:%M'), event.end.strftime('%d/%m/%y %H:%M'),
-                x.profile.long_name
-            ), signups))
+        columns = ['event_title', 'start', 'end', 'nick', 'seat', 'ticket_status', 'uwcs_member', 'esports_member']
+        events = {event.id: event for event in queryset.order_by('start')}
+
+        # Each event's latest seating plan is rebuilt once rather than looking up everyone's seat separately
+        seats = {}
+        for event in events.values():
+            latest_revision = SeatingRevision.objects.for_event(event).first()
+            seats[event.id] = latest_revision.seats() if latest_revision else {}
+
+        # One query for every signup to the events, along with everything the rows need
+        signups = EventSignup.objects.filter(event__in=events.keys(), is_unsigned_up=False).annotate(
+            uwcs_member=Exists(SocialAccount.objects.filter(user=OuterRef('user'))),
+            esports_member=SocietyMembership.objects.is_member_expr('WE', OuterRef('user__warwickgguser__uni_id')),
+            nick=WarwickGGUser.objects.long_name_expr()
+        ).order_by('event__start', 'event_id', 'created_at').values_list(
+            'event_id', 'user_id', 'nick', 'ticket__status', 'uwcs_member', 'esports_member')
+
+        ticket_statuses = dict(Ticket.TICKET_STATUSES)
+        event_times = {event.id: (event.start.strftime('%d/%m/%y %H:%M'), event.end.strftime('%d/%m/%y %H:%M'))
+                       for event in events.values()}
+
+        def rows():
+            yield columns
+            for event_id, user_id, nick, ticket_status, uwcs_member, esports_member in signups.iterator():
+                start, end = event_times[event_id]
+                yield (events[event_id].title, start, end, nick, seats[event_id].get(user_id, ''),
+                       ticket_statuses.get(ticket_status, 'Free'), 'Yes' if uwcs_member else 'No',
+                       'Yes' if esports_member else 'No')
 
         filename = '{time}-{events}-signups.csv'.format(time=timezone.now().strftime('%d-%m-%yT%H:%M'),
-                                                        events=(slugify('-'.join(map(lambda x: x.title, queryset)))))
-        response = HttpResponse(content_type='text/csv')
+                                                        events=slugify('-'.join(event.title for event in
+                                                                                events.values())))
+        writer = csv.writer(Echo())
+        response = StreamingHttpResponse((writer.writerow(row) for row in rows()), content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename="{filename}"'.format(filename=filename)
 
-        writer = csv.writer(response)
-        writer.writerow(columns)
-        writer.writerows(entries)
         return response
 
     export_signups.short_description = 'Export signups for info slips'
@@ -62,15 +101,31 @@ class EventAdmin(admin.ModelAdmin):
 @admin.register(Ticket)
 class TicketAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
-    list_display = ('user', 'created_at', 'status', 'comment', 'last_updated_at', 'charge_id')
+    list_display = ('user', 'event', 'created_at', 'status', 'comment', 'last_updated_at', 'charge_id')
     list_filter = ('user', 'status')
     search_fields = ('user__first_name', 'user__last_name')
 
 
+@admin.register(StripeWebhookEvent)
+class StripeWebhookEventAdmin(admin.ModelAdmin):
+    date_hierarchy = 'received_at'
+    list_display = ('stripe_id', 'type', 'received_at', 'processed_at', 'attempts', 'last_error')
+    list_filter = ('type',)
+    search_fields = ['stripe_id']
+
+
+@admin.register(SignupReservation)
+class SignupReservationAdmin(admin.ModelAdmin):
+    date_hierarchy = 'created_at'
+    list_display = ('event', 'user', 'created_at', 'expires_at')
+    search_fields = ['event__title', 'user__first_name', 'user__last_name']
+
+
 @admin.register(EventSignup)
 class EventSignupAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
     list_display = ('event', 'long_name', 'created_at')
+    list_select_related = ('event', 'user__warwickgguser')
     list_filter = ('is_unsigned_up',)
     search_fields = ['comment', 'event__title', 'user__first_name', 'user__last_name']
 
@@ -79,5 +134,13 @@ class EventSignupAdmin(admin.ModelAdmin):
 class TournamentSignupAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
     list_display = ('tournament', 'long_name', 'created_at')
+    list_select_related = ('tournament', 'user__warwickgguser')
     list_filter = ('is_unsigned_up',)
     search_fields = ['comment', 'tournament__title', 'user__first_name', 'user__last_name']
+
+
+@admin.register(SocietyMembership)
+class SocietyMembershipAdmin(admin.ModelAdmin):
+    list_display = ('uni_id', 'society', 'synced_at')
+    list_filter = ('society',)
+    search_fields = ['uni_id']
@@ -1,9 +1,12 @@
+import json
 import random
 
 from django import forms
+from django.core.files.base import ContentFile
 from django.forms import Widget
 
-from events.models import EventSignup, TournamentSignup
+from events.models import EventSignup, TournamentSignup, SeatingRoom
+from events.seat_map import parse_seat_map, SeatMapError, minify_svg, has_tables, table_sizes, assign_tables
 
 PLACEHOLDER_TEXTS = [
     'Bottom text',
@@ -62,3 +65,57 @@ class EventSignupForm(forms.ModelForm):
                 'placeholder': get_placeholder(),
             })
         }
+
+
+class SeatingRoomForm(forms.ModelForm):
+    class Meta:
+        model = SeatingRoom
+        fields = ['name', 'seating_plan_svg', 'tables_raw']
+
+    def clean_seating_plan_svg(self):
+        svg = self.cleaned_data['seating_plan_svg']
+
+        if 'seating_plan_svg' in self.changed_data:
+            # Parse the seats once on upload so the room can be indexed when it's saved, and store the plan minified
+            try:
+                self.seat_map = parse_seat_map(svg)
+                svg.seek(0)
+                return ContentFile(minify_svg(svg).encode('utf-8'), name=svg.name)
+            except SeatMapError as e:
+                raise forms.ValidationError(str(e))
+
+        return svg
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        seat_map = getattr(self, 'seat_map', None)
+        if seat_map is None and 'tables_raw' in self.changed_data and self.instance.capacity:
+            # The stored seats need to be moved onto the new tables
+            try:
+                with self.instance.seating_plan_svg.open('rb') as svg:
+                    seat_map = self.seat_map = parse_seat_map(svg)
+            except (OSError, SeatMapError) as e:
+                self.add_error('seating_plan_svg', str(e))
+                return cleaned_data
+
+        if seat_map is None or 'tables_raw' not in cleaned_data:
+            return cleaned_data
+
+        try:
+            tables = [int(size) for size in json.loads(cleaned_data['tables_raw'])]
+        except (TypeError, ValueError):
+            self.add_error('tables_raw', 'The tables must be a JSON list of seat counts')
+            return cleaned_data
+
+        if has_tables(seat_map):
+            if 'tables_raw' in self.changed_data and tables != table_sizes(seat_map):
+                self.add_error('tables_raw', 'The tables come from the Table-N groups in the seating plan, so they '
+                                             'can\'t be changed here')
+        else:
+            try:
+                assign_tables(seat_map, tables)
+            except SeatMapError as e:
+                self.add_error('tables_raw', str(e))
+
+        return cleaned_data
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from events.models import Ticket
+
+
+class Command(BaseCommand):
+    help = 'Expire the unpaid tickets whose checkout sessions have run out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--purge-after', type=int, metavar='DAYS',
+                            help='Also delete tickets that have been expired for more than this many days')
+
+    def handle(self, *args, **options):
+        expired = Ticket.objects.expire_stale()
+        self.stdout.write(self.style.SUCCESS('Expired {n} ticket(s)'.format(n=expired)))
+
+        if options['purge_after'] is not None:
+            purged, _ = Ticket.objects.filter(status=Ticket.EXPIRED, last_updated_at__lte=timezone.now() - timedelta(
+                days=options['purge_after'])).delete()
+            self.stdout.write(self.style.SUCCESS('Deleted {n} expired ticket(s)'.format(n=purged)))
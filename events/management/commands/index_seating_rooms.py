@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from events.models import SeatingRoom
+from events.seat_map import SeatMapError
+
+
+class Command(BaseCommand):
+    help = 'Find the seats in every seating room\'s SVG and store them, so seat IDs can be checked without the SVG'
+
+    def handle(self, *args, **options):
+        for room in SeatingRoom.objects.all():
+            try:
+                room.index_seats()
+            except (OSError, SeatMapError) as e:
+                self.stderr.write('{room}: {error}'.format(room=room.name, error=e))
+                continue
+
+            self.stdout.write('{room}: {n} seats on {tables} tables'.format(room=room.name, n=room.capacity,
+                                                                           tables=len(room.tables)))
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from events.payments import process_pending_webhook_events
+
+
+class Command(BaseCommand):
+    help = 'Apply the Stripe webhook events that have been received but not processed yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forever', action='store_true',
+                            help='Keep checking for new events instead of stopping when there are none left')
+        parser.add_argument('--limit', type=int, help='The most events to process in one go')
+
+    def handle(self, *args, **options):
+        while True:
+            applied, failed = process_pending_webhook_events(options['limit'])
+
+            if applied or failed or not options['forever']:
+                self.stdout.write(self.style.SUCCESS(
+                    'Processed {applied} Stripe event(s), {failed} failed or waiting'.format(applied=applied,
+                                                                                            failed=failed)))
+
+            if not options['forever']:
+                return
+
+            # Events that failed are left for the next check rather than being retried straight away
+            if not applied:
+                time.sleep(settings.STRIPE_WEBHOOK_POLL_INTERVAL)
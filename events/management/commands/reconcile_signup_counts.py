@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from events.models import Event, SignupReservation
+
+
+class Command(BaseCommand):
+    help = 'Recount the active signups and held spaces for every event and repair any stored signup counts that have ' \
+           'drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted counts without fixing them')
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            # Expired reservations still hold their space until they're released, so release them first
+            SignupReservation.objects.release_expired()
+
+        drifted = Event.objects.annotate(actual_count=Event.objects.actual_signup_count()) \
+            .exclude(signup_count=F('actual_count')).values_list('id', 'title', 'signup_count', 'actual_count')
+
+        for event_id, title, stored, actual in drifted:
+            self.stdout.write('{title}: stored {stored}, actually {actual}'.format(title=title, stored=stored,
+                                                                                  actual=actual))
+
+            if not options['dry_run']:
+                Event.objects.recount_signups(event_id)
+
+        self.stdout.write(self.style.SUCCESS('{n} event(s) {verb}'.format(
+            n=len(drifted), verb='drifted' if options['dry_run'] else 'repaired')))
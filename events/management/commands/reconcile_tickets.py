@@ -0,0 +1,204 @@
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from stripe.error import StripeError
+
+from events.models import Ticket
+from events.payments import get_stripe
+from seating.models import Seating
+
+PAGE_SIZE = 100
+
+
+def stripe_pages(list_method, **params):
+    """
+    Every page of a Stripe list API call, following has_more
+    """
+    while True:
+        page = list_method(limit=PAGE_SIZE, **params)
+        yield page['data']
+
+        if not page['has_more'] or not page['data']:
+            return
+        params['starting_after'] = page['data'][-1]['id']
+
+
+def charge_payment(charge):
+    """
+    The (charge ID, payment intent ID, ticket status, amount in pence) a Stripe charge says its ticket should have
+    """
+    if charge.get('refunded'):
+        status = Ticket.REFUNDED
+    elif charge['paid']:
+        status = Ticket.COMPLETE
+    else:
+        status = Ticket.IN_PROGRESS
+
+    return charge['id'], charge.get('payment_intent'), status, charge.get('amount')
+
+
+def refund_payment(refund):
+    return refund['charge'], refund.get('payment_intent'), Ticket.REFUNDED, None
+
+
+@transaction.atomic
+def reconcile_page(payments, fix=False):
+    """
+    Compare a page of payments from Stripe with the tickets and signups they're for, using one query to find them.
+
+    :param payments: A list of (charge ID, payment intent ID, ticket status, amount in pence) tuples
+    :param fix: Whether to bring tickets and signups that are behind Stripe up to date
+    :return: A list of (problem, charge ID, ticket ID, detail) discrepancies
+    """
+    charge_ids = [charge_id for charge_id, _, _, _ in payments]
+    intent_ids = [intent_id for _, intent_id, _, _ in payments if intent_id]
+
+    tickets = Ticket.objects.select_for_update(of=('self',)) if fix else Ticket.objects
+    tickets = list(tickets.filter(Q(charge_id__in=charge_ids) | Q(payment_intent_id__in=intent_ids))
+                   .select_related('signup__event'))
+    by_charge = {ticket.charge_id: ticket for ticket in tickets if ticket.charge_id}
+    by_intent = {ticket.payment_intent_id: ticket for ticket in tickets if ticket.payment_intent_id}
+
+    discrepancies = []
+    updated = []
+
+    for charge_id, intent_id, status, amount in payments:
+        ticket = by_charge.get(charge_id) or by_intent.get(intent_id)
+        if ticket is None:
+            discrepancies.append(('missing_ticket', charge_id, None, 'Stripe has a payment with no ticket'))
+            continue
+
+        if ticket.amount is not None and amount is not None and int(ticket.amount * 100) != amount:
+            discrepancies.append(('amount', charge_id, ticket.id, 'Stripe charged {charged}p for a {price}p ticket'
+                                  .format(charged=amount, price=int(ticket.amount * 100))))
+
+        if ticket.status != status:
+            behind = Ticket.STATUS_ORDER.index(ticket.status) < Ticket.STATUS_ORDER.index(status)
+            discrepancies.append(('status', charge_id, ticket.id, 'Ticket is {ours} but Stripe says {theirs}{fixed}'
+                                  .format(ours=ticket.get_status_display(), theirs=dict(Ticket.TICKET_STATUSES)[status],
+                                          fixed=' (fixed)' if fix and behind else '')))
+            if fix and behind:
+                ticket.advance(status)
+                ticket.charge_id = ticket.charge_id or charge_id
+                ticket.comment = 'Reconciled with Stripe at {time}'.format(
+                    time=timezone.now().strftime('%Y-%m-%dT%H:%M:%S%z'))
+                updated.append(ticket)
+
+        signup = getattr(ticket, 'signup', None)
+        if status == Ticket.COMPLETE and signup is None:
+            discrepancies.append(('missing_signup', charge_id, ticket.id, 'Ticket is paid for but has no signup'))
+        elif status == Ticket.REFUNDED and signup is not None and not signup.is_unsigned_up:
+            fixed = fix and signup.unsign_up()
+            if fixed:
+                Seating.objects.for_event(signup.event).filter(user_id=ticket.user_id).delete()
+            discrepancies.append(('refunded_signup', charge_id, ticket.id, 'Ticket was refunded but is still signed up'
+                                  '{fixed}'.format(fixed=' (fixed)' if fixed else '')))
+
+    if updated:
+        Ticket.objects.bulk_update(updated, ['status', 'charge_id', 'comment', 'last_updated_at'])
+
+    return discrepancies
+
+
+def unpaid_tickets(since, until, charge_ids, intent_ids):
+    """
+    Find the tickets made between since and until that are paid for but weren't among the payments Stripe listed.
+    A ticket made just before until could have been paid for after it, so those are worth checking with a later window.
+
+    :return: A list of (problem, charge ID, ticket ID, detail) discrepancies
+    """
+    tickets = Ticket.objects.filter(status=Ticket.COMPLETE, created_at__gte=since, created_at__lt=until) \
+        .values_list('id', 'charge_id', 'payment_intent_id')
+
+    return [('missing_payment', charge_id or None, ticket_id, 'Ticket is paid for but Stripe has no payment for it')
+            for ticket_id, charge_id, intent_id in tickets.iterator()
+            if charge_id not in charge_ids and intent_id not in intent_ids]
+
+
+def recorded_pages(stream):
+    """
+    The pages of charges and refunds in a recorded reconciliation fixture, which holds the list API responses as
+    {"charges": [page, ...], "refunds": [page, ...]}
+    """
+    recording = json.load(stream)
+
+    for page in recording.get('charges', []):
+        yield [charge_payment(charge) for charge in page['data']]
+    for page in recording.get('refunds', []):
+        yield [refund_payment(refund) for refund in page['data']]
+
+
+def stripe_payment_pages(since, until):
+    stripe = get_stripe()
+    created = {'gte': int(since.timestamp()), 'lt': int(until.timestamp())}
+
+    for page in stripe_pages(stripe.Charge.list, created=created):
+        yield [charge_payment(charge) for charge in page]
+    for page in stripe_pages(stripe.Refund.list, created=created):
+        yield [refund_payment(refund) for refund in page]
+
+
+class Command(BaseCommand):
+    help = 'Check tickets and signups against the charges and refunds Stripe has for a date window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='The first day to check (YYYY-MM-DD), a week ago by default')
+        parser.add_argument('--until', help='The last day to check (YYYY-MM-DD), today by default')
+        parser.add_argument('--fix', action='store_true',
+                            help='Bring tickets and signups that are behind Stripe up to date')
+        parser.add_argument('--file',
+                            help='Read the charges and refunds from a recorded JSON fixture instead of the Stripe API')
+
+    def day(self, value, default):
+        if value is None:
+            return default
+
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError('"{value}" is not a YYYY-MM-DD date'.format(value=value))
+        return parsed
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        since = timezone.make_aware(datetime.combine(self.day(options['since'], today - timedelta(days=7)), time.min))
+        until = timezone.make_aware(datetime.combine(self.day(options['until'], today) + timedelta(days=1), time.min))
+
+        checked = 0
+        discrepancies = []
+        # Refunds of charges in the window have already been checked with the charge
+        seen = set()
+        seen_intents = set()
+
+        try:
+            if options['file']:
+                with open(options['file']) as stream:
+                    pages = list(recorded_pages(stream))
+            else:
+                pages = stripe_payment_pages(since, until)
+
+            for payments in pages:
+                payments = [payment for payment in payments if payment[0] not in seen]
+                if not payments:
+                    continue
+                seen.update(charge_id for charge_id, _, _, _ in payments)
+                seen_intents.update(intent_id for _, intent_id, _, _ in payments if intent_id)
+
+                discrepancies.extend(reconcile_page(payments, options['fix']))
+                checked += len(payments)
+        except StripeError as e:
+            raise CommandError('Could not list payments from Stripe: {error}'.format(error=e))
+
+        discrepancies.extend(unpaid_tickets(since, until, seen, seen_intents))
+
+        for problem, charge_id, ticket_id, detail in discrepancies:
+            self.stdout.write('{problem}\tcharge={charge}\tticket={ticket}\t{detail}'.format(
+                problem=problem, charge=charge_id, ticket=ticket_id if ticket_id is not None else '-', detail=detail))
+
+        style = self.style.WARNING if discrepancies else self.style.SUCCESS
+        self.stdout.write(style('Checked {checked} payment(s), found {n} discrepancies'.format(
+            checked=checked, n=len(discrepancies))))
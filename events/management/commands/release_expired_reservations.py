@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from events.models import SignupReservation
+
+
+class Command(BaseCommand):
+    help = 'Give the spaces held by expired checkout reservations back to their events'
+
+    def handle(self, *args, **options):
+        released = SignupReservation.objects.release_expired()
+
+        self.stdout.write(self.style.SUCCESS('Released {n} expired reservation(s)'.format(n=released)))
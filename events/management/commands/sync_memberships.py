@@ -0,0 +1,77 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from events.membership import iter_member_ids, open_member_list, MembershipLookupError
+from events.models import SocietyMembership
+
+BATCH_SIZE = 1000
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+@transaction.atomic
+def sync_society(society, stream):
+    """
+    Replace the stored member list for a society with the members in a listMembers XML stream.
+
+    Returns a tuple of (members synced, stale members removed)
+    """
+    synced_at = timezone.now()
+    synced = 0
+
+    for batch in batches(iter_member_ids(stream), BATCH_SIZE):
+        batch = set(batch)
+        SocietyMembership.objects.for_society(society).filter(uni_id__in=batch).update(synced_at=synced_at)
+        SocietyMembership.objects.bulk_create(
+            [SocietyMembership(society=society, uni_id=uni_id, synced_at=synced_at) for uni_id in batch],
+            ignore_conflicts=True)
+        synced += len(batch)
+
+    removed, _ = SocietyMembership.objects.for_society(society).filter(synced_at__lt=synced_at).delete()
+
+    return synced, removed
+
+
+class Command(BaseCommand):
+    help = 'Sync the local copy of the SU member lists used to check society membership on signup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--society', choices=settings.SU_MEMBERSHIP_API_KEYS.keys(),
+                            help='Only sync this society')
+        parser.add_argument('--file',
+                            help='Read the member list from a local listMembers XML file instead of the SU API')
+
+    def handle(self, *args, **options):
+        if options['file'] and not options['society']:
+            raise CommandError('--file can only be used with --society')
+
+        societies = [options['society']] if options['society'] else settings.SU_MEMBERSHIP_API_KEYS.keys()
+
+        for society in societies:
+            try:
+                if options['file']:
+                    with open(options['file'], 'rb') as stream:
+                        synced, removed = sync_society(society, stream)
+                else:
+                    api_token = settings.SU_MEMBERSHIP_API_KEYS[society]
+                    if not api_token:
+                        raise CommandError('No SU API key is configured for {society}'.format(society=society))
+
+                    synced, removed = sync_society(society, open_member_list(api_token))
+            except MembershipLookupError as e:
+                raise CommandError('Could not sync {society}: {error}'.format(society=society, error=e))
+
+            self.stdout.write(self.style.SUCCESS(
+                'Synced {synced} {society} members ({removed} removed)'.format(synced=synced, society=society,
+                                                                              removed=removed)))
@@ -0,0 +1,67 @@
+import xml.etree.ElementTree as ET
+
+import requests
+from django.db.models import Value
+from django.db.models.functions import Lower, Replace, Trim
+
+SU_MEMBERSHIP_URL = 'https://www.warwicksu.com/membershipapi/listMembers/{token}/'
+
+
+class MembershipLookupError(Exception):
+    pass
+
+
+def normalise_uni_id(uni_id):
+    """
+    The form uni IDs are stored in, without whitespace or the "u" prefix. normalised_uni_id does the same in the
+    database, so the two must be changed together.
+    """
+    return uni_id.strip().lower().replace('u', '')
+
+
+def normalised_uni_id(expression):
+    """
+    A database expression for normalise_uni_id of a field (or any other expression giving a uni ID)
+    """
+    return Replace(Lower(Trim(expression)), Value('u'), Value(''))
+
+
+def iter_member_ids(stream):
+    """
+    Incrementally parse a SU listMembers XML document and yield the uni ID of every member in it.
+
+    Each member element is discarded as soon as it has been read so memory use stays flat no matter how large the
+    society is.
+    """
+    depth = 0
+
+    try:
+        for event, element in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+
+            depth -= 1
+            if element.tag == 'UniqueID' and element.text:
+                yield normalise_uni_id(element.text)
+            elif depth == 1:
+                # The end of a member element
+                element.clear()
+    except ET.ParseError as e:
+        raise MembershipLookupError('The SU member list is not valid XML') from e
+
+
+def open_member_list(api_token):
+    """
+    Open a streamed connection to the SU listMembers endpoint for a society, returning a file-like object
+    """
+    try:
+        api_call = requests.get(SU_MEMBERSHIP_URL.format(token=api_token), stream=True, timeout=60)
+    except requests.RequestException as e:
+        raise MembershipLookupError('Could not reach the SU membership API') from e
+
+    if api_call.status_code != 200:
+        raise MembershipLookupError('The SU membership API returned {status}'.format(status=api_call.status_code))
+
+    api_call.raw.decode_content = True
+    return api_call.raw
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.6 on 2026-10-18 13:15
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0048_event_seating_lock_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SocietyMembership',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('society', models.CharField(choices=[('UWCS', 'Uni of Warwick Computing Society'), ('WE', 'Warwick Esports')], max_length=4)),
+                ('uni_id', models.CharField(max_length=11)),
+                ('synced_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='societymembership',
+            index=models.Index(fields=['society', 'synced_at'], name='events_soci_society_2a9db1_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='societymembership',
+            unique_together={('society', 'uni_id')},
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.6 on 2026-10-18 13:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_existing_signups(apps, schema_editor):
+    Event = apps.get_model('events', 'Event')
+    EventSignup = apps.get_model('events', 'EventSignup')
+
+    active_signups = EventSignup.objects.filter(event=OuterRef('pk'), is_unsigned_up=False).order_by() \
+        .values('event').annotate(n=Count('id')).values('n')
+    Event.objects.update(signup_count=Coalesce(Subquery(active_signups, output_field=models.IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0049_societymembership'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='signup_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing_signups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.6 on 2026-10-18 13:31
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_existing_revisions(apps, schema_editor):
+    Event = apps.get_model('events', 'Event')
+    SeatingRevision = apps.get_model('seating', 'SeatingRevision')
+
+    # Revision numbers start at 0, so the next number is one after the highest
+    next_number = SeatingRevision.objects.filter(event=OuterRef('pk')).order_by() \
+        .values('event').annotate(n=Max('number') + 1).values('n')
+    Event.objects.update(
+        seating_revision_count=Coalesce(Subquery(next_number, output_field=models.IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0051_signupreservation'),
+        ('seating', '0005_seating_deltas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='seating_revision_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing_revisions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.6 on 2026-10-18 13:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0052_event_seating_revision_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seatingroom',
+            name='capacity',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='seatingroom',
+            name='tables_raw',
+            field=models.TextField(help_text='This field will contain a literal array of integers in JSON list notation ([2, 3, 4, 5]). Each position corresponds to a table, and the value is the total seats on that table. For example: [20, 20, 20, 10] would be the standard LIB2 set up. It is filled in from the SVG when the seats in it can be found.'),
+        ),
+        migrations.CreateModel(
+            name='Seat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seat_id', models.CharField(max_length=5)),
+                ('table', models.PositiveIntegerField()),
+                ('x', models.FloatField()),
+                ('y', models.FloatField()),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seats', to='events.SeatingRoom')),
+            ],
+            options={
+                'ordering': ['table', 'id'],
+                'unique_together': {('room', 'seat_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0054_stripe_webhook_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='payment_intent_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.6 on 2026-10-18 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0055_ticket_payment_intent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=3, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='checkout_session_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='event',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='events.Event'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='status',
+            field=models.CharField(choices=[('C', 'Complete'), ('R', 'Refunded'), ('P', 'In progress'), ('N', 'Created'), ('E', 'Expired')], default='N', max_length=1),
+        ),
+    ]
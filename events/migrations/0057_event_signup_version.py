@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0056_ticket_checkout_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='signup_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 14:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0057_event_signup_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='seatingroom',
+            name='tables_raw',
+            field=models.TextField(help_text='This field will contain a literal array of integers in JSON list notation ([2, 3, 4, 5]). Each position corresponds to a table, and the value is the total seats on that table. For example: [20, 20, 20, 10] would be the standard LIB2 set up. It is filled in from the SVG when the SVG groups its seats into tables.'),
+        ),
+    ]
@@ -1,14 +1,20 @@
 import json
 import sys
-
+from collections import Counter
+from datetime import timedelta
 from functools import reduce
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, OuterRef, Subquery, Count
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
+from django.utils.functional import cached_property
 from markdown_deux.templatetags.markdown_deux_tags import markdown_allowed
 from multiselectfield import MultiSelectField
 
+from events.membership import normalise_uni_id, normalised_uni_id
+from events.seat_map import parse_seat_map, has_tables, table_sizes, assign_tables, SeatMapError
 from uwcs_auth.models import WarwickGGUser
 
 
@@ -18,12 +24,14 @@ class SeatingRoom(models.Model):
     """
     This field will contain a literal array of integers in JSON list notation ([2, 3, 4, 5]). Each position
     corresponds to a table, and the value is the total seats on that table. For example: [20, 20, 20, 10] would
-    be the standard LIB2 set up.
+    be the standard LIB2 set up. It is filled in from the SVG when the SVG groups its seats into tables.
     """
     tables_raw = models.TextField(
-        help_text='This field will contain a literal array of integers in JSON list notation ([2, 3, 4, 5]). Each position corresponds to a table, and the value is the total seats on that table. For example: [20, 20, 20, 10] would be the standard LIB2 set up.')
+        help_text='This field will contain a literal array of integers in JSON list notation ([2, 3, 4, 5]). Each position corresponds to a table, and the value is the total seats on that table. For example: [20, 20, 20, 10] would be the standard LIB2 set up. It is filled in from the SVG when the SVG groups its seats into tables.')
+    # The number of seats found in the SVG when it was uploaded, 0 if it hasn't been indexed
+    capacity = models.PositiveIntegerField(default=0, editable=False)
 
-    @property
+    @cached_property
     def tables(self):
         tables = json.loads(self.tables_raw)
         return {k: v for k, v in enumerate(tables)}
@@ -34,15 +42,92 @@ class SeatingRoom(models.Model):
 
     @property
     def max_capacity(self):
-        return reduce(lambda x, y: x + y, self.tables.values())
+        return self.capacity or reduce(lambda x, y: x + y, self.tables.values())
 
     def save_tables(self, tables):
         self.tables_raw = json.dumps(tables)
+        self.__dict__.pop('tables', None)
+
+    @transaction.atomic
+    def index_seats(self, seats=None):
+        """
+        Store the seats in the room's SVG so it never has to be read again. If the SVG has tables then they replace
+        the room's tables, otherwise the seats are put on the room's tables in the order they're numbered.
+        seats is the result of parse_seat_map if the SVG has already been parsed.
+        """
+        if seats is None:
+            with self.seating_plan_svg.open('rb') as svg:
+                seats = parse_seat_map(svg)
+
+        if has_tables(seats):
+            self.save_tables(table_sizes(seats))
+        else:
+            try:
+                seats = assign_tables(seats, [int(size) for size in json.loads(self.tables_raw)])
+            except (TypeError, ValueError) as e:
+                raise SeatMapError('The room\'s tables are not a JSON list of seat counts') from e
+
+        self.seats.all().delete()
+        Seat.objects.bulk_create(
+            [Seat(room=self, seat_id=seat_id, table=table, x=x, y=y) for seat_id, table, x, y in seats])
+
+        self.capacity = len(seats)
+        self.save(update_fields=['tables_raw', 'capacity'])
+
+    def unknown_seats(self, seat_ids):
+        """
+        The seat IDs which aren't in the room, checked in a single query. Any seat is allowed in rooms which haven't
+        been indexed.
+        """
+        if not self.capacity:
+            return set()
+
+        return set(seat_ids) - set(self.seats.filter(seat_id__in=set(seat_ids)).values_list('seat_id', flat=True))
 
     def __str__(self):
         return self.name
 
 
+class Seat(models.Model):
+    room = models.ForeignKey(SeatingRoom, on_delete=models.CASCADE, related_name='seats')
+    seat_id = models.CharField(max_length=5)
+    # Tables are numbered from 0 in the same order as SeatingRoom.tables
+    table = models.PositiveIntegerField()
+    # The centre of the seat on the seating plan
+    x = models.FloatField()
+    y = models.FloatField()
+
+    class Meta:
+        unique_together = ('room', 'seat_id')
+        ordering = ['table', 'id']
+
+    def __str__(self):
+        return 'Seat {seat} on table {table} in {room}'.format(seat=self.seat_id, table=self.table + 1,
+                                                               room=self.room_id)
+
+
+class EventManager(models.Manager):
+    def actual_signup_count(self):
+        """
+        An expression for what an event's signup_count should be: its active signups plus the spaces held by
+        reservations. Reservations count until release_expired deletes them, since that is when their space is given
+        back.
+        """
+        active_signups = EventSignup.objects.filter(event=OuterRef('pk'), is_unsigned_up=False).order_by() \
+            .values('event').annotate(n=Count('id')).values('n')
+        reservations = SignupReservation.objects.filter(event=OuterRef('pk')).order_by() \
+            .values('event').annotate(n=Count('id')).values('n')
+
+        return Coalesce(Subquery(active_signups, output_field=models.IntegerField()), 0) + \
+            Coalesce(Subquery(reservations, output_field=models.IntegerField()), 0)
+
+    def recount_signups(self, event_id):
+        """
+        Reset an event's stored signup count from its signups and reservations in a single statement
+        """
+        return self.filter(id=event_id).update(signup_count=self.actual_signup_count())
+
+
 class Event(models.Model):
     SOCIETY_CHOICES = (
         ('UWCS', 'Uni of Warwick Computing Society'),
@@ -63,6 +148,9 @@ class Event(models.Model):
     signup_end = models.DateTimeField(default=timezone.now)
     signup_start_fresher = models.DateTimeField(blank=True, null=True)
     signup_limit = models.IntegerField(default=70)
+    # Maintained alongside EventSignup so capacity checks don't have to count rows,
+    # `manage.py reconcile_signup_counts` will repair it if it drifts
+    signup_count = models.PositiveIntegerField(default=0, editable=False)
 
     # Society eligibility criteria
     hosted_by = MultiSelectField(blank=True, choices=SOCIETY_CHOICES, max_choices=2)
@@ -76,11 +164,27 @@ class Event(models.Model):
     has_seating = models.BooleanField(default=True)
     seating_location = models.ForeignKey(SeatingRoom, on_delete=models.PROTECT, blank=True, null=True)
     seating_lock_time = models.DateTimeField(blank=True, null=True)
+    # Hands out seating revision numbers, see next_seating_revision_number
+    seating_revision_count = models.PositiveIntegerField(default=0, editable=False)
+    # Changes whenever the people signed up (or their names and avatars) change, for the seating plan's ETags
+    signup_version = models.PositiveIntegerField(default=0, editable=False)
 
     # Signup options
     has_photography = models.BooleanField(default=False)
     has_livestream = models.BooleanField(default=False)
 
+    objects = EventManager()
+
+    # Kept up to date with F() updates, so saving a copy of the event that was loaded earlier mustn't overwrite them
+    COUNTER_FIELDS = ('signup_count', 'seating_revision_count', 'signup_version')
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields if
+                                       not field.primary_key and field.name not in self.COUNTER_FIELDS]
+
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.title
 
@@ -92,8 +196,8 @@ class Event(models.Model):
 
     @property
     def signups(self):
-        signups = EventSignup.objects.filter(event=self, is_unsigned_up=False).exclude(comment__exact='').order_by(
-            'commented_at', '-created_at').all()
+        signups = EventSignup.objects.filter(event=self, is_unsigned_up=False).exclude(comment__exact='') \
+            .select_related('user__warwickgguser').order_by('commented_at', '-created_at').all()
 
         return signups
 
@@ -103,9 +207,25 @@ class Event(models.Model):
 
         return signups
 
-    @property
-    def signup_count(self):
-        return len(self.signups_all)
+    def reserve_place(self):
+        """
+        Claim one of the event's spaces, returning False if it is full. The capacity check and the claim are a single
+        conditional UPDATE so concurrent signups can never take the event over its limit.
+        """
+        return bool(Event.objects.filter(id=self.id, signup_count__lt=F('signup_limit')).update(
+            signup_count=F('signup_count') + 1))
+
+    def release_place(self):
+        Event.objects.filter(id=self.id, signup_count__gt=0).update(signup_count=F('signup_count') - 1)
+
+    def next_seating_revision_number(self):
+        """
+        Claim the number for a new seating revision. The UPDATE holds the event's row lock until the transaction ends,
+        so concurrent submits for the same event queue up behind each other instead of colliding on the number.
+        """
+        Event.objects.filter(id=self.id).update(seating_revision_count=F('seating_revision_count') + 1)
+
+        return Event.objects.values_list('seating_revision_count', flat=True).get(id=self.id) - 1
 
     @property
     def signups_left(self):
@@ -140,9 +260,145 @@ class Event(models.Model):
             return False
 
 
+class SocietyMembershipManager(models.Manager):
+    def for_society(self, society):
+        return self.filter(society=society)
+
+    def is_member(self, society, uni_id):
+        return self.filter(society=society, uni_id=normalise_uni_id(uni_id)).exists()
+
+    def is_member_expr(self, society, uni_id):
+        """
+        A database expression for is_member, for checking the membership of every row of a query at once.
+
+        :param uni_id: An expression giving the uni ID to check, such as OuterRef('user__warwickgguser__uni_id')
+        """
+        return models.Exists(self.for_society(society).filter(uni_id=normalised_uni_id(uni_id)))
+
+    def is_synced(self, society):
+        """
+        Check if the society's member list was synced in the last SU_MEMBERSHIP_SYNC_MAX_AGE seconds. If it wasn't then
+        nobody can be found to be a member, since a list that was never synced is empty and an old one is wrong.
+        """
+        synced_since = timezone.now() - timedelta(seconds=settings.SU_MEMBERSHIP_SYNC_MAX_AGE)
+        return self.for_society(society).filter(synced_at__gte=synced_since).exists()
+
+
+class SocietyMembership(models.Model):
+    """
+    A local copy of the SU member list for a society, kept up to date by the sync_memberships command
+    """
+    society = models.CharField(max_length=4, choices=Event.SOCIETY_CHOICES)
+    uni_id = models.CharField(max_length=11)
+    synced_at = models.DateTimeField(default=timezone.now)
+
+    objects = SocietyMembershipManager()
+
+    def __str__(self):
+        return '{uni_id} ({society})'.format(uni_id=self.uni_id, society=self.society)
+
+    class Meta:
+        unique_together = ('society', 'uni_id')
+        indexes = [
+            models.Index(fields=['society', 'synced_at'])
+        ]
+
+
+class SignupReservationManager(models.Manager):
+    def reserve(self, event: Event, user):
+        """
+        Hold a space on an event for a user while they pay, returning False if the event is full. A user who already
+        holds a reservation has it extended rather than taking another space.
+        """
+        expires_at = timezone.now() + timedelta(seconds=settings.SIGNUP_RESERVATION_TTL)
+
+        try:
+            with transaction.atomic():
+                if self.filter(event=event, user=user).update(expires_at=expires_at):
+                    return True
+
+                # Expired reservations might be holding the last spaces so clear them out before giving up
+                if not event.reserve_place() and not (self.release_expired(event) and event.reserve_place()):
+                    return False
+
+                self.create(event=event, user=user, expires_at=expires_at)
+        except IntegrityError:
+            # A concurrent request from the same user has just made the reservation
+            pass
+
+        return True
+
+    def consume(self, event: Event, user):
+        """
+        Turn a user's reservation into their signup's space, returning False if they didn't hold one
+        """
+        deleted, _ = self.filter(event=event, user=user).delete()
+
+        return bool(deleted)
+
+    @transaction.atomic
+    def release_expired(self, event: Event = None):
+        """
+        Delete expired reservations and give their spaces back, returning how many were released
+        """
+        expired = self.select_for_update(skip_locked=True).filter(expires_at__lte=timezone.now())
+        if event:
+            expired = expired.filter(event=event)
+        expired = list(expired.values_list('id', 'event_id'))
+
+        if not expired:
+            return 0
+
+        self.filter(id__in=[reservation_id for reservation_id, _ in expired]).delete()
+        for event_id, released in Counter(event_id for _, event_id in expired).items():
+            Event.objects.filter(id=event_id).update(signup_count=Greatest(F('signup_count') - released, 0))
+
+        return len(expired)
+
+
+class SignupReservation(models.Model):
+    """
+    A space on an event held for a user who has started paying for a ticket. The space is counted in
+    Event.signup_count until the reservation is either turned into a signup or expires.
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = SignupReservationManager()
+
+    def __str__(self):
+        return '{user}\'s reservation for {event}'.format(user=self.user, event=self.event)
+
+    class Meta:
+        unique_together = ('event', 'user')
+
+
 class TicketManager(models.Manager):
     def for_event(self, event: Event):
-        return self.filter(eventsignup__event=event)
+        return self.filter(event=event)
+
+    def reusable_checkout(self, event: Event, user, amount):
+        """
+        The unpaid ticket a user already has for an event at a price, if its checkout session can still be used
+        """
+        return self.filter(event=event, user=user, amount=amount, status=Ticket.CREATED,
+                           expires_at__gt=timezone.now() + timedelta(seconds=settings.CHECKOUT_REUSE_MARGIN)) \
+            .exclude(checkout_session_id='').order_by('-expires_at').first()
+
+    def expire_stale(self):
+        """
+        Mark every unpaid ticket whose checkout session has expired as expired, returning how many there were.
+        Tickets from before checkout sessions were stored are expired once a session would have been.
+        """
+        now = timezone.now()
+        stale = self.filter(status=Ticket.CREATED).filter(
+            models.Q(expires_at__lte=now) |
+            models.Q(expires_at__isnull=True,
+                     created_at__lte=now - timedelta(seconds=settings.STRIPE_CHECKOUT_SESSION_TTL)))
+
+        return stale.update(status=Ticket.EXPIRED, last_updated_at=now)
 
     def is_complete(self):
         return self.filter(status=Ticket.COMPLETE)
@@ -159,16 +415,29 @@ class Ticket(models.Model):
     REFUNDED = 'R'
     IN_PROGRESS = 'P'
     CREATED = 'N'
+    EXPIRED = 'E'
 
     TICKET_STATUSES = (
         (COMPLETE, 'Complete'),
         (REFUNDED, 'Refunded'),
         (IN_PROGRESS, 'In progress'),
-        (CREATED, 'Created')
+        (CREATED, 'Created'),
+        (EXPIRED, 'Expired')
     )
 
+    # The order tickets move through their statuses in. Stripe doesn't send webhook events in order so a ticket
+    # never moves back to an earlier status. A payment that comes in after its ticket expired still counts.
+    STATUS_ORDER = (CREATED, EXPIRED, IN_PROGRESS, COMPLETE, REFUNDED)
+
     id = models.AutoField(primary_key=True)
     charge_id = models.TextField(blank=True)
+    payment_intent_id = models.CharField(max_length=255, blank=True, db_index=True)
+
+    # The checkout the ticket is being paid for through, which is reused until it expires
+    event = models.ForeignKey(Event, on_delete=models.SET_NULL, blank=True, null=True)
+    amount = models.DecimalField(decimal_places=2, max_digits=3, blank=True, null=True)
+    checkout_session_id = models.CharField(max_length=255, blank=True)
+    expires_at = models.DateTimeField(blank=True, null=True, db_index=True)
     status = models.CharField(
         max_length=1,
         choices=TICKET_STATUSES,
@@ -185,7 +454,18 @@ class Ticket(models.Model):
         return self.status == self.COMPLETE
 
     def is_valid(self):
-        return self.status != self.CREATED
+        return self.status not in (self.CREATED, self.EXPIRED)
+
+    def advance(self, status):
+        """
+        Move the ticket on to a later status, returning False (and leaving it alone) if it's already there or past it
+        """
+        if self.STATUS_ORDER.index(status) <= self.STATUS_ORDER.index(self.status):
+            return False
+
+        self.status = status
+        self.last_updated_at = timezone.now()
+        return True
 
     def __str__(self):
         return '<Ticket id={id} user={user} status={status}>'.format(status={
@@ -193,6 +473,7 @@ class Ticket(models.Model):
             self.IN_PROGRESS: 'IN_PROGRESS',
             self.REFUNDED: 'REFUNDED',
             self.CREATED: 'CREATED',
+            self.EXPIRED: 'EXPIRED',
         }[self.status], id=self.id, user=self.user)
 
     class Meta:
@@ -225,13 +506,30 @@ class EventSignup(models.Model):
 
     objects = EventSignupManager()
 
+    @transaction.atomic
+    def unsign_up(self):
+        """
+        Mark the signup as removed and give its space back to the event. This is safe to call more than once.
+        """
+        # Lock the signup so that an un-signup racing a refund only gives the space back once
+        if EventSignup.objects.select_for_update().values_list('is_unsigned_up', flat=True).get(id=self.id):
+            return False
+
+        self.is_unsigned_up = True
+        self.unsigned_up_at = timezone.now()
+        self.save(update_fields=['is_unsigned_up', 'unsigned_up_at'])
+        self.event.release_place()
+
+        return True
+
     @property
     def long_name(self):
         return self.profile.long_name
 
     @property
     def profile(self):
-        return WarwickGGUser.objects.get(user=self.user)
+        # Uses the profile loaded by select_related('user__warwickgguser') where there is one
+        return self.user.warwickgguser
 
     @property
     def tooltip(self):
@@ -253,6 +551,55 @@ class EventSignup(models.Model):
         ordering = ['created_at']
 
 
+class StripeWebhookEventManager(models.Manager):
+    def record(self, event):
+        """
+        Store a (verified) Stripe webhook event to be processed later, returning False if it has been seen before.
+        Stripe sends the same event again when it doesn't get a response in time, so this is what stops retries being
+        applied twice.
+        """
+        try:
+            with transaction.atomic():
+                _, created = self.get_or_create(stripe_id=event['id'], defaults={
+                    'type': event['type'],
+                    'payload': json.dumps(event),
+                })
+        except IntegrityError:
+            # A concurrent delivery of the same event has just been stored
+            created = False
+
+        return created
+
+    def pending(self):
+        return self.filter(processed_at__isnull=True, attempts__lt=settings.STRIPE_WEBHOOK_MAX_ATTEMPTS) \
+            .order_by('received_at', 'id')
+
+
+class StripeWebhookEvent(models.Model):
+    """
+    A webhook event received from Stripe. Events are acknowledged as soon as they are stored and applied by the
+    process_stripe_webhooks worker, so the webhook stays fast however slow the Stripe API calls made for them are.
+    """
+    stripe_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.TextField()
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    # How many times processing the event has failed, and why it last did
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    objects = StripeWebhookEventManager()
+
+    @property
+    def data(self):
+        return json.loads(self.payload)['data']['object']
+
+    def __str__(self):
+        return '<StripeWebhookEvent id={id} type={type}>'.format(id=self.stripe_id, type=self.type)
+
+
 class TournamentManager(models.Manager):
     def for_event(self, event):
         return self.filter(for_event=event)
@@ -345,7 +692,7 @@ class Tournament(models.Model):
     @property
     def signups(self):
         signups = TournamentSignup.objects.filter(tournament=self, is_unsigned_up=False).exclude(comment__exact='')\
-            .order_by('commented_at', '-created_at').all()
+            .select_related('user__warwickgguser').order_by('commented_at', '-created_at').all()
 
         return signups
 
@@ -378,7 +725,8 @@ class TournamentSignup(models.Model):
 
     @property
     def profile(self):
-        return WarwickGGUser.objects.get(user=self.user)
+        # Uses the profile loaded by select_related('user__warwickgguser') where there is one
+        return self.user.warwickgguser
 
     @property
     def tooltip(self):
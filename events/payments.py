@@ -0,0 +1,289 @@
+import json
+from datetime import datetime, timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from stripe.error import StripeError
+
+from events.models import Event, EventSignup, SignupReservation, StripeWebhookEvent, Ticket
+from seating.models import Seating
+
+
+class WebhookProcessingError(Exception):
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        # Whether trying again later could succeed, as opposed to the event never being applicable
+        self.retry = retry
+
+
+def get_stripe():
+    """
+    The Stripe client module set by STRIPE_CLIENT, which is either the stripe library or a stand-in for it
+    """
+    return import_module(settings.STRIPE_CLIENT)
+
+
+def checkout_session_for(event, user, amount):
+    """
+    The ID of a Stripe checkout session for a user to buy a ticket to an event. The session (and the unpaid ticket
+    it's for) is reused while it's still open so refreshing the signup page doesn't start a new one each time.
+    """
+    ticket = Ticket.objects.reusable_checkout(event, user, amount)
+    if ticket:
+        return ticket.checkout_session_id
+
+    ticket = Ticket.objects.create(user=user, event=event, amount=amount)
+
+    ticket_json = json.dumps({
+        'ticket': ticket.id,
+        'event': event.id,
+        'created_at': ticket.created_at.strftime('%Y-%m-%dT%H:%M:%S%z')
+    })
+
+    checkout_session = get_stripe().checkout.session.Session.create(
+        success_url='https://{base}/events/{slug}#signup'.format(base=settings.CHECKOUT_BASE_URL, slug=event.slug),
+        cancel_url='https://{base}/events/{slug}#signup'.format(base=settings.CHECKOUT_BASE_URL, slug=event.slug),
+        client_reference_id=ticket_json,
+        # Lets the payment's webhook events find the ticket even if they arrive before the checkout's
+        payment_intent_data={'metadata': {'ticket': ticket.id}},
+        customer_email=user.email,
+        payment_method_types=['card'],
+        line_items=[{
+            'name': '{title} ticket'.format(title=event.title),
+            'currency': 'gbp',
+            'amount': int(amount * 100),
+            'quantity': 1,
+            'description': 'A ticket to {title}, an event run by the Uni of Warwick Computing Society.'.format(
+                title=event.title)
+        }]
+    )
+
+    ticket.checkout_session_id = checkout_session.id
+    if checkout_session.get('expires_at'):
+        ticket.expires_at = datetime.fromtimestamp(checkout_session['expires_at'], tz=timezone.utc)
+    else:
+        ticket.expires_at = ticket.created_at + timedelta(seconds=settings.STRIPE_CHECKOUT_SESSION_TTL)
+    ticket.save(update_fields=['checkout_session_id', 'expires_at'])
+
+    return ticket.checkout_session_id
+
+
+class WebhookDeferred(WebhookProcessingError):
+    """
+    The event depends on one that hasn't arrived yet, like a charge for a checkout the site hasn't heard about
+    """
+    pass
+
+
+def refund(ticket):
+    # The idempotency key means a retried event can't refund the same ticket twice
+    idempotency_key = 'refund-ticket-{ticket}'.format(ticket=ticket.id)
+
+    if ticket.charge_id:
+        return get_stripe().Refund.create(charge=ticket.charge_id, idempotency_key=idempotency_key)
+    return get_stripe().Refund.create(payment_intent=ticket.payment_intent_id, idempotency_key=idempotency_key)
+
+
+def ticket_for_payment(payment_intent_id, charge_id=None, ticket_id=None):
+    """
+    Lock and return the ticket a payment is for, or raise WebhookDeferred if the checkout it came from hasn't been
+    seen yet
+    """
+    tickets = Ticket.objects.select_for_update()
+
+    ticket = tickets.filter(payment_intent_id=payment_intent_id).first() if payment_intent_id else None
+    if ticket is None and charge_id:
+        ticket = tickets.filter(charge_id=charge_id).first()
+    if ticket is None and ticket_id:
+        ticket = tickets.filter(id=ticket_id).first()
+
+    if ticket is None:
+        raise WebhookDeferred('No ticket has the payment {payment}'.format(payment=payment_intent_id or charge_id))
+
+    return ticket
+
+
+def charge_status(charge):
+    return Ticket.COMPLETE if charge['paid'] else Ticket.IN_PROGRESS
+
+
+def checkout_status(session):
+    """
+    The ticket status a completed checkout's payment is at. Checkout sessions from the API version the site is pinned
+    to don't have a payment_status, so the payment intent is asked instead. If Stripe can't be reached then the
+    payment's own payment_intent.succeeded and charge.succeeded events complete the ticket when they're processed.
+    """
+    if 'payment_status' in session:
+        return Ticket.COMPLETE if session['payment_status'] == 'paid' else Ticket.IN_PROGRESS
+
+    try:
+        payment_intent = get_stripe().PaymentIntent.retrieve(session['payment_intent'])
+    except StripeError:
+        return Ticket.IN_PROGRESS
+
+    return Ticket.COMPLETE if payment_intent['status'] == 'succeeded' else Ticket.IN_PROGRESS
+
+
+def checkout_completed(session):
+    try:
+        ticket_info = json.loads(session['client_reference_id'])
+        ticket_id, event_id = ticket_info['ticket'], ticket_info['event']
+        ticket_created_at = datetime.strptime(ticket_info['created_at'], '%Y-%m-%dT%H:%M:%S%z')
+    except (KeyError, TypeError, ValueError) as e:
+        # Checkouts started anywhere but the signup page don't say which ticket they're for
+        raise WebhookProcessingError('The checkout has no valid ticket reference: {error}'.format(error=e),
+                                     retry=False)
+
+    # If the ticket was created after the current time, then something screwy is going on
+    if ticket_created_at > timezone.now():
+        raise WebhookProcessingError('Ticket {ticket} was created in the future'.format(ticket=ticket_id),
+                                     retry=False)
+
+    try:
+        event = Event.objects.get(id__exact=event_id)
+        # Locking the ticket stops two workers applying the same checkout at once
+        ticket = Ticket.objects.select_for_update().select_related('user').get(id__exact=ticket_id)
+    except (Event.DoesNotExist, Ticket.DoesNotExist) as e:
+        raise WebhookProcessingError(str(e), retry=False)
+
+    if EventSignup.objects.filter(ticket=ticket).exists():
+        # The checkout has already been applied
+        return
+
+    user = ticket.user
+
+    # The payment's own events may have already said whether it has gone through, advance() keeps the later status
+    ticket.payment_intent_id = session['payment_intent']
+    ticket.advance(checkout_status(session))
+
+    if ticket.status == Ticket.REFUNDED:
+        # The payment was refunded before the checkout got here
+        ticket.save()
+        return
+
+    # The space was held when the user started the checkout, but if the reservation has expired they need to claim a
+    # new one
+    if SignupReservation.objects.consume(event, user) or event.reserve_place():
+        ticket.save()
+        EventSignup.objects.create(user=user, event=event, ticket=ticket)
+        return
+
+    # The event filled up while the user was paying, so they need their money back
+    try:
+        refund(ticket)
+    except StripeError as e:
+        raise WebhookProcessingError('Could not refund the payment: {error}'.format(error=e))
+
+    ticket.advance(Ticket.REFUNDED)
+    ticket.comment = 'Refunded at {time} because the event was full'.format(
+        time=timezone.now().strftime('%Y-%m-%dT%H:%M:%S%z'))
+    ticket.save()
+
+
+def payment_intent_succeeded(payment_intent):
+    # The ticket ID is put in the payment's metadata at the checkout, so this doesn't have to wait for the checkout
+    ticket = ticket_for_payment(payment_intent['id'], ticket_id=payment_intent.get('metadata', {}).get('ticket'))
+
+    ticket.payment_intent_id = payment_intent['id']
+    charges = payment_intent.get('charges', {}).get('data')
+    if charges and not ticket.charge_id:
+        ticket.charge_id = charges[0]['id']
+
+    ticket.advance(Ticket.COMPLETE)
+    ticket.save()
+
+
+def charge_succeeded(charge):
+    ticket = ticket_for_payment(charge.get('payment_intent'), charge_id=charge['id'])
+
+    ticket.charge_id = charge['id']
+    ticket.advance(charge_status(charge))
+    ticket.save()
+
+
+def charge_refunded(charge):
+    ticket = ticket_for_payment(charge.get('payment_intent'), charge_id=charge['id'])
+
+    ticket.charge_id = charge['id']
+    if ticket.advance(Ticket.REFUNDED):
+        ticket.comment = 'Refunded at {time}'.format(time=timezone.now().strftime('%Y-%m-%dT%H:%M:%S%z'))
+    ticket.save()
+
+    # A refunded ticket isn't a valid signup so free up the space if the refund didn't come from an un-signup on the
+    # site
+    try:
+        if ticket.signup.unsign_up():
+            Seating.objects.for_event(ticket.signup.event).filter(user=ticket.user).delete()
+    except EventSignup.DoesNotExist:
+        pass
+
+
+WEBHOOK_HANDLERS = {
+    'checkout.session.completed': checkout_completed,
+    'payment_intent.succeeded': payment_intent_succeeded,
+    'charge.succeeded': charge_succeeded,
+    'charge.refunded': charge_refunded,
+}
+
+
+def process_webhook_event(event_id):
+    """
+    Apply a stored webhook event, returning whether it was applied or None if another worker has already taken it.
+    Failures are recorded on the event, which is tried again later if the failure might not happen next time.
+    """
+    with transaction.atomic():
+        webhook_event = StripeWebhookEvent.objects.pending().select_for_update(skip_locked=True) \
+            .filter(id=event_id).first()
+        if webhook_event is None:
+            return None
+
+        handler = WEBHOOK_HANDLERS.get(webhook_event.type)
+        try:
+            if handler:
+                with transaction.atomic():
+                    handler(webhook_event.data)
+        except WebhookDeferred as e:
+            # Waiting doesn't count as an attempt, but the event is given up on if what it's waiting for never comes
+            webhook_event.last_error = str(e)
+            if webhook_event.received_at < timezone.now() - timedelta(seconds=settings.STRIPE_WEBHOOK_DEFER_FOR):
+                webhook_event.processed_at = timezone.now()
+            webhook_event.save(update_fields=['last_error', 'processed_at'])
+            return False
+        except WebhookProcessingError as e:
+            webhook_event.attempts += 1
+            webhook_event.last_error = str(e)
+            if not e.retry:
+                webhook_event.processed_at = timezone.now()
+            webhook_event.save(update_fields=['attempts', 'last_error', 'processed_at'])
+            return False
+        except Exception as e:
+            # A bug or a payload the handler didn't expect. It's recorded like any other failure so one bad event can't
+            # stop the worker, and pending() stops offering it after STRIPE_WEBHOOK_MAX_ATTEMPTS tries.
+            webhook_event.attempts += 1
+            webhook_event.last_error = '{type}: {error}'.format(type=type(e).__name__, error=e)
+            webhook_event.save(update_fields=['attempts', 'last_error'])
+            return False
+
+        webhook_event.processed_at = timezone.now()
+        webhook_event.save(update_fields=['processed_at'])
+
+    return True
+
+
+def process_pending_webhook_events(limit=None):
+    """
+    Apply the stored webhook events that haven't been processed yet in the order they arrived, returning a tuple of
+    how many were applied and how many failed or are waiting for other events
+    """
+    applied = failed = 0
+
+    for event_id in list(StripeWebhookEvent.objects.pending().values_list('id', flat=True)[:limit]):
+        result = process_webhook_event(event_id)
+        if result:
+            applied += 1
+        elif result is False:
+            failed += 1
+
+    return applied, failed
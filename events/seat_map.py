@@ -0,0 +1,246 @@
+import math
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+TABLE_ID = re.compile(r'^Table-\d+$')
+TRANSFORM = re.compile(r'(matrix|translate|scale|rotate)\s*\(([^)]*)\)')
+IDENTITY = (1, 0, 0, 1, 0, 0)
+# The longest seat ID that fits in Seating.seat_id
+MAX_SEAT_ID_LENGTH = 5
+
+
+class SeatMapError(Exception):
+    pass
+
+
+def multiply(m, n):
+    """
+    Compose two SVG affine transforms given as (a, b, c, d, e, f), applying n first
+    """
+    return (m[0] * n[0] + m[2] * n[1], m[1] * n[0] + m[3] * n[1],
+            m[0] * n[2] + m[2] * n[3], m[1] * n[2] + m[3] * n[3],
+            m[0] * n[4] + m[2] * n[5] + m[4], m[1] * n[4] + m[3] * n[5] + m[5])
+
+
+def parse_transform(transform):
+    """
+    Turn the value of an SVG transform attribute into a single affine transform
+    """
+    result = IDENTITY
+
+    for name, args in TRANSFORM.findall(transform or ''):
+        values = [float(value) for value in re.split(r'[\s,]+', args.strip()) if value]
+
+        if name == 'matrix' and len(values) == 6:
+            step = tuple(values)
+        elif name == 'translate' and values:
+            step = (1, 0, 0, 1, values[0], values[1] if len(values) > 1 else 0)
+        elif name == 'scale' and values:
+            step = (values[0], 0, 0, values[1] if len(values) > 1 else values[0], 0, 0)
+        elif name == 'rotate' and values:
+            angle = math.radians(values[0])
+            step = (math.cos(angle), math.sin(angle), -math.sin(angle), math.cos(angle), 0, 0)
+            if len(values) == 3:
+                # Rotating about a point is the same as moving it to the origin, rotating and moving it back
+                step = multiply(multiply((1, 0, 0, 1, values[1], values[2]), step),
+                                (1, 0, 0, 1, -values[1], -values[2]))
+        else:
+            raise SeatMapError('Unsupported transform {transform}'.format(transform=transform))
+
+        result = multiply(result, step)
+
+    return result
+
+
+def seat_centre(element):
+    """
+    The centre of a seat's shape in its own coordinates
+    """
+    if 'cx' in element.attrib:
+        return float(element.get('cx', 0)), float(element.get('cy', 0))
+
+    return (float(element.get('x', 0)) + float(element.get('width', 0)) / 2,
+            float(element.get('y', 0)) + float(element.get('height', 0)) / 2)
+
+
+def seat_order(seat_id):
+    """
+    A sort key putting seat IDs in the order they're numbered across the room, with any that aren't numbers last
+    """
+    return (int(seat_id), '') if seat_id.isdigit() else (math.inf, seat_id)
+
+
+def parse_seat_map(stream):
+    """
+    Find every seat (an element with a data-seat-id attribute) in a seating plan SVG and the table (a group with an
+    ID like "Table-1") it's on.
+
+    Tables are numbered in the order of their lowest seat ID, which is how the seats are numbered across the room.
+    If the plan has tables, any seats that aren't on one share an extra table. If it has none, every seat's table is
+    None and the tables have to be given with assign_tables.
+    Returns a list of (seat ID, table number, x, y) tuples where x and y are the centre of the seat on the plan
+    """
+    transforms = [IDENTITY]
+    # The index of the table each open element is in, or None if it isn't in one
+    tables = [None]
+    table_seats = []
+    loose_seats = []
+
+    try:
+        for event, element in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'end':
+                transforms.pop()
+                tables.pop()
+                continue
+
+            if len(transforms) == 1:
+                check_namespace(element)
+
+            transform = multiply(transforms[-1], parse_transform(element.get('transform')))
+            table = tables[-1]
+            if table is None and element.tag.endswith('}g') and TABLE_ID.match(element.get('id', '')):
+                table = len(table_seats)
+                table_seats.append([])
+
+            seat_id = element.get('data-seat-id')
+            if seat_id is not None:
+                if not seat_id or len(seat_id) > MAX_SEAT_ID_LENGTH:
+                    raise SeatMapError('Seat ID "{seat}" must be 1 to {n} characters'.format(seat=seat_id,
+                                                                                           n=MAX_SEAT_ID_LENGTH))
+                x, y = seat_centre(element)
+                (loose_seats if table is None else table_seats[table]).append(
+                    (seat_id, transform[0] * x + transform[2] * y + transform[4],
+                     transform[1] * x + transform[3] * y + transform[5]))
+
+            transforms.append(transform)
+            tables.append(table)
+    except (ET.ParseError, ValueError) as e:
+        raise SeatMapError('The seating plan is not a valid SVG') from e
+
+    def lowest_seat(seats):
+        return min(seat_order(seat_id) for seat_id, _, _ in seats)
+
+    table_seats = list(filter(None, table_seats))
+    seats = []
+    if table_seats:
+        for table, table_seat_list in enumerate(sorted(table_seats + list(filter(None, [loose_seats])),
+                                                       key=lowest_seat)):
+            seats.extend((seat_id, table, round(x, 2), round(y, 2)) for seat_id, x, y in table_seat_list)
+    else:
+        seats.extend((seat_id, None, round(x, 2), round(y, 2)) for seat_id, x, y in loose_seats)
+
+    seat_ids = [seat_id for seat_id, _, _, _ in seats]
+    if len(set(seat_ids)) != len(seat_ids):
+        raise SeatMapError('The seating plan has more than one seat with the same ID')
+
+    return seats
+
+
+def has_tables(seats):
+    """
+    Check if the seats from parse_seat_map were found on tables in the plan
+    """
+    return any(table is not None for _, table, _, _ in seats)
+
+
+def table_sizes(seats):
+    """
+    The number of seats on each table, in the same order as the tables, for seats which have tables
+    """
+    sizes = Counter(table for _, table, _, _ in seats)
+    return [sizes[table] for table in range(len(sizes))]
+
+
+def assign_tables(seats, sizes):
+    """
+    Put the seats from a plan without tables onto tables of the given sizes, in the order the seats are numbered.
+    Seats which are already on tables are returned as they are.
+    """
+    if has_tables(seats):
+        return seats
+
+    if sum(sizes) != len(seats):
+        raise SeatMapError('The seating plan has {n} seats but the tables have {total} between them'.format(
+            n=len(seats), total=sum(sizes)))
+
+    tables = [table for table, size in enumerate(sizes) for _ in range(size)]
+    ordered = sorted(seats, key=lambda seat: seat_order(seat[0]))
+
+    return [(seat_id, table, x, y) for (seat_id, _, x, y), table in zip(ordered, tables)]
+
+
+SVG_NAMESPACE = 'http://www.w3.org/2000/svg'
+XLINK_NAMESPACE = 'http://www.w3.org/1999/xlink'
+# Elements that only hold information for the editor the plan was drawn in
+METADATA_TAGS = {'{%s}%s' % (SVG_NAMESPACE, tag) for tag in ('desc', 'title', 'metadata')}
+NUMERIC_ATTRIBUTES = {'transform', 'x', 'y', 'width', 'height', 'rx', 'ry', 'cx', 'cy', 'r', 'x1', 'y1', 'x2', 'y2',
+                      'd', 'points', 'viewBox'}
+# A single number in an attribute. Path data can run numbers together, so "10.0.5" is 10.0 followed by .5
+NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+ET.register_namespace('', SVG_NAMESPACE)
+ET.register_namespace('xlink', XLINK_NAMESPACE)
+
+
+def check_namespace(root):
+    """
+    Make sure an SVG declares the SVG namespace, without which none of its elements would be recognised as SVG
+    """
+    if root.tag != '{%s}svg' % SVG_NAMESPACE:
+        raise SeatMapError('The seating plan must be an <svg> element with xmlns="{namespace}"'.format(
+            namespace=SVG_NAMESPACE))
+
+
+def trim_number(match):
+    """
+    Drop the trailing zeros from a number matched by NUMBER, leaving it alone if removing its decimal point would join
+    it to the number after it
+    """
+    number = match.group()
+    if '.' not in number or 'e' in number.lower():
+        return number
+
+    trimmed = number.rstrip('0')
+    if trimmed.endswith('.'):
+        if match.string[match.end():match.end() + 1] == '.':
+            return number
+        trimmed = trimmed[:-1]
+
+    return trimmed if trimmed.lstrip('+-') else trimmed + '0'
+
+
+def minify_svg(stream):
+    """
+    Strip comments, editor metadata and formatting from a seating plan SVG so it's as small as possible to inline in a
+    page. The seats, tables and an (empty) <defs> for the seating chart's avatars are kept.
+    Returns the SVG as a string without an XML declaration
+    """
+    try:
+        root = ET.parse(stream).getroot()
+    except ET.ParseError as e:
+        raise SeatMapError('The seating plan is not a valid SVG') from e
+    check_namespace(root)
+
+    for parent in root.iter():
+        for child in list(parent):
+            if child.tag in METADATA_TAGS or not child.tag.startswith('{%s}' % SVG_NAMESPACE):
+                parent.remove(child)
+
+    for element in root.iter():
+        for name in list(element.attrib):
+            if name.startswith('{') and not name.startswith('{%s}' % XLINK_NAMESPACE):
+                # Attributes in editor namespaces, like sketch:type
+                del element.attrib[name]
+            elif name in NUMERIC_ATTRIBUTES:
+                element.set(name, NUMBER.sub(trim_number, element.get(name)))
+
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+
+    if root.find('{%s}defs' % SVG_NAMESPACE) is None:
+        root.insert(0, ET.Element('{%s}defs' % SVG_NAMESPACE))
+
+    return ET.tostring(root, encoding='unicode', short_empty_elements=True)
@@ -0,0 +1,163 @@
+"""
+An in-memory stand-in for the parts of the Stripe API the site uses, so the checkout and webhook code can be run
+without talking to Stripe. Set STRIPE_CLIENT = 'events.stripe_stub' to use it.
+
+Webhook signatures are checked with the real (offline) stripe.Webhook, so payloads need signing with sign_payload.
+"""
+import hashlib
+import hmac
+import itertools
+import json
+import time
+from types import SimpleNamespace
+
+from stripe import Webhook, error  # noqa: F401 - the webhook view uses these through the client module
+from stripe.stripe_object import StripeObject
+
+_ids = itertools.count(1)
+
+payment_intents = {}
+checkout_sessions = {}
+# Refunds are keyed by their idempotency key, like Stripe does, so a retried refund returns the original one
+refunds = {}
+
+
+def reset():
+    payment_intents.clear()
+    checkout_sessions.clear()
+    refunds.clear()
+
+
+def new_id(prefix):
+    return '{prefix}_stub{n}'.format(prefix=prefix, n=next(_ids))
+
+
+def charges():
+    return [charge for intent in payment_intents.values() for charge in intent['charges']['data']]
+
+
+def create_payment(ticket=None, paid=True, amount=500):
+    """
+    Make a payment intent with a single charge (of amount pence, unless the ticket has a price), as if the user had
+    just paid at the checkout for a ticket.
+    Returns a tuple of the payment intent and its charge, for use in webhook events
+    """
+    intent_id = new_id('pi')
+    if ticket and ticket.amount is not None:
+        amount = int(ticket.amount * 100)
+    charge = {'id': new_id('ch'), 'object': 'charge', 'amount': amount, 'paid': paid, 'refunded': False,
+              'payment_intent': intent_id, 'created': int(time.time())}
+    payment_intents[intent_id] = {
+        'id': intent_id,
+        'object': 'payment_intent',
+        'status': 'succeeded' if paid else 'processing',
+        'metadata': {'ticket': ticket.id} if ticket else {},
+        'charges': {'object': 'list', 'data': [charge]},
+    }
+
+    return payment_intents[intent_id], charge
+
+
+def list_page(objects, created=None, limit=10, starting_after=None):
+    """
+    One page of a list API response, newest first like Stripe's
+    """
+    created = created or {}
+    objects = sorted((obj for obj in objects if
+                      created.get('gte', -1) <= obj['created'] < created.get('lt', float('inf'))),
+                     key=lambda obj: obj['created'], reverse=True)
+
+    if starting_after:
+        ids = [obj['id'] for obj in objects]
+        objects = objects[ids.index(starting_after) + 1:]
+
+    return StripeObject.construct_from({'object': 'list', 'data': objects[:limit], 'has_more': len(objects) > limit},
+                                       None)
+
+
+def webhook_event(event_type, data):
+    return {
+        'id': new_id('evt'),
+        'object': 'event',
+        'type': event_type,
+        'created': int(time.time()),
+        'data': {'object': data},
+    }
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """
+    The Stripe-Signature header Stripe would send with a webhook payload
+    """
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode('utf-8'), '{t}.{payload}'.format(t=timestamp, payload=payload).encode('utf-8'),
+                         hashlib.sha256).hexdigest()
+
+    return 't={t},v1={signature}'.format(t=timestamp, signature=signature)
+
+
+def signed_webhook(event, secret):
+    """
+    A webhook payload for an event and its signature header
+    """
+    payload = json.dumps(event)
+    return payload, sign_payload(payload, secret)
+
+
+class Refund:
+    @staticmethod
+    def create(charge=None, payment_intent=None, idempotency_key=None, **kwargs):
+        if payment_intent and not charge:
+            try:
+                charge = payment_intents[payment_intent]['charges']['data'][0]['id']
+            except KeyError:
+                raise error.InvalidRequestError('No such payment_intent: {id}'.format(id=payment_intent),
+                                                'payment_intent')
+
+        key = idempotency_key or new_id('idempotency')
+        if key not in refunds:
+            refunded = next((refunded for refunded in charges() if refunded['id'] == charge), {})
+            refunded['refunded'] = True
+            refunds[key] = StripeObject.construct_from({
+                'id': new_id('re'),
+                'object': 'refund',
+                'charge': charge,
+                'payment_intent': refunded.get('payment_intent'),
+                'status': 'succeeded',
+                'created': int(time.time()),
+            }, None)
+
+        return refunds[key]
+
+    @staticmethod
+    def list(**kwargs):
+        return list_page(refunds.values(), **kwargs)
+
+
+class Charge:
+    @staticmethod
+    def list(**kwargs):
+        return list_page(charges(), **kwargs)
+
+
+class PaymentIntent:
+    @staticmethod
+    def retrieve(intent_id, **kwargs):
+        if intent_id not in payment_intents:
+            raise error.InvalidRequestError('No such payment_intent: {id}'.format(id=intent_id), 'id')
+
+        return StripeObject.construct_from(payment_intents[intent_id], None)
+
+
+class Session:
+    @staticmethod
+    def create(**kwargs):
+        session_id = new_id('cs')
+        checkout_sessions[session_id] = StripeObject.construct_from(dict(kwargs, id=session_id,
+                                                                         object='checkout.session'), None)
+
+        return checkout_sessions[session_id]
+
+
+# Mirrors stripe.checkout.session.Session
+checkout = SimpleNamespace(session=SimpleNamespace(Session=Session))
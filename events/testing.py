@@ -0,0 +1,42 @@
+"""
+Helpers for making the objects most tests need, shared by every app's tests
+"""
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.text import slugify
+
+from events.models import Event
+from uwcs_auth.models import WarwickGGUser
+
+
+def make_event(title='LAN', **kwargs):
+    """
+    Create an event a week away which is open for signups, with any of its fields overridden
+    """
+    now = timezone.now()
+    fields = {
+        'title': title,
+        'slug': slugify(title),
+        'start': now + timedelta(days=7),
+        'end': now + timedelta(days=8),
+        'signup_start': now - timedelta(days=1),
+        'signup_end': now + timedelta(days=6),
+        'signup_limit': 10,
+        'cost_member': 5,
+        'cost_non_member': 5,
+    }
+    fields.update(kwargs)
+
+    return Event.objects.create(**fields)
+
+
+def make_user(username, **kwargs):
+    """
+    Create a user with a warwick.gg profile, with any of the profile's fields overridden
+    """
+    user = User.objects.create(username=username)
+    WarwickGGUser.objects.create(user=user, **dict({'uni_id': 'u{id:07d}'.format(id=user.id)}, **kwargs))
+
+    return user
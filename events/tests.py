@@ -1,3 +1,743 @@
-from django.test import TestCase
+import csv
+import json
+import os
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from events import stripe_stub
+from events.admin import EventAdmin
+from events.forms import SeatingRoomForm
+from events.models import Event, EventSignup, SeatingRoom, SignupReservation, SocietyMembership, StripeWebhookEvent, \
+    Ticket
+from events.payments import checkout_session_for, process_pending_webhook_events
+from events.seat_map import SeatMapError, minify_svg, parse_seat_map, table_sizes
+from events.testing import make_event, make_user
+from events.views import unchecked_societies
+from uwcs_auth.models import WarwickGGUser
+
+
+SHIPPED_SEATING_PLANS = [os.path.join(settings.BASE_DIR, 'seating', 'templates', name) for name in
+                         ('bfl-seating-optimised.svg', 'compsoc-seating.svg', 'freshers-seating.svg')]
+
+
+def checkout_event(ticket, payment_intent):
+    return stripe_stub.webhook_event('checkout.session.completed', {
+        'client_reference_id': json.dumps({
+            'ticket': ticket.id,
+            'event': ticket.event_id,
+            'created_at': (timezone.now() - timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%S%z'),
+        }),
+        'payment_intent': payment_intent['id'],
+    })
+
+
+@override_settings(STRIPE_CLIENT='events.stripe_stub', STRIPE_WEBHOOK_MAX_ATTEMPTS=3)
+class StripeWebhookProcessingTestCase(TestCase):
+    def setUp(self):
+        stripe_stub.reset()
+        self.event = make_event()
+        self.user = User.objects.create(username='payer')
+        self.ticket = Ticket.objects.create(user=self.user, event=self.event, amount=5)
+
+    def test_checkout_is_applied_once(self):
+        payment_intent, _ = stripe_stub.create_payment(self.ticket)
+        webhook_event = checkout_event(self.ticket, payment_intent)
+
+        self.assertTrue(StripeWebhookEvent.objects.record(webhook_event))
+        self.assertFalse(StripeWebhookEvent.objects.record(webhook_event))
+        self.assertEqual(process_pending_webhook_events(), (1, 0))
+        self.assertEqual(process_pending_webhook_events(), (0, 0))
+        self.assertEqual(EventSignup.objects.filter(ticket=self.ticket).count(), 1)
+
+    def test_checkout_without_ticket_reference_is_given_up_on(self):
+        StripeWebhookEvent.objects.record(stripe_stub.webhook_event('checkout.session.completed',
+                                                                    {'payment_intent': 'pi_elsewhere'}))
+        payment_intent, _ = stripe_stub.create_payment(self.ticket)
+        StripeWebhookEvent.objects.record(checkout_event(self.ticket, payment_intent))
+
+        self.assertEqual(process_pending_webhook_events(), (1, 1))
+
+        poison = StripeWebhookEvent.objects.get(last_error__contains='ticket reference')
+        self.assertIsNotNone(poison.processed_at)
+        self.assertEqual(poison.attempts, 1)
+        self.assertTrue(EventSignup.objects.filter(ticket=self.ticket).exists())
+
+    def test_unexpected_error_does_not_block_the_queue(self):
+        # A charge without an ID makes the handler raise a KeyError
+        StripeWebhookEvent.objects.record(stripe_stub.webhook_event('charge.succeeded', {'paid': True}))
+        payment_intent, _ = stripe_stub.create_payment(self.ticket)
+        StripeWebhookEvent.objects.record(checkout_event(self.ticket, payment_intent))
+
+        self.assertEqual(process_pending_webhook_events(), (1, 1))
+
+        poison = StripeWebhookEvent.objects.get(type='charge.succeeded')
+        self.assertEqual(poison.attempts, 1)
+        self.assertIn('KeyError', poison.last_error)
+        self.assertTrue(EventSignup.objects.filter(ticket=self.ticket).exists())
+
+        # It's tried until it runs out of attempts and then left alone
+        self.assertEqual(process_pending_webhook_events(), (0, 1))
+        self.assertEqual(process_pending_webhook_events(), (0, 1))
+        self.assertEqual(process_pending_webhook_events(), (0, 0))
+        self.assertEqual(StripeWebhookEvent.objects.get(type='charge.succeeded').attempts, 3)
+
+
+@override_settings(STRIPE_CLIENT='events.stripe_stub')
+class SignupPageTestCase(TestCase):
+    def setUp(self):
+        stripe_stub.reset()
+        self.event = make_event(signup_limit=2)
+        self.user = make_user('payer')
+        self.client.force_login(self.user)
+
+    def test_reload_while_payment_is_processing_does_not_take_another_space(self):
+        # The checkout has completed and used the user's reservation, but the payment hasn't been confirmed
+        self.assertTrue(self.event.reserve_place())
+        ticket = Ticket.objects.create(user=self.user, event=self.event, amount=5, status=Ticket.IN_PROGRESS)
+        EventSignup.objects.create(user=self.user, event=self.event, ticket=ticket)
+
+        response = self.client.get(reverse('event_signup', kwargs={'slug': self.event.slug}))
+
+        self.assertRedirects(response, reverse('event_home', kwargs={'slug': self.event.slug}),
+                             fetch_redirect_response=False)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.signup_count, 1)
+        self.assertFalse(SignupReservation.objects.exists())
+        self.assertEqual(Ticket.objects.count(), 1)
+        self.assertEqual(stripe_stub.checkout_sessions, {})
+
+@override_settings(STRIPE_CLIENT='events.stripe_stub')
+class StripeWebhookOrderingTestCase(TestCase):
+    """
+    Stripe doesn't promise to deliver a payment's webhook events in order, or only once
+    """
+    def setUp(self):
+        stripe_stub.reset()
+        self.event = make_event()
+        self.user = User.objects.create(username='payer')
+        self.ticket = Ticket.objects.create(user=self.user, event=self.event, amount=5)
+
+    def deliver(self, *webhook_events):
+        for webhook_event in webhook_events:
+            StripeWebhookEvent.objects.record(webhook_event)
+
+        return process_pending_webhook_events()
+
+    def assert_signed_up(self, status=Ticket.COMPLETE):
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.status, status)
+        self.assertEqual(EventSignup.objects.filter(ticket=self.ticket).count(), 1)
+
+    def test_checkout_then_charge(self):
+        payment_intent, charge = stripe_stub.create_payment(self.ticket, paid=False)
+
+        # The session has no payment_status, so the payment intent says the payment is still going through
+        self.assertEqual(self.deliver(checkout_event(self.ticket, payment_intent)), (1, 0))
+        self.assert_signed_up(Ticket.IN_PROGRESS)
+
+        charge['paid'] = True
+        self.assertEqual(self.deliver(stripe_stub.webhook_event('charge.succeeded', charge)), (1, 0))
+        self.assert_signed_up()
+        self.assertEqual(self.ticket.charge_id, charge['id'])
+
+    def test_paid_checkout_completes_the_ticket(self):
+        payment_intent, _ = stripe_stub.create_payment(self.ticket)
+
+        self.assertEqual(self.deliver(checkout_event(self.ticket, payment_intent)), (1, 0))
+        self.assert_signed_up()
+
+    def test_charge_then_checkout(self):
+        payment_intent, charge = stripe_stub.create_payment(self.ticket)
+
+        # The charge waits for the checkout, which arrives in the same batch
+        self.assertEqual(self.deliver(stripe_stub.webhook_event('charge.succeeded', charge),
+                                      checkout_event(self.ticket, payment_intent)), (1, 1))
+        self.assert_signed_up()
+
+        self.assertEqual(process_pending_webhook_events(), (1, 0))
+        self.assert_signed_up()
+        self.assertEqual(self.ticket.charge_id, charge['id'])
+
+    def test_payment_intent_then_checkout(self):
+        payment_intent, _ = stripe_stub.create_payment(self.ticket)
+
+        # The ticket ID in the payment's metadata means this doesn't have to wait
+        self.assertEqual(self.deliver(stripe_stub.webhook_event('payment_intent.succeeded', payment_intent)), (1, 0))
+        self.ticket.refresh_from_db()
+        self.assertEqual(self.ticket.status, Ticket.COMPLETE)
+
+        self.assertEqual(self.deliver(checkout_event(self.ticket, payment_intent)), (1, 0))
+        self.assert_signed_up()
+
+    def test_duplicate_deliveries(self):
+        payment_intent, charge = stripe_stub.create_payment(self.ticket)
+        checkout = checkout_event(self.ticket, payment_intent)
+        charge_succeeded = stripe_stub.webhook_event('charge.succeeded', charge)
+
+        self.assertEqual(self.deliver(checkout, charge_succeeded, checkout, charge_succeeded), (2, 0))
+        # Stripe sometimes sends the same change as a new event
+        self.assertEqual(self.deliver(checkout_event(self.ticket, payment_intent),
+                                      stripe_stub.webhook_event('charge.succeeded', charge)), (2, 0))
+
+        self.assert_signed_up()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.signup_count, 1)
+
+
+@override_settings(STRIPE_CLIENT='events.stripe_stub')
+class TicketCheckoutTestCase(TestCase):
+    def setUp(self):
+        stripe_stub.reset()
+        self.event = make_event()
+        self.user = User.objects.create(username='user', email='user@example.com')
+
+    def test_refreshing_reuses_the_open_checkout(self):
+        session_id = checkout_session_for(self.event, self.user, 5)
+
+        self.assertEqual(checkout_session_for(self.event, self.user, 5), session_id)
+        self.assertEqual(len(stripe_stub.checkout_sessions), 1)
+        self.assertEqual(Ticket.objects.get().checkout_session_id, session_id)
+
+    def test_new_checkout_for_a_different_price(self):
+        session_id = checkout_session_for(self.event, self.user, 5)
+
+        self.assertNotEqual(checkout_session_for(self.event, self.user, 3), session_id)
+        self.assertEqual(Ticket.objects.count(), 2)
+
+    @override_settings(CHECKOUT_REUSE_MARGIN=600)
+    def test_new_checkout_when_the_open_one_is_about_to_expire(self):
+        session_id = checkout_session_for(self.event, self.user, 5)
+        Ticket.objects.update(expires_at=timezone.now() + timedelta(seconds=60))
+
+        self.assertNotEqual(checkout_session_for(self.event, self.user, 5), session_id)
+
+    def test_new_checkout_once_the_ticket_is_paid_for(self):
+        session_id = checkout_session_for(self.event, self.user, 5)
+        Ticket.objects.update(status=Ticket.IN_PROGRESS)
+
+        self.assertNotEqual(checkout_session_for(self.event, self.user, 5), session_id)
+
+    @override_settings(STRIPE_CHECKOUT_SESSION_TTL=3600)
+    def test_stale_tickets_expire(self):
+        now = timezone.now()
+        stale = Ticket.objects.create(user=self.user, event=self.event, amount=5, expires_at=now - timedelta(minutes=1))
+        open_ticket = Ticket.objects.create(user=self.user, event=self.event, amount=5,
+                                            expires_at=now + timedelta(minutes=1))
+        # From before checkout sessions were stored on tickets
+        old = Ticket.objects.create(user=self.user, event=self.event, amount=5, created_at=now - timedelta(hours=2))
+        recent = Ticket.objects.create(user=self.user, event=self.event, amount=5, created_at=now)
+        paid = Ticket.objects.create(user=self.user, event=self.event, amount=5, status=Ticket.COMPLETE,
+                                     expires_at=now - timedelta(minutes=1))
+
+        self.assertEqual(Ticket.objects.expire_stale(), 2)
+
+        statuses = dict(Ticket.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[stale.id], Ticket.EXPIRED)
+        self.assertEqual(statuses[old.id], Ticket.EXPIRED)
+        self.assertEqual(statuses[open_ticket.id], Ticket.CREATED)
+        self.assertEqual(statuses[recent.id], Ticket.CREATED)
+        self.assertEqual(statuses[paid.id], Ticket.COMPLETE)
+
+    def test_expire_stale_tickets_command(self):
+        Ticket.objects.create(user=self.user, event=self.event, amount=5,
+                              expires_at=timezone.now() - timedelta(minutes=1))
+        stdout = StringIO()
+
+        call_command('expire_stale_tickets', stdout=stdout)
+
+        self.assertIn('Expired 1 ticket(s)', stdout.getvalue())
+        self.assertEqual(Ticket.objects.get().status, Ticket.EXPIRED)
+
+    def test_advance_never_moves_backwards(self):
+        for earlier, later in zip(Ticket.STATUS_ORDER, Ticket.STATUS_ORDER[1:]):
+            ticket = Ticket(user=self.user, status=later)
+
+            self.assertFalse(ticket.advance(earlier))
+            self.assertFalse(ticket.advance(later))
+            self.assertEqual(ticket.status, later)
+
+    def test_advance_skips_forwards(self):
+        ticket = Ticket(user=self.user)
+
+        self.assertTrue(ticket.advance(Ticket.COMPLETE))
+        self.assertEqual(ticket.status, Ticket.COMPLETE)
+
+        # A payment that arrives after the ticket expired still counts
+        ticket = Ticket(user=self.user, status=Ticket.EXPIRED)
+        self.assertTrue(ticket.advance(Ticket.IN_PROGRESS))
+        self.assertEqual(ticket.status, Ticket.IN_PROGRESS)
+
+class SeatingRevisionNumberTestCase(TestCase):
+    def test_numbers_are_sequential_per_event(self):
+        lan, other = make_event(), make_event('Other LAN')
+
+        self.assertEqual([lan.next_seating_revision_number() for _ in range(3)], [0, 1, 2])
+        self.assertEqual(other.next_seating_revision_number(), 0)
+        self.assertEqual(lan.next_seating_revision_number(), 3)
+
+    def test_saving_a_stale_event_keeps_the_count(self):
+        event = make_event()
+        stale = Event.objects.get(id=event.id)
+        event.next_seating_revision_number()
+        event.next_seating_revision_number()
+
+        stale.title = 'Renamed LAN'
+        stale.save()
+
+        self.assertEqual(Event.objects.get(id=event.id).seating_revision_count, 2)
+        self.assertEqual(event.next_seating_revision_number(), 2)
+
+class ReconcileSignupCountsTestCase(TestCase):
+    def setUp(self):
+        self.event = make_event(signup_limit=2)
+        self.users = [User.objects.create(username='user{n}'.format(n=n)) for n in range(3)]
+
+    def reconcile(self, *args):
+        call_command('reconcile_signup_counts', *args, stdout=StringIO())
+        self.event.refresh_from_db()
+
+    def test_drifted_count_is_repaired(self):
+        EventSignup.objects.create(user=self.users[0], event=self.event)
+        Event.objects.filter(id=self.event.id).update(signup_count=5)
+
+        self.reconcile('--dry-run')
+        self.assertEqual(self.event.signup_count, 5)
+
+        self.reconcile()
+        self.assertEqual(self.event.signup_count, 1)
+
+    def test_held_spaces_are_kept(self):
+        self.assertTrue(SignupReservation.objects.reserve(self.event, self.users[0]))
+        self.assertTrue(self.event.reserve_place())
+        EventSignup.objects.create(user=self.users[1], event=self.event)
+
+        self.reconcile()
+        self.assertEqual(self.event.signup_count, 2)
+
+        # The event is still full so nobody else can take the reserved space
+        self.assertFalse(SignupReservation.objects.reserve(self.event, self.users[2]))
+
+    def test_expired_reservations_are_released(self):
+        SignupReservation.objects.reserve(self.event, self.users[0])
+        SignupReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.reconcile()
+        self.assertEqual(self.event.signup_count, 0)
+        self.assertFalse(SignupReservation.objects.exists())
+
+
+
+class SignupReservationTestCase(TestCase):
+    def setUp(self):
+        self.event = make_event(signup_limit=2)
+        self.users = [User.objects.create(username='user{n}'.format(n=n)) for n in range(3)]
+
+    def signup_count(self):
+        self.event.refresh_from_db()
+        return self.event.signup_count
+
+    def expire(self, user):
+        SignupReservation.objects.filter(user=user).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_reserving_holds_a_space(self):
+        self.assertTrue(SignupReservation.objects.reserve(self.event, self.users[0]))
+
+        self.assertEqual(self.signup_count(), 1)
+        self.assertGreater(SignupReservation.objects.get().expires_at, timezone.now())
+
+    @override_settings(SIGNUP_RESERVATION_TTL=600)
+    def test_reserving_again_extends_instead_of_double_counting(self):
+        SignupReservation.objects.reserve(self.event, self.users[0])
+        SignupReservation.objects.update(expires_at=timezone.now() + timedelta(seconds=5))
+
+        self.assertTrue(SignupReservation.objects.reserve(self.event, self.users[0]))
+
+        self.assertEqual(self.signup_count(), 1)
+        self.assertEqual(SignupReservation.objects.count(), 1)
+        self.assertGreater(SignupReservation.objects.get().expires_at, timezone.now() + timedelta(seconds=500))
+
+    def test_full_event_cannot_be_reserved(self):
+        SignupReservation.objects.reserve(self.event, self.users[0])
+        SignupReservation.objects.reserve(self.event, self.users[1])
+
+        self.assertFalse(SignupReservation.objects.reserve(self.event, self.users[2]))
+        self.assertEqual(self.signup_count(), 2)
+        self.assertFalse(SignupReservation.objects.filter(user=self.users[2]).exists())
+
+    def test_expired_reservation_space_is_given_to_the_next_user(self):
+        SignupReservation.objects.reserve(self.event, self.users[0])
+        SignupReservation.objects.reserve(self.event, self.users[1])
+        self.expire(self.users[0])
+
+        self.assertTrue(SignupReservation.objects.reserve(self.event, self.users[2]))
+        self.assertEqual(self.signup_count(), 2)
+        self.assertFalse(SignupReservation.objects.filter(user=self.users[0]).exists())
+
+    def test_release_expired(self):
+        other_event = make_event('Other LAN')
+        SignupReservation.objects.reserve(self.event, self.users[0])
+        SignupReservation.objects.reserve(self.event, self.users[1])
+        SignupReservation.objects.reserve(other_event, self.users[0])
+        self.expire(self.users[0])
+
+        self.assertEqual(SignupReservation.objects.release_expired(self.event), 1)
+        self.assertEqual(self.signup_count(), 1)
+        self.assertTrue(SignupReservation.objects.filter(event=other_event).exists())
+
+        self.assertEqual(SignupReservation.objects.release_expired(), 1)
+        self.assertEqual(SignupReservation.objects.release_expired(), 0)
+        other_event.refresh_from_db()
+        self.assertEqual(other_event.signup_count, 0)
+
+    def test_release_expired_reservations_command(self):
+        SignupReservation.objects.reserve(self.event, self.users[0])
+        SignupReservation.objects.reserve(self.event, self.users[1])
+        self.expire(self.users[0])
+        stdout = StringIO()
+
+        call_command('release_expired_reservations', stdout=stdout)
+
+        self.assertIn('Released 1 expired reservation(s)', stdout.getvalue())
+        self.assertEqual(self.signup_count(), 1)
+        self.assertEqual(list(SignupReservation.objects.values_list('user', flat=True)), [self.users[1].id])
+
+    def test_consume(self):
+        SignupReservation.objects.reserve(self.event, self.users[0])
+
+        self.assertTrue(SignupReservation.objects.consume(self.event, self.users[0]))
+        self.assertFalse(SignupReservation.objects.consume(self.event, self.users[0]))
+
+        # The space now belongs to the signup so is still counted
+        self.assertEqual(self.signup_count(), 1)
+
+@override_settings(STRIPE_CLIENT='events.stripe_stub')
+class ReconcileTicketsTestCase(TestCase):
+    def setUp(self):
+        stripe_stub.reset()
+        self.event = make_event()
+        self.users = [User.objects.create(username='user{n}'.format(n=n)) for n in range(3)]
+
+        # Paid for, but the webhooks never arrived
+        self.behind = Ticket.objects.create(user=self.users[0], event=self.event, amount=5, status=Ticket.IN_PROGRESS)
+        payment_intent, _ = stripe_stub.create_payment(self.behind)
+        Ticket.objects.filter(id=self.behind.id).update(payment_intent_id=payment_intent['id'])
+
+        # Refunded in the Stripe dashboard
+        self.refunded = Ticket.objects.create(user=self.users[1], event=self.event, amount=5, status=Ticket.COMPLETE)
+        _, charge = stripe_stub.create_payment(self.refunded)
+        Ticket.objects.filter(id=self.refunded.id).update(charge_id=charge['id'])
+        self.signup = EventSignup.objects.create(user=self.users[1], event=self.event, ticket=self.refunded)
+        stripe_stub.Refund.create(charge=charge['id'])
+
+        # Paid for as far as the site knows, but Stripe has never seen it
+        self.unpaid = Ticket.objects.create(user=self.users[2], event=self.event, amount=5, status=Ticket.COMPLETE,
+                                            charge_id='ch_unknown')
+        EventSignup.objects.create(user=self.users[2], event=self.event, ticket=self.unpaid)
+
+        # A payment taken somewhere other than the signup page
+        stripe_stub.create_payment()
+
+    def reconcile(self, *args):
+        stdout = StringIO()
+        call_command('reconcile_tickets', *args, stdout=stdout)
+
+        lines = stdout.getvalue().splitlines()
+        return {(problem, ticket) for problem, _, ticket, _ in (line.split('\t') for line in lines[:-1])}, lines[-1]
+
+    def test_report_without_fixing(self):
+        report, summary = self.reconcile()
+
+        self.assertEqual(report, {
+            ('status', 'ticket={id}'.format(id=self.behind.id)),
+            ('missing_signup', 'ticket={id}'.format(id=self.behind.id)),
+            ('status', 'ticket={id}'.format(id=self.refunded.id)),
+            ('refunded_signup', 'ticket={id}'.format(id=self.refunded.id)),
+            ('missing_payment', 'ticket={id}'.format(id=self.unpaid.id)),
+            ('missing_ticket', 'ticket=-'),
+        })
+        self.assertIn('Checked 3 payment(s), found 6 discrepancies', summary)
+
+        self.behind.refresh_from_db()
+        self.assertEqual(self.behind.status, Ticket.IN_PROGRESS)
+        self.signup.refresh_from_db()
+        self.assertFalse(self.signup.is_unsigned_up)
+
+    def test_fix_brings_tickets_up_to_date(self):
+        self.reconcile('--fix')
+
+        self.behind.refresh_from_db()
+        self.assertEqual(self.behind.status, Ticket.COMPLETE)
+        self.assertTrue(self.behind.charge_id)
+        self.refunded.refresh_from_db()
+        self.assertEqual(self.refunded.status, Ticket.REFUNDED)
+        self.signup.refresh_from_db()
+        self.assertTrue(self.signup.is_unsigned_up)
+
+        # Only what the site can't fix by itself is left
+        report, _ = self.reconcile()
+        self.assertEqual(report, {
+            ('missing_signup', 'ticket={id}'.format(id=self.behind.id)),
+            ('missing_payment', 'ticket={id}'.format(id=self.unpaid.id)),
+            ('missing_ticket', 'ticket=-'),
+        })
+
+
+@override_settings(SU_MEMBERSHIP_API_KEYS={'WE': 'key'}, SU_MEMBERSHIP_SYNC_MAX_AGE=60 * 60)
+class SyncMembershipsTestCase(TestCase):
+    def setUp(self):
+        self.event = make_event(hosted_by=['UWCS', 'WE'], cost_member=0)
+
+    def test_members_are_found_once_synced(self):
+        self.assertEqual(unchecked_societies(self.event), ['Warwick Esports'])
+
+        call_command('sync_memberships', society='WE', file='events/fixtures/su_list_members.xml', stdout=StringIO())
+
+        self.assertTrue(SocietyMembership.objects.is_member('WE', 'u1800001'))
+        self.assertTrue(SocietyMembership.objects.is_member('WE', '1900003'))
+        self.assertFalse(SocietyMembership.objects.is_member('WE', '1800004'))
+        self.assertEqual(unchecked_societies(self.event), [])
+
+    def test_out_of_date_list_is_unchecked(self):
+        call_command('sync_memberships', society='WE', file='events/fixtures/su_list_members.xml', stdout=StringIO())
+        SocietyMembership.objects.update(synced_at=timezone.now() - timedelta(hours=2))
+
+        self.assertFalse(SocietyMembership.objects.is_synced('WE'))
+        self.assertEqual(unchecked_societies(self.event), ['Warwick Esports'])
+
+
+class ReconcileRecordedTicketsTestCase(TestCase):
+    """
+    Runs reconcile_tickets over the recorded Stripe responses in events/fixtures/stripe_reconciliation.json
+    """
+    FIXTURE = os.path.join(settings.BASE_DIR, 'events', 'fixtures', 'stripe_reconciliation.json')
+
+    def setUp(self):
+        self.event = make_event()
+        # The day the fixture's payments were made
+        created_at = timezone.make_aware(datetime(2019, 10, 18, 12))
+
+        def ticket(n, status, signed_up=True, **kwargs):
+            user = User.objects.create(username='user{n}'.format(n=n))
+            ticket = Ticket.objects.create(user=user, event=self.event, amount=5, status=status, created_at=created_at,
+                                           **kwargs)
+            if signed_up:
+                EventSignup.objects.create(user=user, event=self.event, ticket=ticket)
+            return ticket
+
+        self.tickets = {
+            'matching': ticket(1, Ticket.COMPLETE, payment_intent_id='pi_1FV0001Reconcile'),
+            'behind': ticket(2, Ticket.IN_PROGRESS, charge_id='ch_1FV0002Reconcile'),
+            'unsigned': ticket(3, Ticket.COMPLETE, signed_up=False, charge_id='ch_1FV0003Reconcile'),
+            'refunded': ticket(4, Ticket.COMPLETE, charge_id='ch_1FV0004Reconcile'),
+            'underpaid': ticket(5, Ticket.COMPLETE, payment_intent_id='pi_1FV0005Reconcile'),
+            'ahead': ticket(6, Ticket.COMPLETE, charge_id='ch_1FV0006Reconcile'),
+            'unpaid': ticket(7, Ticket.COMPLETE, charge_id='ch_1FV0008Reconcile'),
+        }
+
+    def reconcile(self, *args):
+        stdout = StringIO()
+        call_command('reconcile_tickets', *args, file=self.FIXTURE, since='2019-10-18', until='2019-10-18',
+                     stdout=stdout)
+
+        lines = stdout.getvalue().splitlines()
+        names = {'ticket={id}'.format(id=ticket.id): name for name, ticket in self.tickets.items()}
+        report = {(problem, names.get(ticket, ticket)) for problem, _, ticket, _ in
+                  (line.split('\t') for line in lines[:-1])}
+
+        return report, lines[-1]
+
+    def test_every_kind_of_mismatch_is_reported(self):
+        report, summary = self.reconcile()
+
+        self.assertEqual(report, {
+            ('status', 'behind'),
+            ('missing_signup', 'unsigned'),
+            ('status', 'refunded'),
+            ('refunded_signup', 'refunded'),
+            ('amount', 'underpaid'),
+            ('status', 'ahead'),
+            ('missing_payment', 'unpaid'),
+            # A refund of a charge from before the window, which isn't a ticket the site knows about
+            ('missing_ticket', 'ticket=-'),
+        })
+        self.assertIn('Checked 7 payment(s), found 8 discrepancies', summary)
+        self.assertEqual(Ticket.objects.get(id=self.tickets['behind'].id).status, Ticket.IN_PROGRESS)
+
+    def test_fix_only_moves_tickets_forward(self):
+        self.reconcile('--fix')
+
+        statuses = dict(Ticket.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[self.tickets['behind'].id], Ticket.COMPLETE)
+        self.assertEqual(statuses[self.tickets['refunded'].id], Ticket.REFUNDED)
+        # Stripe hasn't finished taking this payment, but the ticket is never moved backwards
+        self.assertEqual(statuses[self.tickets['ahead'].id], Ticket.COMPLETE)
+        self.assertTrue(EventSignup.objects.get(ticket=self.tickets['refunded']).is_unsigned_up)
+
+class ExportSignupsTestCase(TestCase):
+    def setUp(self):
+        self.event = make_event()
+        SocietyMembership.objects.create(society='WE', uni_id='1800001')
+
+        profiles = [('nicknamed', ' Nick ', ' U1800001 '), ('named', '  ', '1800002'), ('nameless', '', 'u1800001')]
+        self.profiles = []
+        for username, nickname, uni_id in profiles:
+            user = User.objects.create(username=username, first_name=username.title(), last_name='Smith')
+            self.profiles.append(WarwickGGUser.objects.create(user=user, nickname=nickname, uni_id=uni_id))
+            EventSignup.objects.create(user=user, event=self.event)
+        User.objects.filter(username='nameless').update(first_name='', last_name='')
+
+    def test_rows_match_the_models(self):
+        response = EventAdmin(Event, site).export_signups(None, Event.objects.all())
+        rows = list(csv.DictReader(line.decode('utf-8') for line in response.streaming_content))
+
+        self.assertEqual(len(rows), len(self.profiles))
+        for row, profile in zip(rows, self.profiles):
+            profile = WarwickGGUser.objects.select_related('user').get(id=profile.id)
+            self.assertEqual(row['nick'], profile.long_name)
+            self.assertEqual(row['esports_member'],
+                             'Yes' if SocietyMembership.objects.is_member('WE', profile.uni_id) else 'No')
+
+
+class MinifySvgTestCase(SimpleTestCase):
+    def minify(self, svg):
+        return minify_svg(BytesIO(svg.encode('utf-8')))
+
+    def test_shipped_plans_keep_their_seats(self):
+        for path in SHIPPED_SEATING_PLANS:
+            with self.subTest(plan=os.path.basename(path)):
+                with open(path, 'rb') as svg:
+                    original = svg.read()
+                minified = minify_svg(BytesIO(original))
+                seats = parse_seat_map(BytesIO(original))
+
+                self.assertLess(len(minified), len(original))
+                self.assertEqual(parse_seat_map(BytesIO(minified.encode('utf-8'))), seats)
+                self.assertEqual(minified.count('data-seat-id'), len(seats))
+                self.assertEqual(minified.count('id="Table-'), original.decode('utf-8').count('id="Table-'))
+
+    def test_editor_content_is_removed(self):
+        minified = self.minify('<svg xmlns="http://www.w3.org/2000/svg" '
+                               'xmlns:sketch="http://www.bohemiancoding.com/sketch/ns">'
+                               '<!-- Generator: Sketch --><title>Plan</title><desc>Created with Sketch.</desc>'
+                               '<sketch:page/><g sketch:type="MSPage"><rect data-seat-id="1" width="10"/></g></svg>')
+
+        self.assertEqual(minified, '<svg xmlns="http://www.w3.org/2000/svg"><defs /><g><rect data-seat-id="1" '
+                                   'width="10" /></g></svg>')
+
+    def test_numbers_are_trimmed_without_moving_anything(self):
+        minified = self.minify('<svg xmlns="http://www.w3.org/2000/svg">'
+                               '<g transform="translate(69.000000, 104.500000)">'
+                               '<path d="M10.0.5L-0.50-1.0 3.0e2 .0"/></g></svg>')
+
+        self.assertIn('transform="translate(69, 104.5)"', minified)
+        # 10.0 can't lose its point since it would run into .5
+        self.assertIn('d="M10.0.5L-0.5-1 3.0e2 0"', minified)
+
+    def test_svg_without_namespace_is_rejected(self):
+        svg = '<svg><g id="Table-1"><rect data-seat-id="1" width="10"/></g></svg>'
+
+        with self.assertRaises(SeatMapError):
+            self.minify(svg)
+        with self.assertRaises(SeatMapError):
+            parse_seat_map(BytesIO(svg.encode('utf-8')))
+
+
+def seat_map_svg(*tables, loose=()):
+    """
+    A seating plan SVG with a Table-N group of seats for each list of seat IDs in tables, then the loose seats
+    """
+    def rects(seat_ids):
+        return ''.join('<rect data-seat-id="{id}" x="{x}" width="10" height="10"/>'.format(id=seat_id, x=10 * n)
+                       for n, seat_id in enumerate(seat_ids))
+
+    groups = ''.join('<g id="Table-{n}">{seats}</g>'.format(n=n + 1, seats=rects(seat_ids))
+                     for n, seat_ids in enumerate(tables))
+    return '<svg xmlns="http://www.w3.org/2000/svg">{groups}{loose}</svg>'.format(groups=groups, loose=rects(loose))
+
+
+class ParseSeatMapTestCase(SimpleTestCase):
+    def parse(self, svg):
+        return parse_seat_map(BytesIO(svg.encode('utf-8')))
+
+    def test_shipped_plans(self):
+        expected = {
+            'bfl-seating-optimised.svg': [24, 20, 20, 8, 20, 20],
+            'compsoc-seating.svg': [20, 20, 20, 8],
+            'freshers-seating.svg': [24, 20, 20, 8, 28, 24, 12, 8],
+        }
+
+        for path in SHIPPED_SEATING_PLANS:
+            with self.subTest(plan=os.path.basename(path)):
+                with open(path, 'rb') as svg:
+                    seats = parse_seat_map(svg)
+
+                self.assertEqual(table_sizes(seats), expected[os.path.basename(path)])
+                # Seats are numbered across the room from 0
+                self.assertEqual(sorted(int(seat_id) for seat_id, _, _, _ in seats), list(range(len(seats))))
+
+    def test_tables_are_ordered_by_their_lowest_seat(self):
+        seats = self.parse(seat_map_svg(['4', '5'], ['0', '1', '2', '3']))
+
+        self.assertEqual([(seat_id, table) for seat_id, table, _, _ in seats],
+                         [('0', 0), ('1', 0), ('2', 0), ('3', 0), ('4', 1), ('5', 1)])
+
+    def test_loose_seats_share_a_table(self):
+        seats = self.parse(seat_map_svg(['0', '1'], loose=['2', '3', '4']))
+
+        self.assertEqual(table_sizes(seats), [2, 3])
+
+    def test_plan_without_tables(self):
+        seats = self.parse(seat_map_svg(loose=['0', '1', '2']))
+
+        self.assertEqual([table for _, table, _, _ in seats], [None, None, None])
+
+
+class SeatingRoomIndexTestCase(TestCase):
+    def make_room(self, tables_raw='[2, 1]'):
+        return SeatingRoom.objects.create(name='LIB2', seating_plan_svg='seating/lib2.svg', tables_raw=tables_raw)
+
+    def svg_form(self, room, svg, tables_raw):
+        return SeatingRoomForm({'name': room.name, 'tables_raw': tables_raw},
+                               {'seating_plan_svg': SimpleUploadedFile('lib2.svg', svg.encode('utf-8'))},
+                               instance=room)
+
+    def test_tables_from_the_plan_replace_the_typed_ones(self):
+        room = self.make_room()
+        room.index_seats(parse_seat_map(BytesIO(seat_map_svg(['0', '1', '2'], ['3']).encode('utf-8'))))
+
+        room.refresh_from_db()
+        self.assertEqual(room.tables, {0: 3, 1: 1})
+        self.assertEqual(room.capacity, 4)
+
+    def test_typed_tables_are_kept_for_a_plan_without_tables(self):
+        room = self.make_room()
+        room.index_seats(parse_seat_map(BytesIO(seat_map_svg(loose=['2', '0', '1']).encode('utf-8'))))
+
+        room.refresh_from_db()
+        self.assertEqual(room.tables_raw, '[2, 1]')
+        self.assertEqual(dict(room.seats.values_list('seat_id', 'table')), {'0': 0, '1': 0, '2': 1})
+
+    def test_typed_tables_must_match_a_plan_without_tables(self):
+        room = self.make_room()
+
+        form = self.svg_form(room, seat_map_svg(loose=['0', '1']), '[2, 1]')
+        self.assertFalse(form.is_valid())
+        self.assertIn('tables_raw', form.errors)
+
+        self.assertTrue(self.svg_form(room, seat_map_svg(loose=['0', '1']), '[1, 1]').is_valid())
+
+    def test_typed_tables_cant_contradict_the_plan(self):
+        room = self.make_room()
+
+        form = self.svg_form(room, seat_map_svg(['0', '1', '2']), '[2, 2]')
+        self.assertFalse(form.is_valid())
+        self.assertIn('tables_raw', form.errors)
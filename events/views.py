@@ -1,14 +1,8 @@
-import json
-import xml.etree.ElementTree as ET
-from datetime import datetime
-
-import requests
-import stripe
 from allauth.socialaccount.models import SocialAccount
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models.functions import Lower
+from django.db import transaction
 from django.http import HttpResponseBadRequest, HttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.template.loader import render_to_string
@@ -19,7 +13,9 @@ from django.views.decorators.csrf import csrf_protect, csrf_exempt
 from stripe.error import StripeError
 
 from events.forms import EventSignupForm, TournamentSignupForm, TournamentCommentForm
-from events.models import Event, EventSignup, Tournament, Ticket, TournamentSignup
+from events.models import Event, EventSignup, Tournament, TournamentSignup, SocietyMembership, \
+    SignupReservation, StripeWebhookEvent
+from events.payments import get_stripe, refund, checkout_session_for
 from seating.models import Seating
 from uwcs_auth.models import WarwickGGUser
 
@@ -57,7 +53,7 @@ class EventView(View):
             except IndexError:
                 ticket_status = None
 
-        is_exec = WarwickGGUser.objects.get(user=request.user).is_exec if request.user.is_authenticated else False
+        is_exec = request.is_exec
         if signup or is_exec:
             signups = event.signups
         else:
@@ -108,7 +104,7 @@ def update_event_comment(slug, request):
 
     event = signup.event
     signups = event.signups
-    is_exec = 'exec' in request.user.groups.values_list(Lower('name'), flat=True)
+    is_exec = request.is_exec
 
     context = {
         'event': event,
@@ -147,7 +143,7 @@ def update_tournament_comment(slug, request):
 
     tournament = signup.tournament
     signups = tournament.signups
-    is_exec = 'exec' in request.user.groups.values_list(Lower('name'), flat=True)
+    is_exec = request.is_exec
 
     context = {
         'tournament': tournament,
@@ -188,7 +184,7 @@ class TournamentView(View):
         else:
             user_signup = None
 
-        is_exec = WarwickGGUser.objects.get(user=request.user).is_exec if request.user.is_authenticated else False
+        is_exec = request.is_exec
         if user_signup or is_exec:
             signups = tournament.signups
         else:
@@ -346,15 +342,14 @@ class TournamentIndexView(LoginRequiredMixin, View):
 
 
 def delete_event_comment(signup, request):
-    if signup.user == request.user \
-            or 'exec' in request.user.groups.values_list(Lower('name'), flat=True):
+    if signup.user == request.user or request.is_exec:
         signup.comment = ''
         signup.save()
 
         event = signup.event
         comment_form = EventSignupForm(instance=signup)
         signups = event.signups
-        is_exec = 'exec' in request.user.groups.values_list(Lower('name'), flat=True)
+        is_exec = request.is_exec
 
         try:
             user_signup = [x for x in EventSignup.objects.for_event(signup.event, user=request.user) if
@@ -382,15 +377,14 @@ def delete_event_comment(signup, request):
 
 
 def delete_tournament_comment(signup, request):
-    if signup.user == request.user \
-            or 'exec' in request.user.groups.values_list(Lower('name'), flat=True):
+    if signup.user == request.user or request.is_exec:
         signup.comment = ''
         signup.save()
 
         tournament = signup.tournament
         comment_form = TournamentCommentForm(instance=signup)
         signups = tournament.signups
-        is_exec = 'exec' in request.user.groups.values_list(Lower('name'), flat=True)
+        is_exec = request.is_exec
 
         try:
             user_signup = TournamentSignup.objects.get(tournament=tournament, user=request.user, is_unsigned_up=False)
@@ -438,24 +432,20 @@ class DeleteCommentView(LoginRequiredMixin, View):
             return HttpResponseBadRequest()
 
 
-def check_membership(api_token, profile, request, society):
+def check_membership(profile, society):
     if society == 'UWCS':
         return SocialAccount.objects.filter(user=profile.user).exists()
 
-    membership_url = 'https://www.warwicksu.com/membershipapi/listMembers/{token}/'.format(token=api_token)
-    api_call = requests.get(membership_url)
-
-    if api_call.status_code == 200:
-        xml_root = ET.fromstring(api_call.text)
-        members = list(map(lambda x: x.find('UniqueID').text, xml_root))
+    return SocietyMembership.objects.is_member(society, profile.uni_id)
 
-        return profile.uni_id.lower().strip('u') in members
-    else:
-        messages.error(request,
-                       'There was an error checking your {soc} membership, please contact an exec member.'.format(
-                           soc=society), extra_tags='is-danger')
 
-        return False
+def unchecked_societies(event):
+    """
+    The names of the societies hosting an event whose membership can't be checked at the moment because their SU
+    member list hasn't been synced recently
+    """
+    return [name for society, name in Event.SOCIETY_CHOICES if society in event.hosted_by and
+            society in settings.SU_MEMBERSHIP_API_KEYS and not SocietyMembership.objects.is_synced(society)]
 
 
 class SignupChargeView(LoginRequiredMixin, View):
@@ -469,27 +459,22 @@ class SignupChargeView(LoginRequiredMixin, View):
         event = get_object_or_404(Event, id=request.POST.get('event_id'))
 
         has_signed_up = list(
-            filter(lambda x: x.is_complete(), EventSignup.objects.for_event(event, request.user).all()))
+            filter(lambda x: x.is_valid(), EventSignup.objects.for_event(event, request.user).all()))
         if has_signed_up:
             messages.error(request, 'You\'re already signed up to that event.', extra_tags='is-danger')
             return redirect('event_home', slug=event.slug)
 
-        # Check if there is still space left
-        if event.signup_count == event.signup_limit:
-            messages.error(request, 'There\'s no more space for that event, sorry.', extra_tags='is-danger')
-            return redirect('event_home', slug=event.slug)
-
         profile = WarwickGGUser.objects.get(user=request.user)
 
         # If the event is hosted by UWCS
         if 'UWCS' in event.hosted_by:
-            uwcs_member = check_membership(settings.UWCS_API_KEY, profile, request, 'UWCS')
+            uwcs_member = check_membership(profile, 'UWCS')
         else:
             uwcs_member = False
 
         # If the event is hosted by Esports
         if 'WE' in event.hosted_by:
-            esports_member = check_membership(settings.ESPORTS_API_KEY, profile, request, 'Esports')
+            esports_member = check_membership(profile, 'WE')
         else:
             esports_member = False
 
@@ -509,7 +494,14 @@ class SignupChargeView(LoginRequiredMixin, View):
             # This shouldn't happen since the Stripe checkout should have taken over
             return HttpResponseBadRequest()
         else:
-            signup_form.save()
+            with transaction.atomic():
+                # Use the space held for the user if they've been to the checkout, otherwise claim one
+                if not SignupReservation.objects.consume(event, request.user) and not event.reserve_place():
+                    messages.error(request, 'There\'s no more space for that event, sorry.', extra_tags='is-danger')
+                    return redirect('event_home', slug=event.slug)
+
+                signup_form.save()
+
             messages.success(request, 'Signup successful!{seating}'.format(
                 seating=' You can now reserve a seat on the seating plan.' if event.has_seating else ''),
                              extra_tags='is-success')
@@ -529,17 +521,24 @@ class SignupFormView(LoginRequiredMixin, View):
             messages.error(request, 'You\'re already signed up to that event.', extra_tags='is-danger')
             return redirect('event_home', slug=slug)
 
+        if EventSignup.objects.for_event(event, request.user).exists():
+            # They've paid at the checkout but Stripe hasn't confirmed it yet. Their reservation has already become the
+            # signup, so going through the checkout again would take a second space.
+            messages.info(request, 'Your payment is still being processed, your signup will be confirmed once it has.',
+                          extra_tags='is-info')
+            return redirect('event_home', slug=slug)
+
         profile = WarwickGGUser.objects.get(user=request.user)
 
         # If the event is hosted by UWCS
         if 'UWCS' in event.hosted_by:
-            uwcs_member = check_membership(settings.UWCS_API_KEY, profile, request, 'UWCS')
+            uwcs_member = check_membership(profile, 'UWCS')
         else:
             uwcs_member = False
 
         # If the event is hosted by Esports
         if 'WE' in event.hosted_by:
-            esports_member = check_membership(settings.ESPORTS_API_KEY, profile, request, 'Esports')
+            esports_member = check_membership(profile, 'WE')
         else:
             esports_member = False
 
@@ -547,41 +546,29 @@ class SignupFormView(LoginRequiredMixin, View):
         signup_cost = event.cost_member if is_host_member else event.cost_non_member
 
         if signup_cost > 0:
-            new_ticket = Ticket(user=profile.user)
-            new_ticket.save()
-
-            ticket_json = json.dumps({
-                'ticket': new_ticket.id,
-                'event': event.id,
-                'created_at': timezone.now().strftime('%Y-%m-%dT%H:%M:%S%z')
-            })
-
-            checkout_session = stripe.checkout.session.Session.create(
-                success_url='https://{base}/events/{slug}#signup'.format(base=settings.CHECKOUT_BASE_URL,
-                                                                         slug=event.slug),
-                cancel_url='https://{base}/events/{slug}#signup'.format(base=settings.CHECKOUT_BASE_URL,
-                                                                        slug=event.slug),
-                client_reference_id=ticket_json,
-                customer_email=request.user.email,
-                payment_method_types=['card'],
-                line_items=[{
-                    'name': '{title} ticket'.format(title=event.title),
-                    'currency': 'gbp',
-                    'amount': int(signup_cost * 100),
-                    'quantity': 1,
-                    'description': 'A ticket to {title}, an event run by the Uni of Warwick Computing Society.'.format(
-                        title=event.title)
-                }]
-            )
+            # Hold a space while the user pays so the event can't sell out from under them
+            if not SignupReservation.objects.reserve(event, request.user):
+                messages.error(request, 'There\'s no more space for that event, sorry.', extra_tags='is-danger')
+                return redirect('event_home', slug=slug)
+
+            checkout_session = checkout_session_for(event, profile.user, signup_cost)
         else:
             checkout_session = None
 
+        # Members of a society whose list is out of date would otherwise be charged the non-member price without
+        # knowing why
+        if not is_host_member and event.cost_member != event.cost_non_member:
+            membership_unchecked = unchecked_societies(event)
+        else:
+            membership_unchecked = []
+
         ctx = {
             'event': event,
             'event_cost': signup_cost,
             'is_host_member': is_host_member,
+            'membership_unchecked': membership_unchecked,
             'stripe_pubkey': settings.STRIPE_PUBLIC_KEY,
-            'checkout_session': checkout_session.id if checkout_session else ''
+            'checkout_session': checkout_session or ''
         }
         return render(request, self.template_name, context=ctx)
 
@@ -614,7 +601,8 @@ class StripeWebhookView(View):
 
     def post(self, request):
         payload = request.body
-        sig_header = request.META['HTTP_STRIPE_SIGNATURE']
+        sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
+        stripe = get_stripe()
 
         try:
             # Verify the Stripe signature
@@ -624,61 +612,9 @@ class StripeWebhookView(View):
         except stripe.error.SignatureVerificationError:
             return HttpResponse(status=400)
 
-        if event['type'] == 'checkout.session.completed':
-            session = event['data']['object']
-            ticket_info = json.loads(session['client_reference_id'])
-            ticket_created_at = datetime.strptime(ticket_info['created_at'], '%Y-%m-%dT%H:%M:%S%z')
-
-            # If the ticket was created after the current time, then something screwy is going on
-            if ticket_created_at > timezone.now():
-                return HttpResponse(status=400)
-
-            event = Event.objects.get(id__exact=ticket_info['event'])
-            ticket = Ticket.objects.get(id__exact=ticket_info['ticket'])
-            user = ticket.user
-
-            # Create the event signup for the user
-            signup = EventSignup(user=user, event=event, ticket=ticket)
-
-            # Check the charge
-            payment = stripe.PaymentIntent.retrieve(session['payment_intent'])
-            charge = payment['charges']['data'][0]
-
-            # Update the ticket
-            ticket.status = Ticket.IN_PROGRESS
-            ticket.last_updated_at = timezone.now()
-            ticket.charge_id = charge['id']
-
-            if charge['paid']:
-                ticket.status = Ticket.COMPLETE
-
-            ticket.save()
-            signup.save()
-        elif event['type'] == 'charge.succeeded':
-            charge = event['data']['object']
-
-            try:
-                ticket = Ticket.objects.get(charge_id__exact=charge['id'])
-            except Ticket.DoesNotExist:
-                # The ticket doesn't exist for some reason, refund the charge and 400
-                return HttpResponse(400)
-
-            if charge['paid']:
-                ticket.status = Ticket.COMPLETE
-                ticket.last_updated_at = timezone.now()
-                ticket.save()
-        elif event['type'] == 'charge.refunded':
-            charge = event['data']['object']
-
-            try:
-                ticket = Ticket.objects.get(charge_id__exact=charge['id'])
-                ticket.status = Ticket.REFUNDED
-                ticket.last_updated_at = timezone.now()
-                ticket.comment = 'Refunded at {time}'.format(time=timezone.now().strftime('%Y-%m-%dT%H:%M:%S%z'))
-                ticket.save()
-            except Ticket.DoesNotExist:
-                # Nothing needs to be done since the ticket doesn't exist and the refund has been processed
-                pass
+        # Acknowledge the event straight away and leave the process_stripe_webhooks worker to apply it. Events that
+        # have been seen before are Stripe retrying, so they're acknowledged again without being stored twice.
+        StripeWebhookEvent.objects.record(event)
 
         return HttpResponse(status=200)
 
@@ -702,15 +638,13 @@ class UnsignupConfirmView(LoginRequiredMixin, View):
         if signup.ticket:
             try:
                 # Nothing else needs to be done since the webhook will deal with the rest of this
-                stripe.Refund.create(charge=signup.ticket.charge_id)
+                refund(signup.ticket)
             except StripeError:
                 messages.error(request,
                                'There was an error processing your refund. Please contact a member of the exec.',
                                extra_tags='is-danger')
 
-        signup.is_unsigned_up = True
-        signup.unsigned_up_at = timezone.now()
-        signup.save()
+        signup.unsign_up()
         # Remove all seating references
         Seating.objects.for_event(event).filter(user=request.user).delete()
 
@@ -0,0 +1,173 @@
+import re
+from collections import Counter
+
+from events.models import EventSignup, TournamentSignup
+
+# Shorter names than this match too many words in comments to be treated as friend requests
+MIN_FRIEND_NAME_LENGTH = 3
+
+
+def table_seats(room, taken=()):
+    """
+    The free seat IDs on each table of a seating room. Rooms whose SVG hasn't been indexed are assumed to have their
+    seats numbered in order across the tables, so each table's seats follow on from the table before it.
+    Returns a list of lists of seat IDs
+    """
+    taken = set(taken)
+    tables = [[] for _ in room.tables]
+
+    if room.capacity:
+        for seat_id, table in room.seats.values_list('seat_id', 'table'):
+            if seat_id not in taken:
+                tables[table].append(seat_id)
+        return tables
+
+    first_seat = 0
+    for table, capacity in room.tables.items():
+        tables[table] = [str(seat) for seat in range(first_seat, first_seat + capacity) if str(seat) not in taken]
+        first_seat += capacity
+
+    return tables
+
+
+def friend_groups(comments, names):
+    """
+    Find the people who asked to sit with each other in their signup comments.
+
+    :param comments: A dict of user ID to the comment they left when signing up
+    :param names: A dict of user ID to the names they could be referred to by
+    :return: A list of (user ID, user ID) pairs of friends
+    """
+    name_users = {}
+    for user_id, user_names in names.items():
+        for name in user_names:
+            if name and len(name) >= MIN_FRIEND_NAME_LENGTH:
+                name_users.setdefault(name.lower(), set()).add(user_id)
+
+    if not name_users:
+        return []
+
+    # One pass over each comment for every name, longest first so full names win over partial ones
+    pattern = re.compile(r'(?<!\w)({names})(?!\w)'.format(
+        names='|'.join(map(re.escape, sorted(name_users, key=len, reverse=True)))))
+
+    pairs = []
+    for user_id, comment in comments.items():
+        for name in pattern.findall((comment or '').lower()):
+            # Ambiguous names are ignored rather than guessed
+            if len(name_users[name]) == 1:
+                friend_id = next(iter(name_users[name]))
+                if friend_id != user_id:
+                    pairs.append((user_id, friend_id))
+
+    return pairs
+
+
+def group_attendees(attendees, pairs):
+    """
+    Join attendees into groups of people who want to sit together, following chains of friends.
+    Returns a list of lists of user IDs in the same order as attendees
+    """
+    parent = {user_id: user_id for user_id in attendees}
+
+    def find(user_id):
+        while parent[user_id] != user_id:
+            parent[user_id] = parent[parent[user_id]]
+            user_id = parent[user_id]
+        return user_id
+
+    for a, b in pairs:
+        if a in parent and b in parent:
+            parent[find(a)] = find(b)
+
+    groups = {}
+    for user_id in attendees:
+        groups.setdefault(find(user_id), []).append(user_id)
+
+    return list(groups.values())
+
+
+def allocate(tables, attendees, pairs=(), teams=None):
+    """
+    Seat attendees at tables so that friends sit at the same table and tournament teams share tables where they can.
+
+    Groups of friends are packed into tables biggest first, each going to the fullest table it fits on (preferring a
+    table their team is already at). Groups too big for any table are split over the emptiest tables. Each group's
+    seats are consecutive on its table.
+
+    :param tables: A list of lists of free seat IDs, one per table, in seat order
+    :param attendees: The user IDs of the people to seat
+    :param pairs: (user ID, user ID) pairs of people who want to sit together
+    :param teams: A dict of user ID to the tournament they're playing in
+    :return: A tuple of a dict of user ID to seat ID and a list of user IDs who didn't fit
+    """
+    teams = teams or {}
+    free = [list(seats) for seats in tables]
+    table_teams = [Counter() for _ in free]
+
+    def group_team(group):
+        return Counter(teams.get(user_id) for user_id in group).most_common(1)[0][0]
+
+    groups = group_attendees(attendees, pairs)
+    # Larger groups first, with each tournament's groups next to each other so they land near each other
+    groups.sort(key=lambda group: (-len(group), str(group_team(group))))
+
+    plan = {}
+    unseated = []
+
+    def seat(group, table):
+        for user_id in group:
+            plan[user_id] = free[table].pop(0)
+            if teams.get(user_id) is not None:
+                table_teams[table][teams[user_id]] += 1
+
+    for group in groups:
+        team = group_team(group)
+        fits = [table for table in range(len(free)) if len(free[table]) >= len(group)]
+
+        if fits:
+            # Best fit, with tables the group's team is already at first
+            seat(group, min(fits, key=lambda table: (-table_teams[table][team], len(free[table]))))
+            continue
+
+        # Nowhere has room for the whole group so keep as many together as possible
+        remaining = list(group)
+        for table in sorted(range(len(free)), key=lambda table: -len(free[table])):
+            if not remaining or not free[table]:
+                break
+            chunk, remaining = remaining[:len(free[table])], remaining[len(free[table]):]
+            seat(chunk, table)
+        unseated.extend(remaining)
+
+    return plan, unseated
+
+
+def allocate_event(event, seats=None):
+    """
+    Work out a seating plan for an event's seating room, seating everyone who has signed up but isn't in seats (a dict
+    of user ID to seat ID of people who should stay where they are).
+    Returns a tuple of the new plan as a dict of user ID to seat ID and a list of user IDs who didn't fit
+    """
+    seats = dict(seats or {})
+
+    signups = EventSignup.objects.all_for_event(event).exclude(user_id__in=list(seats)) \
+        .values_list('user_id', 'comment', 'user__username', 'user__warwickgguser__nickname',
+                     'user__warwickgguser__uni_id').order_by('created_at')
+
+    attendees = []
+    comments = {}
+    names = {}
+    for user_id, comment, username, nickname, uni_id in signups:
+        if user_id not in comments:
+            attendees.append(user_id)
+        comments[user_id] = comment
+        names[user_id] = [username, nickname, uni_id]
+
+    teams = dict(TournamentSignup.objects.filter(tournament__for_event=event, user_id__in=attendees,
+                                                 is_unsigned_up=False).values_list('user_id', 'tournament_id'))
+
+    plan, unseated = allocate(table_seats(event.seating_location, seats.values()), attendees,
+                              friend_groups(comments, names), teams)
+    seats.update(plan)
+
+    return seats, unseated
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SeatingConfig(AppConfig):
     name = 'seating'
+
+    def ready(self):
+        from seating import signals  # noqa: F401
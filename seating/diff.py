@@ -0,0 +1,56 @@
+def diff_seats(before, after):
+    """
+    Compare two seating plans, each given as a dict of user ID to seat ID.
+
+    Returns a dict of the users who were added (with their seat), removed and moved (with their new seat).
+    """
+    added = {}
+    moved = {}
+
+    for user_id, seat_id in after.items():
+        if user_id not in before:
+            added[user_id] = seat_id
+        elif before[user_id] != seat_id:
+            moved[user_id] = seat_id
+
+    return {
+        'added': added,
+        'removed': [user_id for user_id in before if user_id not in after],
+        'moved': moved
+    }
+
+
+def merge_seats(base, ours, theirs):
+    """
+    Three-way merge two seating plans that were both made from the same base plan. Each plan is a dict of user ID to
+    seat ID.
+
+    A user conflicts if both sides moved them to different places, or if the merge would put them in the same seat as
+    someone else. Returns a tuple of the merged plan and the set of conflicting user IDs.
+    """
+    our_changes = {user_id: ours.get(user_id) for user_id in base.keys() | ours.keys()
+                   if base.get(user_id) != ours.get(user_id)}
+    their_changes = {user_id: theirs.get(user_id) for user_id in base.keys() | theirs.keys()
+                     if base.get(user_id) != theirs.get(user_id)}
+
+    merged = dict(theirs)
+    conflicts = set()
+
+    for user_id, seat_id in our_changes.items():
+        if user_id in their_changes and their_changes[user_id] != seat_id:
+            conflicts.add(user_id)
+        elif seat_id is None:
+            merged.pop(user_id, None)
+        else:
+            merged[user_id] = seat_id
+
+    # Index the merged plan by seat to find anyone who has ended up sharing
+    seat_users = {}
+    for user_id, seat_id in merged.items():
+        seat_users.setdefault(seat_id, []).append(user_id)
+
+    for user_ids in seat_users.values():
+        if len(user_ids) > 1:
+            conflicts.update(user_id for user_id in user_ids if user_id in our_changes or user_id in their_changes)
+
+    return merged, conflicts
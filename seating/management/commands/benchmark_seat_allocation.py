@@ -0,0 +1,77 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from seating.allocation import allocate
+
+
+def synthetic_room(seats, rng):
+    """
+    A list of tables of free seat IDs adding up to the given number of seats, using the table sizes of the rooms the
+    society books
+    """
+    tables = []
+    first_seat = 0
+
+    while first_seat < seats:
+        capacity = min(rng.choice([8, 12, 20, 24, 28]), seats - first_seat)
+        tables.append([str(seat) for seat in range(first_seat, first_seat + capacity)])
+        first_seat += capacity
+
+    return tables
+
+
+def synthetic_attendees(count, tournaments, rng):
+    """
+    Attendees in friend groups of 1 to 8 people, each with a chance of playing in one of the tournaments
+    """
+    attendees = list(range(count))
+    pairs = []
+    teams = {}
+
+    user_id = 0
+    while user_id < count:
+        size = min(rng.choice([1, 1, 2, 2, 3, 4, 5, 8]), count - user_id)
+        pairs.extend((user_id, friend_id) for friend_id in range(user_id + 1, user_id + size))
+
+        if tournaments and rng.random() < 0.5:
+            team = rng.randrange(tournaments)
+            teams.update({member: team for member in range(user_id, user_id + size)})
+
+        user_id += size
+
+    return attendees, pairs, teams
+
+
+class Command(BaseCommand):
+    help = 'Time the seat allocator on randomly generated rooms and attendees'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seats', type=int, default=500, help='The number of seats in each room')
+        parser.add_argument('--fill', type=float, default=0.95,
+                            help='The proportion of the seats that people have signed up for')
+        parser.add_argument('--tournaments', type=int, default=4)
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        timings = []
+        unseated = 0
+
+        for _ in range(options['runs']):
+            tables = synthetic_room(options['seats'], rng)
+            attendees, pairs, teams = synthetic_attendees(int(options['seats'] * options['fill']),
+                                                          options['tournaments'], rng)
+
+            start = time.perf_counter()
+            _, not_seated = allocate(tables, attendees, pairs, teams)
+            timings.append(time.perf_counter() - start)
+            unseated += len(not_seated)
+
+        timings.sort()
+        self.stdout.write('{runs} runs of {seats} seats: median {median:.1f}ms, max {max:.1f}ms, {unseated} people '
+                          'left unseated in total'.format(runs=len(timings), seats=options['seats'],
+                                                          median=timings[len(timings) // 2] * 1000,
+                                                          max=timings[-1] * 1000, unseated=unseated))
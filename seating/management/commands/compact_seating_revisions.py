@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from seating.diff import diff_seats
+from seating.models import SeatingRevision, Seating
+
+
+def compact_event(event_id):
+    """
+    Rewrite the full copies of an event's seating plan that fall between keyframes as deltas.
+    Returns the number of seatings removed
+    """
+    compacted = 0
+    previous_seats = {}
+
+    with transaction.atomic():
+        for revision in SeatingRevision.objects.filter(event_id=event_id).order_by('number'):
+            seats = revision.seats()
+
+            if revision.is_keyframe and revision.number % settings.SEATING_KEYFRAME_INTERVAL != 0:
+                diff = diff_seats(previous_seats, seats)
+                deleted, _ = revision.seating_set.all().delete()
+
+                new_seats = [Seating(user_id=user_id, seat_id=seat_id, revision=revision) for user_id, seat_id in
+                             list(diff['added'].items()) + list(diff['moved'].items())]
+                new_seats += [Seating(user_id=user_id, seat_id=previous_seats[user_id], revision=revision,
+                                      removed=True) for user_id in diff['removed']]
+                Seating.objects.bulk_create(new_seats)
+
+                revision.is_keyframe = False
+                revision.save(update_fields=['is_keyframe'])
+                compacted += deleted - len(new_seats)
+
+            previous_seats = seats
+
+    return compacted
+
+
+class Command(BaseCommand):
+    help = 'Store seating revisions that were saved as full copies of the plan as deltas against their keyframe'
+
+    def handle(self, *args, **options):
+        event_ids = SeatingRevision.objects.filter(is_keyframe=True).values_list('event_id', flat=True).distinct()
+
+        for event_id in event_ids:
+            compacted = compact_event(event_id)
+            self.stdout.write('Event {event}: removed {n} seating(s)'.format(event=event_id, n=compacted))
+
+        self.stdout.write(self.style.SUCCESS('Compacted {n} event(s)'.format(n=len(event_ids))))
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.6 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seating', '0004_auto_20191018_1313'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seating',
+            name='removed',
+            field=models.BooleanField(default=False),
+        ),
+        # Every existing revision is a full copy of the plan
+        migrations.AddField(
+            model_name='seatingrevision',
+            name='is_keyframe',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='seatingrevision',
+            name='is_keyframe',
+            field=models.BooleanField(default=False),
+        ),
+    ]
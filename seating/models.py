@@ -1,9 +1,12 @@
 from django.conf import settings
 from django.db import models
+from django.db.models import Subquery, Value, IntegerField
+from django.db.models.functions import Coalesce
 from django.utils import timezone
+from django.utils.functional import cached_property
 
 from events.models import Event
-from uwcs_auth.models import WarwickGGUser
+from seating.diff import diff_seats
 
 
 class RevisionManager(models.Manager):
@@ -16,40 +19,69 @@ class SeatingRevision(models.Model):
     creator = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     number = models.IntegerField()
     created_at = models.DateTimeField(default=timezone.now)
+    # Keyframes store a full copy of the plan, every other revision only stores what changed since the one before it
+    is_keyframe = models.BooleanField(default=False)
 
     objects = RevisionManager()
 
     @property
     def creator_name(self):
-        return WarwickGGUser.objects.get(user=self.creator).long_name
+        return self.creator.warwickgguser.long_name
+
+    def plan(self):
+        """
+        The seating plan as of this revision.
+        Returns a dict of user ID to Seating object
+        """
+        return materialise(Seating.objects.history(self))
+
+    def seats(self):
+        """
+        The seating plan as of this revision as a dict of user ID to seat ID
+        """
+        return {user_id: seat.seat_id for user_id, seat in self.plan().items()}
 
     def prev(self):
         return SeatingRevision.objects.get(event=self.event, number=self.number - 1)
 
+    @cached_property
+    def changes(self):
+        """
+        Compare this revision with the one before it. Both plans are rebuilt from a single query.
+        Returns a dict of the Seatings that were added, the previous Seatings of those removed and (current, previous)
+        pairs of Seatings for those who moved
+        """
+        seatings = list(Seating.objects.history(self, since=self.number - 1).select_related('user__warwickgguser'))
+
+        before = materialise(seat for seat in seatings if seat.revision_id != self.id)
+        if self.is_keyframe:
+            # A keyframe replaces the plan rather than changing it
+            after = materialise(seat for seat in seatings if seat.revision_id == self.id)
+        else:
+            after = materialise(seatings)
+
+        diff = diff_seats({user_id: seat.seat_id for user_id, seat in before.items()},
+                          {user_id: seat.seat_id for user_id, seat in after.items()})
+
+        return {
+            'added': [after[user_id] for user_id in diff['added']],
+            'removed': [before[user_id] for user_id in diff['removed']],
+            'moved': [(after[user_id], before[user_id]) for user_id in diff['moved']]
+        }
+
     def added(self):
         """
         People who were added to the seating plan in the current
         revision.
         Returns an iterable of Seating Objects
         """
-        try:
-            return self.seating_set.exclude(user__in=self.prev().users())
-        except SeatingRevision.DoesNotExist:
-            return self.seating_set.all()
+        return self.changes['added']
 
     def removed(self):
-        try:
-            return self.prev().seating_set.exclude(user__in=self.users())
-        except SeatingRevision.DoesNotExist:
-            return self.seating_set.none()
+        return self.changes['removed']
 
     def moved(self):
-        try:
-            current = self.seating_set.filter(user__in=self.prev().users()).order_by('user')
-            previous = self.prev().seating_set.filter(user__in=self.users()).order_by('user')
-            return filter(lambda curr, prev: curr.col != prev.col or curr.row != prev.row, zip(current, previous))
-        except SeatingRevision.DoesNotExist:
-            return self.seating_set.none()
+        return self.changes['moved']
 
     class Meta:
         unique_together = ('event', 'number')
@@ -66,11 +98,43 @@ class SeatingManager(models.Manager):
     def for_event_revision(self, event, revision):
         return self.filter(revision__event=event, revision__number=revision)
 
+    def history(self, revision, since=None):
+        """
+        Get the seatings needed to rebuild a revision, oldest first: the keyframe at or before it (or at or before the
+        revision number since, to rebuild earlier revisions too) and every delta after. This is a single query.
+        """
+        if since is None:
+            since = revision.number
+
+        keyframe = SeatingRevision.objects.filter(event_id=revision.event_id, number__lte=since,
+                                                  is_keyframe=True).order_by('-number').values('number')[:1]
+
+        return self.filter(revision__event_id=revision.event_id,
+                           revision__number__gte=Coalesce(Subquery(keyframe, output_field=IntegerField()), Value(0)),
+                           revision__number__lte=revision.number).order_by('revision__number', 'id')
+
 
 class Seating(models.Model):
     reserved = models.BooleanField(default=False)
     revision = models.ForeignKey(SeatingRevision, on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     seat_id = models.CharField(max_length=5)
+    # Marks the user being taken off the plan in a delta revision, seat_id is the seat they left
+    removed = models.BooleanField(default=False)
 
     objects = SeatingManager()
+
+
+def materialise(seatings):
+    """
+    Replay seatings from SeatingManager.history into a dict of user ID to the Seating for where they are sat
+    """
+    plan = {}
+
+    for seat in seatings:
+        if seat.removed:
+            plan.pop(seat.user_id, None)
+        else:
+            plan[seat.user_id] = seat
+
+    return plan
@@ -0,0 +1,80 @@
+import queue
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class SeatingBroker:
+    """
+    Fans seating plan updates for an event out to everyone who has the plan open.
+
+    Backends are chosen with the SEATING_PUSH_BACKEND setting. A backend shared between processes (e.g. one built on
+    Redis pub/sub) is needed when the site runs in more than one process.
+    """
+
+    def publish(self, event_id, event_type, data):
+        raise NotImplementedError()
+
+    def listen(self, event_id, timeout):
+        """
+        Yield (event type, data) tuples for an event as they are published, or None whenever nothing has been
+        published for `timeout` seconds. Closing the generator unsubscribes.
+        """
+        raise NotImplementedError()
+
+
+class InProcessBroker(SeatingBroker):
+    """
+    A broker which only reaches listeners in the current process
+    """
+    # Listeners that fall this far behind are sent nothing until they catch up, the front-end will re-sync itself
+    # from the seats API when it reconnects anyway
+    MAX_QUEUED = 100
+
+    def __init__(self):
+        self._listeners = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, event_id, event_type, data):
+        with self._lock:
+            listeners = list(self._listeners.get(event_id, ()))
+
+        for listener in listeners:
+            try:
+                listener.put_nowait((event_type, data))
+            except queue.Full:
+                pass
+
+    def listen(self, event_id, timeout):
+        listener = queue.Queue(maxsize=self.MAX_QUEUED)
+
+        with self._lock:
+            self._listeners[event_id].add(listener)
+
+        try:
+            while True:
+                try:
+                    yield listener.get(timeout=timeout)
+                except queue.Empty:
+                    yield None
+        finally:
+            with self._lock:
+                self._listeners[event_id].discard(listener)
+                if not self._listeners[event_id]:
+                    del self._listeners[event_id]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.SEATING_PUSH_BACKEND)()
+
+    return _broker
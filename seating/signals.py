@@ -0,0 +1,36 @@
+from avatar.models import Avatar
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from events.models import EventSignup
+from seating.push import get_broker
+from seating.snapshots import bump_signup_version
+from uwcs_auth.models import WarwickGGUser
+
+
+def signups_changed(event_ids):
+    bump_signup_version(event_ids)
+
+    def notify():
+        for event_id in event_ids:
+            get_broker().publish(event_id, 'signups', {})
+
+    transaction.on_commit(notify)
+
+
+@receiver(post_save, sender=EventSignup)
+@receiver(post_delete, sender=EventSignup)
+def signup_changed(sender, instance, **kwargs):
+    signups_changed([instance.event_id])
+
+
+@receiver(post_save, sender=WarwickGGUser)
+@receiver(post_save, sender=Avatar)
+@receiver(post_delete, sender=Avatar)
+def profile_changed(sender, instance, **kwargs):
+    # A new nickname or avatar changes how the user is shown on the seating plan of every event they're going to
+    event_ids = list(EventSignup.objects.filter(user_id=instance.user_id, is_unsigned_up=False).values_list(
+        'event_id', flat=True).distinct())
+    if event_ids:
+        signups_changed(event_ids)
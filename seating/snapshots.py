@@ -0,0 +1,73 @@
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+from events.models import Event
+
+SEATS_SNAPSHOT_KEY = 'seating:seats:{event_id}:{revision}:{signup_version}'
+REVISIONS_SNAPSHOT_KEY = 'seating:revisions:{event_id}:{latest_revision}'
+AVATAR_ATLAS_KEY = 'seating:atlas:{event_id}:{version}'
+
+
+def bump_signup_version(event_ids):
+    """
+    Change Event.signup_version for events whose signups (or their names and avatars) have changed. This happens in
+    the same transaction as the change so every server process sees the new version as soon as it's committed.
+    """
+    Event.objects.filter(id__in=event_ids).update(signup_version=F('signup_version') + 1)
+
+
+def seats_etag(event, revision_number):
+    return '"seats-{event}-{revision}-{version}"'.format(event=event.id, revision=revision_number,
+                                                         version=event.signup_version)
+
+
+def revisions_etag(event_id, latest_revision_number):
+    return '"revisions-{event}-{revision}"'.format(event=event_id, revision=latest_revision_number)
+
+
+def avatar_atlas_etag(event, version):
+    return '"atlas-{event}-{version}"'.format(event=event.id, version=version)
+
+
+def cached_snapshot(key, build):
+    """
+    Get the serialised JSON stored under a snapshot key, building and storing it if it's not there
+    """
+    snapshot = cache.get(key)
+
+    if snapshot is None:
+        snapshot = json.dumps(build(), cls=DjangoJSONEncoder)
+        cache.set(key, snapshot, settings.SEATING_SNAPSHOT_TTL)
+
+    return snapshot
+
+
+def seats_snapshot(event, revision_number, build):
+    key = SEATS_SNAPSHOT_KEY.format(event_id=event.id, revision=revision_number, signup_version=event.signup_version)
+
+    return cached_snapshot(key, build)
+
+
+def revisions_snapshot(event_id, latest_revision_number, build):
+    key = REVISIONS_SNAPSHOT_KEY.format(event_id=event_id, latest_revision=latest_revision_number)
+
+    return cached_snapshot(key, build)
+
+
+def avatar_atlas_snapshot(event, version, build):
+    """
+    Get the avatar atlas PNG for an event, building and storing it if the avatars in it (given by their atlas_version)
+    have changed
+    """
+    key = AVATAR_ATLAS_KEY.format(event_id=event.id, version=version)
+    atlas = cache.get(key)
+
+    if atlas is None:
+        atlas = build()
+        cache.set(key, atlas, settings.SEATING_SNAPSHOT_TTL)
+
+    return atlas
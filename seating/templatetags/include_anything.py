@@ -5,4 +5,5 @@ register = template.Library()
 
 @register.simple_tag
 def include_anything(file_name):
-    return open(file_name).read()
+    with open(file_name) as f:
+        return f.read()
@@ -0,0 +1,52 @@
+import os
+
+from django import template
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from events.seat_map import minify_svg, SeatMapError
+
+register = template.Library()
+
+# Minified seating plans by path, along with the modification time of the file they were read from
+_svg_cache = {}
+
+
+def seating_plan_path(room):
+    path = room.seating_plan_svg.path
+
+    if not os.path.exists(path):
+        # The plans which ship with the site are kept with the seating templates
+        path = get_template(os.path.basename(room.seating_plan_svg.name)).origin.name
+
+    return path
+
+
+def load_seating_plan(path):
+    """
+    Get the minified SVG for a seating plan, only reading the file again if it has changed since it was last read
+    """
+    mtime = os.stat(path).st_mtime
+    cached = _svg_cache.get(path)
+
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as svg:
+            try:
+                plan = minify_svg(svg)
+            except SeatMapError:
+                # Show the plan as it is rather than not at all
+                svg.seek(0)
+                plan = svg.read().decode('utf-8')
+
+        cached = (mtime, plan)
+        _svg_cache[path] = cached
+
+    return cached[1]
+
+
+@register.simple_tag()
+def seating_plan_svg(room):
+    if not room:
+        return ''
+
+    return mark_safe(load_seating_plan(seating_plan_path(room)))
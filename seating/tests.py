@@ -1,3 +1,485 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from avatar.models import Avatar
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from events.models import Event, EventSignup, Seat, SeatingRoom
+from events.testing import make_event, make_user
+from seating import push
+from seating.allocation import allocate, friend_groups, group_attendees
+from seating.diff import merge_seats
+from seating.models import Seating, SeatingRevision
+from seating.push import InProcessBroker
+from seating.views import SeatingConflictError, event_stream, latest_seats, save_revision, write_revision
+
+
+class SeatingSnapshotTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.event = make_event()
+        self.user = make_user('attendee')
+        EventSignup.objects.create(user=self.user, event=self.event)
+        self.client.force_login(self.user)
+
+    def get_seats(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(reverse('seating_api', kwargs={'event_id': self.event.id}), **headers)
+
+    def test_signup_changes_etag_in_every_process(self):
+        response = self.get_seats()
+        self.assertEqual(len(response.json()['unseated']), 1)
+        etag = response['ETag']
+
+        self.assertEqual(self.get_seats(etag).status_code, 304)
+
+        EventSignup.objects.create(user=make_user('latecomer'), event=self.event)
+        # Another server process has its own cache, which never heard about the signup
+        cache.clear()
+
+        response = self.get_seats(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['unseated']), 2)
+
+    def test_saving_a_stale_event_keeps_the_version(self):
+        stale = Event.objects.get(id=self.event.id)
+        EventSignup.objects.create(user=make_user('latecomer'), event=self.event)
+        version = Event.objects.get(id=self.event.id).signup_version
+
+        stale.title = 'Renamed LAN'
+        stale.save()
+
+        self.assertEqual(Event.objects.get(id=self.event.id).signup_version, version)
+
+
+class SeatingAvatarAtlasTestCase(TestCase):
+    def setUp(self):
+        # Every test's event has the same ID and signup version, so snapshots from the last test would be reused
+        cache.clear()
+        self.event = make_event()
+        self.leaver = make_user('leaver')
+        self.attendee = make_user('attendee')
+        for user in (self.leaver, self.attendee):
+            Avatar.objects.create(user=user, primary=True, avatar='avatars/{name}.png'.format(name=user.username))
+            EventSignup.objects.create(user=user, event=self.event)
+
+        write_revision(self.event, self.attendee, 0, {}, {self.leaver.id: 'A1'})
+        EventSignup.objects.get(user=self.leaver).unsign_up()
+        self.client.force_login(self.attendee)
+
+    def test_plan_indexes_match_the_atlas_image(self):
+        plan = self.client.get(reverse('seating_api', kwargs={'event_id': self.event.id})).json()
+
+        # Someone who left after being seated isn't in the atlas so they can't shift everyone else along
+        self.assertIsNone(plan['seated'][0]['atlas_index'])
+        self.assertEqual(plan['unseated'][0]['atlas_index'], 0)
+        self.assertEqual(plan['atlas']['rows'], 1)
+
+        response = self.client.get(plan['atlas']['url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertIn(plan['atlas']['url'].split('?v=')[1], response['ETag'])
+
+    def test_new_avatar_is_a_new_atlas(self):
+        url = self.client.get(reverse('seating_api', kwargs={'event_id': self.event.id})).json()['atlas']['url']
+
+        Avatar.objects.create(user=self.attendee, primary=True, avatar='avatars/new.png')
+
+        new_url = self.client.get(reverse('seating_api', kwargs={'event_id': self.event.id})).json()['atlas']['url']
+        self.assertNotEqual(new_url, url)
+        self.assertEqual(self.client.get(url)['Cache-Control'], 'private, no-cache')
+
+
+class InProcessBrokerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.broker = InProcessBroker()
+
+    def subscribe(self, event_id):
+        listener = self.broker.listen(event_id, timeout=0.01)
+        # The listener subscribes when it's first asked for a message, which times out since nothing is published yet
+        self.assertIsNone(next(listener))
+
+        return listener
+
+    def test_publish_reaches_the_event_listeners(self):
+        listeners = [self.subscribe(1), self.subscribe(1)]
+        other = self.subscribe(2)
+
+        self.broker.publish(1, 'signups', {})
+
+        for listener in listeners:
+            self.assertEqual(next(listener), ('signups', {}))
+            self.assertIsNone(next(listener))
+        self.assertIsNone(next(other))
+
+    def test_closing_unsubscribes(self):
+        listener = self.subscribe(1)
+        listener.close()
+
+        self.assertEqual(self.broker._listeners, {})
+        # Publishing with nobody listening is fine
+        self.broker.publish(1, 'signups', {})
+
+    def test_slow_listener_does_not_block_publishing(self):
+        listener = self.subscribe(1)
+
+        for n in range(InProcessBroker.MAX_QUEUED + 10):
+            self.broker.publish(1, 'revision', {'n': n})
+
+        received = [next(listener) for _ in range(InProcessBroker.MAX_QUEUED)]
+        self.assertEqual(received[-1], ('revision', {'n': InProcessBroker.MAX_QUEUED - 1}))
+        self.assertIsNone(next(listener))
+
+
+@override_settings(SEATING_PUSH_KEEPALIVE=0.01)
+class SeatingPushTestCase(TransactionTestCase):
+    def setUp(self):
+        self.event = make_event()
+        self.user = make_user('exec')
+        EventSignup.objects.create(user=self.user, event=self.event)
+
+        self.broker = InProcessBroker()
+        patcher = mock.patch.object(push, '_broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.listener = self.broker.listen(self.event.id, timeout=0.01)
+        self.assertIsNone(next(self.listener))
+
+    def test_revision_is_published_once_committed(self):
+        with transaction.atomic():
+            write_revision(self.event, self.user, 0, {}, {self.user.id: 'A1'})
+            self.assertIsNone(next(self.listener))
+
+        event_type, data = next(self.listener)
+        self.assertEqual(event_type, 'revision')
+        self.assertEqual(data['revision']['number'], 0)
+        self.assertEqual(data['diff']['added'], {self.user.id: 'A1'})
+
+    def test_rolled_back_revision_is_not_published(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                write_revision(self.event, self.user, 0, {}, {self.user.id: 'A1'})
+                raise ValueError()
+
+        self.assertIsNone(next(self.listener))
+
+    def test_stream_formats_updates_as_server_sent_events(self):
+        stream = event_stream(self.event.id)
+
+        self.assertEqual(next(stream), 'retry: 10\n\n')
+        self.assertEqual(next(stream), ': keepalive\n\n')
+
+        self.broker.publish(self.event.id, 'signups', {})
+        self.assertEqual(next(stream), 'event: signups\ndata: {}\n\n')
+
+
+class SeatAllocationTestCase(SimpleTestCase):
+    def table_of(self, tables, seat_id):
+        return next(table for table, seats in enumerate(tables) if seat_id in seats)
+
+    def test_friends_are_found_in_comments(self):
+        comments = {1: 'Please sit me with bobby and Carol!', 2: '', 3: 'next to al', 4: 'with Bob'}
+        names = {1: ['alice', 'Al'], 2: ['bobby', 'Bob'], 3: ['carol', ''], 4: ['bob2', 'Bob']}
+
+        # "al" is too short to be a name and "Bob" could be two people
+        self.assertEqual(sorted(friend_groups(comments, names)), [(1, 2), (1, 3)])
+
+    def test_chains_of_friends_are_grouped(self):
+        self.assertEqual(group_attendees([1, 2, 3, 4, 5], [(1, 3), (3, 5), (9, 2)]), [[1, 3, 5], [2], [4]])
+
+    def test_friends_sit_at_the_same_table(self):
+        tables = [['0', '1', '2'], ['3', '4', '5']]
+
+        plan, unseated = allocate(tables, [1, 2, 3, 4], pairs=[(1, 4), (4, 3)])
+
+        self.assertEqual(unseated, [])
+        self.assertEqual({self.table_of(tables, plan[user_id]) for user_id in (1, 3, 4)}, {0})
+        self.assertEqual(sorted(plan[user_id] for user_id in (1, 3, 4)), ['0', '1', '2'])
+        self.assertEqual(self.table_of(tables, plan[2]), 1)
+
+    def test_team_mates_prefer_their_team_table(self):
+        tables = [['0', '1', '2', '3'], ['4', '5', '6', '7']]
+        teams = {1: 'rocket-league', 2: 'rocket-league', 3: 'rocket-league'}
+
+        plan, _ = allocate(tables, [1, 2, 3, 5, 6, 7], pairs=[(1, 2), (5, 6), (6, 7)], teams=teams)
+
+        self.assertEqual(self.table_of(tables, plan[1]), self.table_of(tables, plan[2]))
+        # The other table is a better fit for one person, but their team is on this one
+        self.assertEqual(self.table_of(tables, plan[3]), self.table_of(tables, plan[1]))
+
+    def test_group_bigger_than_any_table_is_split(self):
+        tables = [['0', '1'], ['2', '3', '4']]
+
+        plan, unseated = allocate(tables, [1, 2, 3, 4], pairs=[(1, 2), (2, 3), (3, 4)])
+
+        self.assertEqual(unseated, [])
+        # As many as possible are kept together on the biggest table
+        self.assertEqual([plan[user_id] for user_id in (1, 2, 3, 4)], ['2', '3', '4', '0'])
+
+    def test_attendees_who_do_not_fit_are_left_unseated(self):
+        plan, unseated = allocate([['0'], ['1']], [1, 2, 3], pairs=[(2, 3)])
+
+        self.assertEqual(len(plan), 2)
+        self.assertEqual(len(unseated), 1)
+        self.assertEqual(set(plan) | set(unseated), {1, 2, 3})
+        self.assertEqual(sorted(plan.values()), ['0', '1'])
+
+
+def write_plans(event, user, plans):
+    """
+    Save each plan (a dict of user ID to seat ID) as the next revision of an event's seating plan
+    """
+    revisions = []
+    for seats in plans:
+        with transaction.atomic():
+            revision_number, previous_seats = latest_seats(event)
+            revisions.append(write_revision(event, user, revision_number, previous_seats, seats))
+
+    return revisions
+
+
+@override_settings(SEATING_KEYFRAME_INTERVAL=3)
+class SeatingRevisionHistoryTestCase(TestCase):
+    def setUp(self):
+        self.event = make_event()
+        a, b, c = self.user_ids = [make_user(name).id for name in ('a', 'b', 'c')]
+        self.plans = [
+            {a: '1'},
+            {a: '1', b: '2'},
+            {a: '3', b: '2'},
+            # Keyframes
+            {b: '2', c: '4'},
+            {c: '4'},
+            {c: '4', a: '5'},
+            {a: '5'},
+        ]
+        self.revisions = write_plans(self.event, User.objects.get(id=a), self.plans)
+
+    def test_keyframes_are_every_interval(self):
+        self.assertEqual([revision.number for revision in self.revisions if revision.is_keyframe], [0, 3, 6])
+
+    def test_every_revision_is_rebuilt(self):
+        for revision, seats in zip(SeatingRevision.objects.for_event(self.event).reverse(), self.plans):
+            with self.subTest(revision=revision.number), self.assertNumQueries(1):
+                self.assertEqual(revision.seats(), seats)
+
+    def test_deltas_only_store_changes(self):
+        stored = [list(Seating.objects.filter(revision=revision).values_list('user_id', 'seat_id', 'removed'))
+                  for revision in self.revisions]
+        a, b, c = self.user_ids
+
+        self.assertEqual(stored[2], [(a, '3', False)])
+        self.assertEqual(sorted(stored[3]), sorted([(b, '2', False), (c, '4', False)]))
+        # Taking someone off the plan is stored with the seat they left
+        self.assertEqual(stored[4], [(b, '2', True)])
+        self.assertEqual(stored[6], [(a, '5', False)])
+
+    def test_history_starts_from_the_last_keyframe(self):
+        numbers = Seating.objects.history(self.revisions[5]).values_list('revision__number', flat=True)
+
+        self.assertEqual(sorted(set(numbers)), [3, 4, 5])
+
+
+@override_settings(SEATING_KEYFRAME_INTERVAL=3)
+class SeatingRevisionChangesTestCase(TestCase):
+    def setUp(self):
+        self.event = make_event()
+        self.exec = make_user('exec', nickname='Exec')
+        self.exec.groups.add(Group.objects.create(name='exec'))
+        a, b, c = self.user_ids = [make_user(name).id for name in ('a', 'b', 'c')]
+        self.revisions = write_plans(self.event, self.exec, [
+            {a: '1', b: '2'},
+            {a: '3', b: '2', c: '4'},
+            {a: '3', c: '4'},
+            # A keyframe
+            {a: '5', b: '6', c: '4'},
+        ])
+
+    def changes(self, revision):
+        revision = SeatingRevision.objects.get(id=revision.id)
+        return {
+            'added': {(seat.user_id, seat.seat_id) for seat in revision.added()},
+            'removed': {(seat.user_id, seat.seat_id) for seat in revision.removed()},
+            'moved': {(current.user_id, previous.seat_id, current.seat_id) for current, previous in revision.moved()},
+        }
+
+    def test_added_and_moved(self):
+        a, b, c = self.user_ids
+
+        self.assertEqual(self.changes(self.revisions[1]), {'added': {(c, '4')}, 'removed': set(),
+                                                           'moved': {(a, '1', '3')}})
+
+    def test_removed_has_the_seat_that_was_left(self):
+        a, b, c = self.user_ids
+
+        self.assertEqual(self.changes(self.revisions[2]), {'added': set(), 'removed': {(b, '2')}, 'moved': set()})
+
+    def test_keyframe_is_compared_with_the_plan_before_it(self):
+        a, b, c = self.user_ids
+
+        self.assertEqual(self.changes(self.revisions[3]), {'added': {(b, '6')}, 'removed': set(),
+                                                           'moved': {(a, '3', '5')}})
+
+    def test_first_revision_adds_everyone(self):
+        a, b, c = self.user_ids
+
+        self.assertEqual(self.changes(self.revisions[0]), {'added': {(a, '1'), (b, '2')}, 'removed': set(),
+                                                           'moved': set()})
+
+    def test_diff_api(self):
+        a, b, c = self.user_ids
+        url = reverse('seating_revision_diff_api', kwargs={'event_id': self.event.id, 'number': 1})
+
+        self.client.force_login(User.objects.get(id=a))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.exec)
+        diff = self.client.get(url).json()
+        self.assertEqual(diff['revision']['number'], 1)
+        self.assertEqual([(change['user_id'], change['seat_id']) for change in diff['added']], [(c, '4')])
+        self.assertEqual(diff['removed'], [])
+        self.assertEqual([(change['user_id'], change['from_seat_id'], change['seat_id']) for change in diff['moved']],
+                         [(a, '1', '3')])
+
+
+class SeatingMoveTestCase(TestCase):
+    def setUp(self):
+        room = SeatingRoom.objects.create(name='LIB2', seating_plan_svg='seating/lib2.svg', tables_raw='[3]',
+                                          capacity=3)
+        Seat.objects.bulk_create([Seat(room=room, seat_id=str(n), table=0, x=0, y=0) for n in range(3)])
+        self.event = make_event(seating_location=room)
+        self.user = make_user('mover')
+        self.other = make_user('sitter')
+        for user in (self.user, self.other):
+            EventSignup.objects.create(user=user, event=self.event)
+        self.client.force_login(self.user)
+
+    def move(self, seat_id):
+        return self.client.post(reverse('seating_move_api', kwargs={'event_id': self.event.id}), {'seat_id': seat_id})
+
+    def latest_seats(self):
+        return SeatingRevision.objects.for_event(self.event).first().seats()
+
+    def test_move(self):
+        self.assertEqual(self.move('1').json()['revision']['number'], 0)
+        self.assertEqual(self.move('2').json()['revision']['number'], 1)
+
+        self.assertEqual(self.latest_seats(), {self.user.id: '2'})
+        # Only the mover's change is stored
+        self.assertEqual(Seating.objects.filter(revision__number=1).count(), 1)
+
+        self.assertEqual(self.move('').status_code, 200)
+        self.assertEqual(self.latest_seats(), {})
+
+    def test_occupied_seat_is_rejected(self):
+        write_plans(self.event, self.other, [{self.other.id: '1'}])
+
+        response = self.move('1')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(SeatingRevision.objects.for_event(self.event).count(), 1)
+        self.assertEqual(self.latest_seats(), {self.other.id: '1'})
+
+    def test_unknown_seat_is_rejected(self):
+        self.assertEqual(self.move('9').status_code, 400)
+        self.assertFalse(SeatingRevision.objects.for_event(self.event).exists())
+
+    def test_moving_to_the_same_seat_changes_nothing(self):
+        self.move('1')
+
+        self.assertIsNone(self.move('1').json()['revision'])
+
+        # The revision number that was claimed is given back
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.seating_revision_count, 1)
+        self.assertEqual(self.move('2').json()['revision']['number'], 1)
+
+
+class MergeSeatsTestCase(SimpleTestCase):
+    base = {1: 'A', 2: 'B', 3: 'C'}
+
+    def test_separate_changes_merge(self):
+        merged, conflicts = merge_seats(self.base, {1: 'D', 2: 'B', 3: 'C'}, {1: 'A', 2: 'E', 3: 'C', 4: 'F'})
+
+        self.assertEqual(merged, {1: 'D', 2: 'E', 3: 'C', 4: 'F'})
+        self.assertEqual(conflicts, set())
+
+    def test_same_change_on_both_sides_merges(self):
+        merged, conflicts = merge_seats(self.base, {1: 'D', 2: 'B', 3: 'C'}, {1: 'D', 2: 'B', 3: 'C'})
+
+        self.assertEqual(merged, {1: 'D', 2: 'B', 3: 'C'})
+        self.assertEqual(conflicts, set())
+
+    def test_same_person_moved_on_both_sides_conflicts(self):
+        _, conflicts = merge_seats(self.base, {1: 'D', 2: 'B', 3: 'C'}, {1: 'E', 2: 'B', 3: 'C'})
+
+        self.assertEqual(conflicts, {1})
+
+    def test_same_seat_taken_on_both_sides_conflicts(self):
+        _, conflicts = merge_seats(self.base, {1: 'D', 2: 'B', 3: 'C'}, {1: 'A', 2: 'D', 3: 'C'})
+
+        self.assertEqual(conflicts, {1, 2})
+
+    def test_moving_into_a_seat_the_other_side_filled_conflicts(self):
+        _, conflicts = merge_seats(self.base, {1: 'A', 2: 'B', 3: 'C', 4: 'D'}, {1: 'A', 2: 'B', 3: 'D'})
+
+        self.assertEqual(conflicts, {3, 4})
+
+    def test_remove_against_move_conflicts(self):
+        _, conflicts = merge_seats(self.base, {2: 'B', 3: 'C'}, {1: 'D', 2: 'B', 3: 'C'})
+
+        self.assertEqual(conflicts, {1})
+
+    def test_remove_against_another_change_merges(self):
+        merged, conflicts = merge_seats(self.base, {2: 'B', 3: 'C'}, {1: 'A', 2: 'E', 3: 'C'})
+
+        self.assertEqual(merged, {2: 'E', 3: 'C'})
+        self.assertEqual(conflicts, set())
+
+
+class SaveRevisionMergeTestCase(TestCase):
+    def setUp(self):
+        self.event = make_event()
+        self.a, self.b = make_user('a'), make_user('b')
+        for user in (self.a, self.b):
+            EventSignup.objects.create(user=user, event=self.event)
+
+        # Revision 0 has a on the plan, then someone else adds b in revision 1
+        write_plans(self.event, self.a, [{self.a.id: '1'}, {self.a.id: '1', self.b.id: '2'}])
+
+    def test_stale_base_revision_is_merged(self):
+        revision = save_revision([{'user_id': self.a.id, 'seat_id': '3'}], self.event, self.a, base_revision=0)
+
+        self.assertEqual(revision.number, 2)
+        self.assertEqual(revision.seats(), {self.a.id: '3', self.b.id: '2'})
+
+    def test_stale_base_revision_with_a_conflict_is_rejected(self):
+        save_revision([{'user_id': self.a.id, 'seat_id': '3'}, {'user_id': self.b.id, 'seat_id': '2'}], self.event,
+                      self.a, base_revision=1)
+
+        with self.assertRaises(SeatingConflictError) as raised:
+            save_revision([{'user_id': self.a.id, 'seat_id': '4'}, {'user_id': self.b.id, 'seat_id': '2'}],
+                          self.event, self.a, base_revision=1)
+
+        self.assertEqual(raised.exception.conflicting_user_ids, [self.a.id])
+        self.assertEqual(raised.exception.latest_revision_number, 2)
+        self.assertEqual(SeatingRevision.objects.for_event(self.event).count(), 3)
+
+    def test_conflict_through_the_api(self):
+        save_revision([{'user_id': self.a.id, 'seat_id': '3'}, {'user_id': self.b.id, 'seat_id': '2'}], self.event,
+                      self.a, base_revision=1)
+        self.client.force_login(self.b)
+
+        response = self.client.post(reverse('seating_submit_api', kwargs={'event_id': self.event.id}), {
+            'json': json.dumps({'base_revision': 1, 'seats': [{'user_id': self.a.id, 'seat_id': '2'}]})
+        })
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['conflicting_user_ids'], [self.a.id])
+        self.assertEqual(response.json()['revision'], 2)
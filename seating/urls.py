@@ -1,12 +1,19 @@
 from django.urls import path
 
 from seating.views import SeatingView, SeatingFAQView, SeatingRoomAPIView, SeatingRoomRevisionListAPIView, \
-    SeatingRoomAPISubmitRevisionView
+    SeatingRoomAPISubmitRevisionView, SeatingRoomStreamView, SeatingRoomRevisionDiffAPIView, \
+    SeatingRoomAPIMoveView, SeatingRoomAPIAllocateView, SeatingRoomAvatarAtlasView
 
 urlpatterns = [
     path('<slug:slug>', SeatingView.as_view(), name='event_seating'),
     path('faqs/', SeatingFAQView.as_view(), name='seating_faqs'),
     path('api/seats/<int:event_id>', SeatingRoomAPIView.as_view(), name='seating_api'),
+    path('api/atlas/<int:event_id>', SeatingRoomAvatarAtlasView.as_view(), name='seating_atlas_api'),
     path('api/revisions/<int:event_id>', SeatingRoomRevisionListAPIView.as_view(), name='seating_revision_api'),
+    path('api/revisions/<int:event_id>/<int:number>/diff', SeatingRoomRevisionDiffAPIView.as_view(),
+         name='seating_revision_diff_api'),
     path('api/submit/<int:event_id>', SeatingRoomAPISubmitRevisionView.as_view(), name='seating_submit_api'),
+    path('api/move/<int:event_id>', SeatingRoomAPIMoveView.as_view(), name='seating_move_api'),
+    path('api/allocate/<int:event_id>', SeatingRoomAPIAllocateView.as_view(), name='seating_allocate_api'),
+    path('api/stream/<int:event_id>', SeatingRoomStreamView.as_view(), name='seating_stream_api'),
 ]
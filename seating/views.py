@@ -1,21 +1,31 @@
 import json
-import os
-
-from avatar.templatetags.avatar_tags import avatar_url
-from django.contrib.auth import get_user_model
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db import transaction, DatabaseError
-from django.http import HttpResponseForbidden, JsonResponse, HttpResponseBadRequest
+from collections import Counter
+
+from avatar.conf import settings as avatar_settings
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, DatabaseError, connection
+from django.http import HttpResponseForbidden, JsonResponse, HttpResponseBadRequest, Http404, StreamingHttpResponse
 from django.http.response import HttpResponse
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_protect
 
 from events.models import Event, EventSignup
-from seating.models import SeatingRevision, Seating
-from uwcs_auth.models import WarwickGGUser
+from seating.allocation import allocate_event
+from seating.diff import diff_seats, merge_seats
+from seating.models import SeatingRevision, Seating, materialise
+from seating.push import get_broker
+from seating.snapshots import seats_etag, seats_snapshot, revisions_etag, revisions_snapshot, avatar_atlas_etag, \
+    avatar_atlas_snapshot
+from uwcs_auth.avatars import avatar_urls, primary_avatars, atlas_layout, atlas_version, build_avatar_atlas, \
+    ATLAS_COLUMNS
+from uwcs_auth.permissions import ExecRequiredMixin
 
 
 class SeatingFAQView(LoginRequiredMixin, View):
@@ -27,27 +37,179 @@ class SeatingFAQView(LoginRequiredMixin, View):
         return render(request, self.template_name, context=ctx)
 
 
-@transaction.atomic
-def save_revision(seats, event, user):
-    latest_revision = SeatingRevision.objects.for_event(event).first()
+def revision_to_dict(revision: SeatingRevision):
+    """
+    Convert a revision to a dict for the revision list in the seating front-end
+    """
+    return {
+        'name': 'Revision {n}'.format(n=revision.number + 1),
+        'number': revision.number,
+        'created_at': revision.created_at,
+        'creator': revision.creator_name
+    }
+
+
+class InvalidSeatingError(Exception):
+    def __init__(self, invalid_user_ids):
+        super().__init__('Users {ids} are not signed up to the event'.format(ids=invalid_user_ids))
+        self.invalid_user_ids = invalid_user_ids
+
+
+class InvalidSeatError(Exception):
+    def __init__(self, invalid_seat_ids):
+        super().__init__('Seats {ids} are not in the room or have more than one person in them'.format(
+            ids=invalid_seat_ids))
+        self.invalid_seat_ids = invalid_seat_ids
+
+
+def check_seats(event, seat_ids):
+    """
+    Make sure every seat exists in the event's seating room and nobody is sharing, raising InvalidSeatError otherwise
+    """
+    invalid = {seat_id for seat_id, count in Counter(seat_ids).items() if count > 1}
+
+    if event.seating_location:
+        invalid |= event.seating_location.unknown_seats(seat_ids)
+
+    if invalid:
+        raise InvalidSeatError(sorted(invalid))
+
+
+class SeatingConflictError(Exception):
+    def __init__(self, conflicting_user_ids, latest_revision_number):
+        super().__init__('Users {ids} were moved by someone else'.format(ids=conflicting_user_ids))
+        self.conflicting_user_ids = conflicting_user_ids
+        self.latest_revision_number = latest_revision_number
+
+
+class SeatTakenError(Exception):
+    def __init__(self, seat_id):
+        super().__init__('Seat {seat} is already taken'.format(seat=seat_id))
+        self.seat_id = seat_id
 
-    if latest_revision:
-        revision_number = latest_revision.number + 1
-    else:
-        revision_number = 0
 
-    # Create the new objects
-    new_revision = SeatingRevision(event=event, creator=user, number=revision_number)
+def write_revision(event, user, revision_number, previous_seats, seats):
+    """
+    Store a new revision of the plan, given as a dict of user ID to seat ID, as either a keyframe or the changes
+    since previous_seats, and tell everyone with the plan open about it once it has been committed
+    """
+    is_keyframe = revision_number % settings.SEATING_KEYFRAME_INTERVAL == 0
+    new_revision = SeatingRevision(event=event, creator=user, number=revision_number, is_keyframe=is_keyframe)
     new_revision.save()
 
-    for seat in seats:
-        user = get_user_model().objects.get(id=seat['user_id'])
-        seat_obj = Seating(user=user, seat_id=seat['seat_id'], revision=new_revision)
-        seat_obj.save()
+    diff = diff_seats(previous_seats, seats)
+    if is_keyframe:
+        new_seats = [Seating(user_id=user_id, seat_id=seat_id, revision=new_revision) for user_id, seat_id in
+                     seats.items()]
+    else:
+        new_seats = [Seating(user_id=user_id, seat_id=seat_id, revision=new_revision) for user_id, seat_id in
+                     list(diff['added'].items()) + list(diff['moved'].items())]
+        new_seats += [Seating(user_id=user_id, seat_id=previous_seats[user_id], revision=new_revision, removed=True)
+                      for user_id in diff['removed']]
+
+    Seating.objects.bulk_create(new_seats)
+
+    push_data = {
+        'revision': revision_to_dict(new_revision),
+        'diff': diff
+    }
+    transaction.on_commit(lambda: get_broker().publish(event.id, 'revision', push_data))
 
     return new_revision
 
 
+def latest_seats(event):
+    """
+    Claim the next revision number for an event and get the plan as of the latest revision. The claim serialises
+    submits for the event, so the latest revision can't change until the caller's transaction commits.
+    Returns a tuple of (new revision number, latest plan as a dict of user ID to seat ID)
+    """
+    revision_number = event.next_seating_revision_number()
+    latest_revision = SeatingRevision.objects.for_event(event).first()
+
+    return revision_number, latest_revision.seats() if latest_revision else {}
+
+
+@transaction.atomic
+def save_revision(seats, event, user, base_revision=None):
+    """
+    Save a plan that was made from the revision numbered base_revision (-1 for the empty plan before the first
+    revision). If other revisions have been saved since, the plan is merged with them and SeatingConflictError is
+    raised if it changes anyone they changed. Without a base revision the plan replaces the latest one.
+    """
+    seats = [(int(seat['user_id']), str(seat['seat_id'])) for seat in seats]
+    if base_revision is not None:
+        base_revision = int(base_revision)
+
+    # Everyone on the plan needs to be signed up, which can be checked for the whole plan in one query
+    user_ids = {user_id for user_id, _ in seats}
+    signed_up_ids = set(
+        EventSignup.objects.all_for_event(event).filter(user_id__in=user_ids).values_list('user_id', flat=True))
+    if user_ids - signed_up_ids:
+        raise InvalidSeatingError(sorted(user_ids - signed_up_ids))
+    check_seats(event, [seat_id for _, seat_id in seats])
+
+    revision_number, previous_seats = latest_seats(event)
+    seats = dict(seats)
+
+    if base_revision is not None and base_revision != revision_number - 1:
+        if base_revision == -1:
+            base_seats = {}
+        else:
+            try:
+                base_seats = SeatingRevision.objects.get(event=event, number=base_revision).seats()
+            except SeatingRevision.DoesNotExist:
+                raise ValueError('Revision {n} does not exist'.format(n=base_revision))
+
+        seats, conflicts = merge_seats(base_seats, seats, previous_seats)
+        if conflicts:
+            raise SeatingConflictError(sorted(conflicts), revision_number - 1)
+
+    return write_revision(event, user, revision_number, previous_seats, seats)
+
+
+@transaction.atomic
+def move_user(event, user, seat_id):
+    """
+    Move a single user to a seat, or off the plan if the seat is None, leaving everyone else where they are in the
+    latest revision. Only the user's own change is stored.
+    Returns the new revision, or None if the user was already in that seat
+    """
+    if seat_id is not None:
+        check_seats(event, [seat_id])
+
+    revision_number, previous_seats = latest_seats(event)
+
+    if seat_id is not None and any(seat == seat_id and user_id != user.id for user_id, seat in previous_seats.items()):
+        raise SeatTakenError(seat_id)
+
+    seats = dict(previous_seats)
+    if seat_id is None:
+        seats.pop(user.id, None)
+    else:
+        seats[user.id] = seat_id
+
+    if seats == previous_seats:
+        # Give the revision number back
+        transaction.set_rollback(True)
+        return None
+
+    return write_revision(event, user, revision_number, previous_seats, seats)
+
+
+@transaction.atomic
+def allocate_revision(event, user, keep_seated=True):
+    """
+    Save a revision which gives a seat to everyone who has signed up, leaving anyone on the latest plan where they are
+    if keep_seated is set.
+    Returns a tuple of the new revision and a list of the IDs of anyone who didn't fit
+    """
+    revision_number, previous_seats = latest_seats(event)
+    seats, unseated = allocate_event(event, previous_seats if keep_seated else None)
+
+    return write_revision(event, user, revision_number, previous_seats, seats), unseated
+
+
 class SeatingRoomAPISubmitRevisionView(LoginRequiredMixin, View):
     raise_exception = True
 
@@ -56,6 +218,7 @@ class SeatingRoomAPISubmitRevisionView(LoginRequiredMixin, View):
         """
         The data for this expects the following JSON format:
         {
+            "base_revision": <int> -- The number of the revision the plan was made from, -1 if there were none,
             "seats": [
                 {
                     "seat_id": <int> -- Seat number,
@@ -66,24 +229,32 @@ class SeatingRoomAPISubmitRevisionView(LoginRequiredMixin, View):
         The JSON should be in the POST parameter "json"
 
         :return: If the user is exec, a new revision to add to the revision list, otherwise nothing.
-        If there was an error status code 400 is returned.
+        If there was an error status code 400 is returned, with the IDs of anyone on the plan who isn't signed up to
+        the event in "invalid_user_ids" or any seats which don't exist or are shared in "invalid_seat_ids". If someone
+        else has moved the same people since the base revision status code 409 is returned, with their IDs in
+        "conflicting_user_ids" and the latest revision number in "revision".
         """
         event = get_object_or_404(Event, id=event_id)
 
-        if not EventSignup.objects.for_event(event, request.user).exists() and not WarwickGGUser.objects.get(
-                user=self.request.user).is_exec:
+        if not EventSignup.objects.for_event(event, request.user).exists() and not request.is_exec:
             return HttpResponseForbidden()
 
         if 'json' not in request.POST:
             return HttpResponseBadRequest()
 
-        seats_obj = json.loads(request.POST.get('json'))
         try:
+            seats_obj = json.loads(request.POST.get('json'))
+        except ValueError:
+            return HttpResponseBadRequest()
+
+        try:
+            seats, base_revision = seats_obj['seats'], seats_obj.get('base_revision')
+
             if event.seating_lock_time:
                 if timezone.now() > event.seating_lock_time:
                     # Deny the revision unless the user is exec
-                    if WarwickGGUser.objects.get(user=self.request.user).is_exec:
-                        latest_revision = save_revision(seats_obj['seats'], event, request.user)
+                    if request.is_exec:
+                        latest_revision = save_revision(seats, event, request.user, base_revision)
                     else:
                         # Error with a message saying that the plan is locked
                         return JsonResponse({
@@ -91,121 +262,354 @@ class SeatingRoomAPISubmitRevisionView(LoginRequiredMixin, View):
                         }, status=403)
                 else:
                     # It's ok to add any revision
-                    latest_revision = save_revision(seats_obj['seats'], event, request.user)
+                    latest_revision = save_revision(seats, event, request.user, base_revision)
             else:
                 # It's ok to add any revision
-                latest_revision = save_revision(seats_obj['seats'], event, request.user)
+                latest_revision = save_revision(seats, event, request.user, base_revision)
 
-        except DatabaseError:
+        except InvalidSeatingError as e:
+            return JsonResponse({
+                'error': 'Some of the people on the plan are no longer signed up - refresh the page and try again',
+                'invalid_user_ids': e.invalid_user_ids
+            }, status=400)
+        except InvalidSeatError as e:
+            return JsonResponse({
+                'error': 'Some of the seats on the plan don\'t exist or have more than one person in them',
+                'invalid_seat_ids': e.invalid_seat_ids
+            }, status=400)
+        except SeatingConflictError as e:
+            return JsonResponse({
+                'error': 'Someone else has just moved some of the same people - check the plan and try again',
+                'conflicting_user_ids': e.conflicting_user_ids,
+                'revision': e.latest_revision_number
+            }, status=409)
+        except (DatabaseError, KeyError, TypeError, ValueError):
             return HttpResponseBadRequest()
 
-        if WarwickGGUser.objects.get(user=self.request.user).is_exec:
-            revision_dict = {
-                'name': 'Revision {n}'.format(n=latest_revision.number + 1),
-                'number': latest_revision.number,
-                'created_at': latest_revision.created_at,
-                'creator': latest_revision.creator_name
-            }
-
+        if request.is_exec:
             return JsonResponse({
-                'revision': revision_dict
+                'revision': revision_to_dict(latest_revision)
             })
         else:
             return HttpResponse(status=200)
 
 
-def seat_to_dict(seat: Seating):
+class SeatingRoomAPIMoveView(LoginRequiredMixin, View):
+    raise_exception = True
+
+    @method_decorator(csrf_protect, name='dispatch')
+    def post(self, request, event_id):
+        """
+        Move the logged in user to the seat in the POST parameter "seat_id", or off the plan if it is empty.
+
+        :return: The new revision (or null if nothing changed). If the seat has been taken by someone else status code
+        409 is returned with an error message.
+        """
+        event = get_object_or_404(Event, id=event_id)
+
+        if not EventSignup.objects.for_event(event, request.user).exists():
+            return HttpResponseForbidden()
+
+        seat_id = request.POST.get('seat_id')
+        if seat_id is None or len(seat_id) > Seating._meta.get_field('seat_id').max_length:
+            return HttpResponseBadRequest()
+
+        if event.seating_is_locked and not request.is_exec:
+            return JsonResponse({
+                'error': 'The seating plan is now locked - contact the exec if you would like to move'
+            }, status=403)
+
+        try:
+            revision = move_user(event, request.user, seat_id or None)
+        except SeatTakenError:
+            return JsonResponse({
+                'error': 'Someone else has just taken that seat - please pick another one'
+            }, status=409)
+        except InvalidSeatError:
+            return JsonResponse({
+                'error': 'That seat doesn\'t exist'
+            }, status=400)
+        except DatabaseError:
+            return HttpResponseBadRequest()
+
+        return JsonResponse({
+            'revision': revision_to_dict(revision) if revision else None
+        })
+
+
+class SeatingRoomAPIAllocateView(ExecRequiredMixin, LoginRequiredMixin, View):
+    raise_exception = True
+
+    @method_decorator(csrf_protect, name='dispatch')
+    def post(self, request, event_id):
+        """
+        Automatically seat everyone who isn't on the plan, or reseat everyone if the POST parameter "reseat" is set.
+
+        :return: The new revision, and the IDs of anyone who didn't fit in the room in "unseated_user_ids"
+        """
+        event = get_object_or_404(Event, id=event_id)
+
+        if not event.seating_location:
+            return JsonResponse({
+                'error': 'This event doesn\'t have a seating room to allocate seats in'
+            }, status=400)
+
+        try:
+            revision, unseated = allocate_revision(event, request.user, keep_seated=not request.POST.get('reseat'))
+        except DatabaseError:
+            return HttpResponseBadRequest()
+
+        return JsonResponse({
+            'revision': revision_to_dict(revision),
+            'unseated_user_ids': unseated
+        })
+
+
+def seat_to_dict(seat: Seating, avatars, atlas):
     """
     Convert a seat in the DB to a dict for use in the seating front-end
     """
-    profile = WarwickGGUser.objects.get(user=seat['user_id'])
-
     return {
-        'nickname': profile.long_name,
-        'seat_id': seat['seat_id'],
-        'user_id': seat['user_id'],
-        'avatar': avatar_url(profile.user)
+        'nickname': seat.user.warwickgguser.long_name,
+        'seat_id': seat.seat_id,
+        'user_id': seat.user_id,
+        'avatar': avatars[seat.user_id],
+        'atlas_index': atlas.get(seat.user_id)
     }
 
 
-def user_to_dict(user):
+def user_to_dict(user, avatars, atlas):
     """
     Convert a user to a dict for use in the seating front-end
     """
-    profile = WarwickGGUser.objects.get(user=user)
-
     return {
-        'nickname': profile.long_name,
-        'avatar': avatar_url(user),
+        'nickname': user.warwickgguser.long_name,
+        'avatar': avatars[user.id],
+        'atlas_index': atlas.get(user.id),
         'user_id': user.id
     }
 
 
+def event_atlas_avatars(event):
+    """
+    The uploaded avatars that go in an event's avatar atlas, as a dict of user ID to Avatar. Everyone with an active
+    signup is included, whether they're seated or not, so the same atlas works for every revision of the plan.
+    """
+    return primary_avatars(EventSignup.objects.all_for_event(event).values('user'))
+
+
+def build_seating_payload(event, revision):
+    """
+    Build the seated and unseated lists for a revision of an event's seating plan (or for an empty plan if the
+    revision is None). The number of queries is fixed regardless of how many people have signed up.
+
+    Everyone in the event's avatar atlas (see event_atlas_avatars) has an "atlas_index" giving its place in it, which
+    is described by "atlas" (null if nobody has uploaded an avatar). Anyone else, like someone seated in an old
+    revision who has since left, just has their "avatar" URL.
+    """
+    if revision:
+        seatings = list(materialise(Seating.objects.history(revision).select_related('user__warwickgguser')).values())
+        signups = EventSignup.objects.all_for_event(event).exclude(user_id__in=[seat.user_id for seat in seatings])
+    else:
+        seatings = []
+        signups = EventSignup.objects.all_for_event(event)
+
+    # Someone could have more than one active signup, but they should only be listed once
+    unseated = list({signup.user_id: signup.user for signup in signups.select_related('user__warwickgguser')}.values())
+    users = [seat.user for seat in seatings] + unseated
+
+    uploaded_avatars = primary_avatars(users)
+    avatars = avatar_urls(users, avatars=uploaded_avatars)
+    atlas_avatars = event_atlas_avatars(event)
+    atlas = atlas_layout(atlas_avatars)
+
+    return {
+        'revision': revision.number if revision else None,
+        'atlas': {
+            'url': '{url}?v={version}'.format(url=reverse('seating_atlas_api', kwargs={'event_id': event.id}),
+                                              version=atlas_version(atlas_avatars)),
+            'size': avatar_settings.AVATAR_DEFAULT_SIZE,
+            'columns': ATLAS_COLUMNS,
+            'rows': (len(atlas) + ATLAS_COLUMNS - 1) // ATLAS_COLUMNS
+        } if atlas else None,
+        'seated': [seat_to_dict(seat, avatars, atlas) for seat in seatings],
+        'unseated': [user_to_dict(user, avatars, atlas) for user in unseated]
+    }
+
+
+def json_snapshot_response(snapshot, etag):
+    response = HttpResponse(snapshot, content_type='application/json')
+    response['ETag'] = etag
+    # Let the browser keep the snapshot but make it check the ETag every time it polls
+    response['Cache-Control'] = 'private, no-cache'
+
+    return response
+
+
 class SeatingRoomAPIView(LoginRequiredMixin, View):
     raise_exception = True
 
     def get(self, request, event_id):
         event = get_object_or_404(Event, id=event_id)
 
-        if not EventSignup.objects.for_event(event, request.user).exists() and not WarwickGGUser.objects.get(
-                user=self.request.user).is_exec:
+        if not EventSignup.objects.for_event(event, request.user).exists() and not request.is_exec:
             return HttpResponseForbidden()
 
+        revisions = SeatingRevision.objects.for_event(event)
         if request.GET.get('revision'):
-            # Get the revision specified or 404 if not
-            revision = get_object_or_404(SeatingRevision, event=event, number=int(request.GET.get('revision')))
+            revision_number = int(request.GET.get('revision'))
+            if not revisions.filter(number=revision_number).exists():
+                raise Http404()
         else:
-            revision = SeatingRevision.objects.for_event(event).first()
+            revision_number = revisions.values_list('number', flat=True).first()
+
+        # Nothing needs to be loaded if the client already has this version of the plan
+        etag = seats_etag(event, revision_number)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified:
+            return not_modified
+
+        def build():
+            revision = revisions.get(number=revision_number) if revision_number is not None else None
+            return build_seating_payload(event, revision)
+
+        return json_snapshot_response(seats_snapshot(event, revision_number, build), etag)
 
-        # Maintain a list of users signed up to track who hasn't got a seat yet - this could probably be done with
-        # joins on the DB end, but this'll work for nwo.
-        unseated = set(map(lambda s: s.user, EventSignup.objects.all_for_event(event).all()))
 
-        if revision:
-            seatings = Seating.objects.for_event_revision(event=event, revision=revision.number).all()
-            seated_users = set(map(lambda s: s.user, seatings))
+class SeatingRoomAvatarAtlasView(LoginRequiredMixin, View):
+    raise_exception = True
+
+    def get(self, request, event_id):
+        """
+        A PNG of the uploaded avatars of everyone signed up to the event, laid out as described by "atlas" in the
+        seating plan
+        """
+        event = get_object_or_404(Event, id=event_id)
+
+        if not EventSignup.objects.for_event(event, request.user).exists() and not request.is_exec:
+            return HttpResponseForbidden()
+
+        # The image is made from exactly the avatars the plan's atlas indexes were worked out from
+        avatars = event_atlas_avatars(event)
+        version = atlas_version(avatars)
+
+        etag = avatar_atlas_etag(event, version)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified:
+            return not_modified
+
+        def build():
+            return build_avatar_atlas(avatars, avatar_settings.AVATAR_DEFAULT_SIZE)
 
-            unseated = unseated - seated_users
-            seated = list(map(seat_to_dict, seatings.values()))
+        response = HttpResponse(avatar_atlas_snapshot(event, version, build), content_type='image/png')
+        response['ETag'] = etag
+        if request.GET.get('v') == version:
+            # The plan links to the atlas with its version in the URL, so a new version is a new URL
+            response['Cache-Control'] = 'private, max-age={ttl}'.format(ttl=settings.SEATING_SNAPSHOT_TTL)
         else:
-            seated = []
+            # An out of date link mustn't keep a newer image that doesn't match the plan it came from
+            response['Cache-Control'] = 'private, no-cache'
 
-        # Make sure the people who aren't seated also are converted to JSON properly
-        unseated = list(map(user_to_dict, unseated))
-        data = {
-            'seated': seated,
-            'unseated': unseated
-        }
+        return response
+
+
+class SeatingRoomRevisionListAPIView(ExecRequiredMixin, LoginRequiredMixin, View):
+    raise_exception = True
+
+    def get(self, request, event_id):
+        event = get_object_or_404(Event, id=event_id)
+
+        revisions = SeatingRevision.objects.for_event(event)
+        latest_revision_number = revisions.values_list('number', flat=True).first()
+
+        etag = revisions_etag(event.id, latest_revision_number)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified:
+            return not_modified
+
+        def build():
+            # Create a list of revisions to send
+            return {
+                'revisions': list(map(revision_to_dict, revisions.select_related('creator__warwickgguser')))
+            }
 
-        return JsonResponse(data)
+        return json_snapshot_response(revisions_snapshot(event.id, latest_revision_number, build), etag)
 
 
-class SeatingRoomRevisionListAPIView(UserPassesTestMixin, LoginRequiredMixin, View):
+class SeatingRoomRevisionDiffAPIView(ExecRequiredMixin, LoginRequiredMixin, View):
     raise_exception = True
 
-    def test_func(self):
-        return WarwickGGUser.objects.get(
-            user=self.request.user).is_exec if self.request.user.is_authenticated else False
+    def get(self, request, event_id, number):
+        """
+        The people who were added, removed and moved in a revision compared to the revision before it, in the format:
+        {
+            "revision": <revision> -- The revision, as in the revision list,
+            "added": [{"user_id": <int>, "nickname": <str>, "seat_id": <str>}],
+            "removed": [{"user_id": <int>, "nickname": <str>, "seat_id": <str> -- The seat they left}],
+            "moved": [{"user_id": <int>, "nickname": <str>, "from_seat_id": <str>, "seat_id": <str>}]
+        }
+        """
+        revision = get_object_or_404(SeatingRevision.objects.select_related('creator__warwickgguser'),
+                                     event_id=event_id, number=number)
+
+        def change_to_dict(seat):
+            return {
+                'user_id': seat.user_id,
+                'nickname': seat.user.warwickgguser.long_name,
+                'seat_id': seat.seat_id
+            }
+
+        return JsonResponse({
+            'revision': revision_to_dict(revision),
+            'added': list(map(change_to_dict, revision.added())),
+            'removed': list(map(change_to_dict, revision.removed())),
+            'moved': [dict(change_to_dict(current), from_seat_id=previous.seat_id)
+                      for current, previous in revision.moved()]
+        })
+
+
+def event_stream(event_id):
+    """
+    Format the updates published for an event as a stream of server-sent events
+    """
+    # The stream only waits on the broker, so don't hold a database connection for as long as the client stays
+    # connected. This runs once the response has been through the middleware, which may still use the database.
+    connection.close()
+
+    yield 'retry: {ms}\n\n'.format(ms=int(settings.SEATING_PUSH_KEEPALIVE * 1000))
+
+    for message in get_broker().listen(event_id, timeout=settings.SEATING_PUSH_KEEPALIVE):
+        if message is None:
+            # A comment line to keep proxies from timing out the connection
+            yield ': keepalive\n\n'
+        else:
+            event_type, data = message
+            yield 'event: {type}\ndata: {data}\n\n'.format(type=event_type,
+                                                            data=json.dumps(data, cls=DjangoJSONEncoder))
+
+
+class SeatingRoomStreamView(LoginRequiredMixin, View):
+    raise_exception = True
 
     def get(self, request, event_id):
+        """
+        A server-sent event stream which pushes a "revision" event with the new revision and a diff of the seats
+        whenever a revision is saved, and a "signups" event whenever the people signed up to the event change.
+
+        Each open stream occupies a worker for as long as it's connected, so the site needs to run on async workers
+        (e.g. gunicorn with gevent) for this to scale to a whole LAN. See SEATING_PUSH_BACKEND in the settings.
+        """
         event = get_object_or_404(Event, id=event_id)
 
-        if not WarwickGGUser.objects.get(user=request.user).is_exec:
+        if not EventSignup.objects.for_event(event, request.user).exists() and not request.is_exec:
             return HttpResponseForbidden()
 
-        revisions = SeatingRevision.objects.for_event(event).all()
+        response = StreamingHttpResponse(event_stream(event.id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
 
-        # Create a list of revisions to send
-        data = {
-            'revisions': list(map(lambda revision: {
-                'name': 'Revision {n}'.format(n=revision.number + 1),
-                'number': revision.number,
-                'created_at': revision.created_at,
-                'creator': revision.creator_name
-            }, revisions))
-        }
-
-        return JsonResponse(data)
+        return response
 
 
 class SeatingView(LoginRequiredMixin, View):
@@ -213,21 +617,15 @@ class SeatingView(LoginRequiredMixin, View):
     login_url = '/accounts/login/'
 
     def get(self, request, slug):
-        event = get_object_or_404(Event, slug=slug)
+        event = get_object_or_404(Event.objects.select_related('seating_location'), slug=slug)
 
         # Check if the user has signed up
         has_signed_up = EventSignup.objects.for_event(event, request.user).exists()
-        # Get the filename for the seating plan SVG
-        if event.seating_location:
-            plan_svg = os.path.basename(event.seating_location.seating_plan_svg.name)
-        else:
-            plan_svg = None
 
         ctx = {
             'event': event,
             'has_signed_up': has_signed_up,
-            'is_exec': WarwickGGUser.objects.get(user=self.request.user).is_exec,
-            'slug': slug,
-            'seating_svg': plan_svg
+            'is_exec': request.is_exec,
+            'slug': slug
         }
         return render(request, self.template_name, context=ctx)
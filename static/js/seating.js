@@ -3,10 +3,23 @@
 
     const users = [];
 
+    // How often (in ms) to check for changes when they can't be pushed, and to re-sync even when they can since a
+    // push only reaches the pages streaming from the server process that made the change
+    const POLL_INTERVAL = 5000;
+    const RESYNC_INTERVAL = 60000;
+
     let seatingRevisions = [];
     let unassignedUsers;
     let revisionNumber = null;
 
+    // ETags of the last seating plan and revision list we got, so polls only download them when they've changed
+    let seatsEtag = null;
+    let revisionsEtag = null;
+
+    // The number of the latest revision we've shown, and whether an update arrived while it wasn't safe to show it
+    let latestRevision = null;
+    let refreshPending = false;
+
     let currentSeatHasUser;
     let dragging = false;
     let hovering = false;
@@ -18,6 +31,7 @@
     let popupDom;
     let revisionLogDom;
     let commitButtonDom;
+    let allocateButtonDom;
     let notificationDom;
     let notificationDom2;
     let notificationTextDom;
@@ -97,6 +111,9 @@
         }
         dragging = false;
         draggingUser = undefined;
+
+        if (refreshPending)
+            refreshLatest();
     }
 
     function dragStopOnSeat(event) {
@@ -107,7 +124,7 @@
         if (currentSeatHasUser[seat.dataset.seatId] === undefined) {
             giveSeatToUser(seat, draggingUser.user_id);
             if (revisionNumber === null)
-                commitRevision();
+                saveChange(seat.dataset.seatId);
         }
 
         dragStop(event);
@@ -122,7 +139,7 @@
         dragStop(event);
         onSeatHoverEnd();
         if (revisionNumber === null)
-            commitRevision();
+            saveChange('');
     }
 
     function onSeatHoverStart(event) {
@@ -237,6 +254,21 @@
         updateToRevision(revisionId);
     }
 
+    function onHoverRevision(event) {
+        const revisionDom = this;
+        const diffUrl = '/seating/api/revisions/' + eventId + '/' + revisionDom.dataset.revisionId + '/diff';
+
+        // Summarise what changed in the revision's tooltip
+        ajax(diffUrl, 'GET', null, (status, response) => {
+            if (status !== 200)
+                return;
+
+            const diff = JSON.parse(response);
+            revisionDom.dataset.tooltip = `Created by ${diff.revision.creator}: ${diff.added.length} added, ` +
+                `${diff.moved.length} moved, ${diff.removed.length} removed`;
+        });
+    }
+
     function avatarIdForUser(user) {
         return 'avatar-' + user.user_id;
     }
@@ -257,7 +289,49 @@
         image.setAttribute('height', '1');
         pattern.appendChild(image);
 
-        svgDom.querySelector('defs').appendChild(pattern);
+        return pattern;
+    }
+
+    function createAtlasPattern(id, atlas, index) {
+        const column = index % atlas.columns;
+        const row = Math.floor(index / atlas.columns);
+
+        // The view box picks the user's avatar out of the atlas
+        const pattern = document.createElementNS('http://www.w3.org/2000/svg', 'pattern');
+        pattern.setAttribute('id', id);
+        pattern.setAttribute('preserveAspectRatio', 'xMidYMid slice');
+        pattern.setAttribute('width', '1');
+        pattern.setAttribute('height', '1');
+        pattern.setAttribute('viewBox', `${column * atlas.size} ${row * atlas.size} ${atlas.size} ${atlas.size}`);
+
+        const image = document.createElementNS('http://www.w3.org/2000/svg', 'image');
+        image.setAttributeNS('http://www.w3.org/1999/xlink', 'xlink:href', atlas.url);
+        image.setAttribute('width', atlas.columns * atlas.size);
+        image.setAttribute('height', atlas.rows * atlas.size);
+        pattern.appendChild(image);
+
+        return pattern;
+    }
+
+    function updateAvatarPatterns(atlas) {
+        const defs = svgDom.querySelector('defs');
+
+        users.forEach(user => {
+            const id = avatarIdForUser(user);
+            const inAtlas = atlas !== null && user.atlas_index !== null;
+            const source = inAtlas ? atlas.url + '#' + user.atlas_index : user.avatar;
+
+            // Keep patterns that haven't changed so nothing is downloaded or redrawn again
+            let pattern = document.getElementById(id);
+            if (pattern !== null && pattern.getAttribute('data-source') === source)
+                return;
+            if (pattern !== null)
+                defs.removeChild(pattern);
+
+            pattern = inAtlas ? createAtlasPattern(id, atlas, user.atlas_index) : createSvgPattern(id, user.avatar);
+            pattern.setAttribute('data-source', source);
+            defs.appendChild(pattern);
+        });
     }
 
     function updateSeatStyle(seat) {
@@ -322,10 +396,12 @@
             .filter(key => input[key] !== undefined)
             .map(key => ({seat_id: key, user_id: input[key]}));
         const layout = {
+            // Lets the server merge our changes with anyone else's that were saved since
+            base_revision: latestRevision === null ? -1 : latestRevision,
             seats: seatsToBackendFormat(currentSeatHasUser),
         };
         const eventSubmitUrl = '/seating/api/submit/' + eventId;
-        ajax(eventSubmitUrl, 'POST', 'json=' + JSON.stringify(layout), (status, response) => {
+        ajax(eventSubmitUrl, 'POST', 'json=' + encodeURIComponent(JSON.stringify(layout)), (status, response) => {
             if (status !== 200) {
                 clearError();
 
@@ -337,6 +413,12 @@
                 }
 
                 enableSave();
+                // Someone else moved the same people, so show the plan with their changes
+                if (status === 409) {
+                    seatsEtag = null;
+                    revisionNumber = null;
+                    refreshLatest();
+                }
             }
             else {
                 finishSave('Saved');
@@ -348,6 +430,74 @@
         });
     }
 
+    function saveChange(seatId) {
+        // Attendees can only move themselves, so they only need to send where they've moved to
+        if (isExec)
+            commitRevision();
+        else
+            moveSeat(seatId);
+    }
+
+    function moveSeat(seatId) {
+        disableSave();
+
+        const eventMoveUrl = '/seating/api/move/' + eventId;
+        ajax(eventMoveUrl, 'POST', 'seat_id=' + encodeURIComponent(seatId), (status, response) => {
+            if (status !== 200) {
+                clearError();
+
+                let error = 'There was an error saving your changes.';
+                try {
+                    error = JSON.parse(response).error || error;
+                }
+                catch (e) {
+                    // The response wasn't JSON so use the generic error
+                }
+                addError(error);
+
+                enableSave();
+                // The seat may have been taken by someone else, so show them where everyone actually is
+                if (status === 409) {
+                    seatsEtag = null;
+                    refreshLatest();
+                }
+            }
+            else {
+                finishSave('Saved');
+            }
+        });
+    }
+
+    function allocateSeats() {
+        allocateButtonDom.disabled = true;
+
+        const eventAllocateUrl = '/seating/api/allocate/' + eventId;
+        ajax(eventAllocateUrl, 'POST', null, (status, response) => {
+            allocateButtonDom.disabled = false;
+            clearError();
+
+            if (status !== 200) {
+                let error = 'There was an error allocating seats.';
+                try {
+                    error = JSON.parse(response).error || error;
+                }
+                catch (e) {
+                    // The response wasn't JSON so use the generic error
+                }
+                addError(error);
+                return;
+            }
+
+            const allocation = JSON.parse(response);
+            if (allocation.unseated_user_ids.length)
+                addError(`${allocation.unseated_user_ids.length} people didn't fit in the room.`);
+
+            addRevision(allocation.revision);
+            revisionNumber = null;
+            refreshLatest();
+        });
+    }
+
     function addRevision(revision) {
         if (seatingRevisions.find(a => a.number === revision.number) === undefined) {
             seatingRevisions.unshift(revision);
@@ -359,6 +509,7 @@
             anchor.appendChild(document.createTextNode(revision.name));
             anchor.classList.add('revision', 'tooltip', 'is-tooltip-primary', 'is-tooltip-right');
             anchor.addEventListener('click', onClickRevision);
+            anchor.addEventListener('mouseenter', onHoverRevision, {once: true});
 
             listElement.appendChild(anchor);
             revisionLogDom.insertBefore(listElement, revisionLogDom.childNodes[0]);
@@ -380,7 +531,7 @@
     }
 
 
-    function ajax(url, method, body, callback) {
+    function ajax(url, method, body, callback, etag = null) {
         const csrf = Cookies.get('csrftoken');
         const http = new XMLHttpRequest();
 
@@ -388,12 +539,14 @@
         http.setRequestHeader('X-CSRFToken', csrf);
         if (method !== 'GET')
             http.setRequestHeader('Content-type', 'application/x-www-form-urlencoded');
+        if (etag !== null)
+            http.setRequestHeader('If-None-Match', etag);
 
         http.onload = function () {
-            callback(http.status, http.response);
+            callback(http.status, http.response, http.getResponseHeader('ETag'));
         };
         http.onerror = function () {
-            callback(http.status, http.response);
+            callback(http.status, http.response, null);
         };
         try {
             http.send(body);
@@ -422,13 +575,22 @@
         if (revision !== null)
             eventSeatingUrl = eventSeatingUrl + '?revision=' + revision;
 
-        ajax(eventSeatingUrl, 'GET', null, (status, response) => {
-            if (status !== 200) {
+        // Old revisions never change, so only the latest plan is worth revalidating
+        const etag = revision === null ? seatsEtag : null;
+
+        ajax(eventSeatingUrl, 'GET', null, (status, response, responseEtag) => {
+            if (status === 304) {
+                return;
+            }
+            else if (status !== 200) {
                 clearError();
                 addError('The seating configuration could not be retrieved.');
             }
             else {
+                seatsEtag = revision === null ? responseEtag : null;
                 const currentRevision = JSON.parse(response);
+                if (revision === null)
+                    latestRevision = currentRevision.revision;
 
                 currentSeatHasUser = {};
                 unassignedUsers = [];
@@ -444,10 +606,7 @@
                     unassignedUsers.push(userSeat);
                 });
 
-                svgDom.querySelector('defs').innerHTML = '';
-                users.forEach(user => {
-                    createSvgPattern(avatarIdForUser(user), user.avatar);
-                });
+                updateAvatarPatterns(currentRevision.atlas);
 
                 refreshUnassigned();
                 refreshSeats();
@@ -457,7 +616,7 @@
                     enableSave();
                 }
             }
-        });
+        }, etag);
     }
 
     function updateRevisionList() {
@@ -465,17 +624,98 @@
             return;
 
         const eventRevisionsUrl = '/seating/api/revisions/' + eventId;
-        ajax(eventRevisionsUrl, 'GET', null, (status, response) => {
-            if (status !== 200) {
+        ajax(eventRevisionsUrl, 'GET', null, (status, response, responseEtag) => {
+            if (status === 304) {
+                return;
+            }
+            else if (status !== 200) {
                 clearError();
                 addError('The current revision log could not be retrieved.');
             }
             else {
+                revisionsEtag = responseEtag;
                 JSON.parse(response).revisions
                     .sort((a, b) => a.number - b.number)
                     .map(addRevision);
             }
+        }, revisionsEtag);
+    }
+
+    function refreshLatest() {
+        if (dragging || revisionNumber !== null) {
+            // Don't pull the plan out from under someone who is moving a seat or looking at an old revision
+            refreshPending = true;
+            return;
+        }
+
+        refreshPending = false;
+        updateToRevision(null);
+    }
+
+    function unseatUser(userId) {
+        const seatId = Object.keys(currentSeatHasUser).find(key => currentSeatHasUser[key] === userId);
+        if (seatId !== undefined)
+            currentSeatHasUser[seatId] = undefined;
+    }
+
+    function applyRevisionPush(message) {
+        if (isExec)
+            addRevision(message.revision);
+
+        const diff = message.diff;
+        const changedSeats = Object.entries(diff.added).concat(Object.entries(diff.moved))
+            .map(([userId, seatId]) => [parseInt(userId, 10), seatId]);
+        const previousRevision = latestRevision === null ? -1 : latestRevision;
+        const knowsAllUsers = changedSeats.every(([userId, _]) => users.find(user => user.user_id === userId));
+
+        // A diff can only be applied on top of the revision before it, otherwise get the whole plan again
+        if (dragging || revisionNumber !== null || message.revision.number !== previousRevision + 1 || !knowsAllUsers) {
+            refreshLatest();
+            return;
+        }
+
+        diff.removed.forEach(unseatUser);
+        changedSeats.forEach(([userId, seatId]) => {
+            unseatUser(userId);
+            currentSeatHasUser[seatId] = userId;
         });
+
+        const seatedUsers = Object.values(currentSeatHasUser);
+        unassignedUsers = users.filter(user => !seatedUsers.includes(user.user_id)).sort(sortByNickname);
+        latestRevision = message.revision.number;
+        // Our copy of the plan was built locally so it won't match the server's ETag any more
+        seatsEtag = null;
+
+        refreshUnassigned();
+        refreshSeats();
+    }
+
+    function resync() {
+        refreshLatest();
+        updateRevisionList();
+    }
+
+    function listenForUpdates() {
+        if (!window.EventSource) {
+            // Fall back to polling for browsers without server-sent events
+            setInterval(resync, POLL_INTERVAL);
+            return;
+        }
+
+        const stream = new EventSource('/seating/api/stream/' + eventId);
+        stream.addEventListener('revision', event => applyRevisionPush(JSON.parse(event.data)));
+        stream.addEventListener('signups', refreshLatest);
+        // Catch up with anything that was missed while the stream was disconnected
+        stream.addEventListener('open', resync);
+        stream.addEventListener('error', () => {
+            if (stream.readyState === EventSource.CLOSED) {
+                // The browser has given up reconnecting so poll instead
+                resync();
+                setInterval(resync, POLL_INTERVAL);
+            }
+        });
+
+        setInterval(resync, RESYNC_INTERVAL);
     }
 
 
@@ -491,6 +731,10 @@
         notificationCloseDom = notificationDom.getElementsByClassName('delete')[0];
 
         commitButtonDom.addEventListener('click', commitRevision);
+        if (isExec) {
+            allocateButtonDom = document.getElementById('seating-allocate-button');
+            allocateButtonDom.addEventListener('click', allocateSeats);
+        }
         containerDom.addEventListener('mousemove', dragMove);
         containerDom.addEventListener('touchmove', dragMove);
         // Triggering this on the popup too makes dragging a lot smoother
@@ -523,12 +767,7 @@
 
         updateToRevision(null);
         updateRevisionList();
-        setInterval(() => {
-            if (!dragging && revisionNumber === null)
-                updateToRevision(null);
-
-            updateRevisionList();
-        }, 5000);
+        listenForUpdates();
     });
 
 })();
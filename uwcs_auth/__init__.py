@@ -0,0 +1 @@
+default_app_config = 'uwcs_auth.apps.UwcsAuthConfig'
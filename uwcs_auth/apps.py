@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class UwcsAuthConfig(AppConfig):
+    name = 'uwcs_auth'
+
+    def ready(self):
+        from uwcs_auth import signals  # noqa: F401
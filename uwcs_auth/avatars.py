@@ -0,0 +1,137 @@
+import hashlib
+from io import BytesIO
+
+from PIL import Image
+from avatar.conf import settings
+from avatar.models import Avatar
+from avatar.utils import get_cache_key
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+PRIMARY_AVATAR_PROVIDER = 'avatar.providers.PrimaryAvatarProvider'
+# The cache key prefix django-avatar uses for its avatar_url tag, so the two share cached URLs
+AVATAR_URL_CACHE_PREFIX = 'avatar_url'
+# How many avatars go across each row of an avatar atlas
+ATLAS_COLUMNS = 16
+
+
+def primary_avatars(users):
+    """
+    Get the uploaded avatars for a collection (or queryset) of users in one query, as a dict of user ID to Avatar
+    """
+    return {avatar.user_id: avatar for avatar in Avatar.objects.filter(user__in=users, primary=True)}
+
+
+def cached_sizes():
+    """
+    The avatar sizes whose URLs are cached. Only these can be invalidated when a user's avatar changes.
+    """
+    return set(settings.AVATAR_AUTO_GENERATE_SIZES) | {settings.AVATAR_DEFAULT_SIZE}
+
+
+def invalidate_avatar_urls(user):
+    cache.delete_many([get_cache_key(user, size, AVATAR_URL_CACHE_PREFIX) for size in cached_sizes()])
+
+
+def avatar_urls(users, size=settings.AVATAR_DEFAULT_SIZE, avatars=None):
+    """
+    Resolve the avatar URLs for a collection of users at once, returning a dict of user ID to URL.
+
+    This gives the same URLs as django-avatar's avatar_url tag (and shares its cache), but looks up every cached URL at
+    once and fetches the primary avatars of everyone else in one query rather than one per user (or none, if they've
+    already been fetched with primary_avatars). Users without an uploaded avatar fall through to the other configured
+    providers (Gravatar and the default image) which don't need the database.
+    """
+    users = list(users)
+    cacheable = settings.AVATAR_CACHE_ENABLED and size in cached_sizes()
+
+    urls = {}
+    if cacheable:
+        keys = {user.id: get_cache_key(user, size, AVATAR_URL_CACHE_PREFIX) for user in users}
+        cached = cache.get_many(keys.values())
+        urls = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+
+    missing = [user for user in users if user.id not in urls]
+    if not missing:
+        return urls
+
+    if avatars is None:
+        avatars = primary_avatars(missing)
+    fallback_providers = [import_string(path) for path in settings.AVATAR_PROVIDERS if
+                          path != PRIMARY_AVATAR_PROVIDER]
+
+    resolved = {}
+    for user in missing:
+        avatar = avatars.get(user.id)
+
+        if avatar:
+            # The avatar's file path is built from its user, which we already have
+            avatar.user = user
+            # Thumbnails for the auto-generated sizes are made on upload, so only check the disk for anything else
+            if size not in settings.AVATAR_AUTO_GENERATE_SIZES and not avatar.thumbnail_exists(size):
+                avatar.create_thumbnail(size)
+            resolved[user.id] = avatar.avatar_url(size)
+        else:
+            resolved[user.id] = next(filter(None, (provider.get_avatar_url(user, size) for provider in
+                                                   fallback_providers)), None)
+
+    if cacheable:
+        cache.set_many({keys[user_id]: url for user_id, url in resolved.items() if url is not None},
+                       settings.AVATAR_CACHE_TIMEOUT)
+
+    urls.update(resolved)
+    return urls
+
+
+def atlas_layout(avatars):
+    """
+    Where each user's avatar goes in an atlas of the given avatars (a dict of user ID to Avatar), as a dict of user ID
+    to index. Avatars are placed in user ID order, left to right and then top to bottom.
+    """
+    return {user_id: index for index, user_id in enumerate(sorted(avatars))}
+
+
+def atlas_version(avatars):
+    """
+    A short digest of the avatars (a dict of user ID to Avatar) in an atlas and where they go. Two atlases with the
+    same version have the same image, so it can be used to cache the image and in its URL.
+    """
+    layout = ','.join('{user}:{avatar}:{uploaded}'.format(user=user_id, avatar=avatars[user_id].pk,
+                                                          uploaded=avatars[user_id].date_uploaded.timestamp())
+                      for user_id in sorted(avatars))
+
+    return hashlib.sha1(layout.encode('utf-8')).hexdigest()[:16]
+
+
+def build_avatar_atlas(avatars, size=settings.AVATAR_DEFAULT_SIZE):
+    """
+    Paste uploaded avatars (a dict of user ID to Avatar) into a single PNG using the positions from atlas_layout, so
+    they can all be downloaded at once. Each avatar is a size by size square, ATLAS_COLUMNS to a row.
+    Returns the PNG as bytes
+    """
+    layout = atlas_layout(avatars)
+    rows = (len(layout) + ATLAS_COLUMNS - 1) // ATLAS_COLUMNS
+    # An empty atlas is still a valid (blank) image
+    atlas = Image.new('RGBA', (max(min(len(layout), ATLAS_COLUMNS), 1) * size, max(rows, 1) * size))
+
+    for user_id, index in layout.items():
+        avatar = avatars[user_id]
+
+        try:
+            if not avatar.thumbnail_exists(size):
+                avatar.create_thumbnail(size)
+
+            with avatar.avatar.storage.open(avatar.avatar_name(size), 'rb') as thumbnail_file:
+                thumbnail = Image.open(thumbnail_file).convert('RGBA')
+        except OSError:
+            # Leave a gap rather than fail the whole atlas over one missing image
+            continue
+
+        if thumbnail.size != (size, size):
+            thumbnail = thumbnail.resize((size, size), Image.LANCZOS)
+        atlas.paste(thumbnail, ((index % ATLAS_COLUMNS) * size, (index // ATLAS_COLUMNS) * size))
+
+    output = BytesIO()
+    atlas.save(output, format='PNG', optimize=True)
+
+    return output.getvalue()
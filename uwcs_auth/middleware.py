@@ -0,0 +1,19 @@
+from django.utils.functional import SimpleLazyObject
+
+from uwcs_auth.permissions import user_is_exec
+
+
+class ExecStatusMiddleware:
+    """
+    Attach `request.is_exec` so that the exec check is done at most once per request, and only if a view needs it.
+
+    Must come after django.contrib.auth.middleware.AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.is_exec = SimpleLazyObject(lambda: user_is_exec(request.user))
+
+        return self.get_response(request)
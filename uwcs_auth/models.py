@@ -1,9 +1,25 @@
 from django.contrib.auth.models import User
 
 from django.db import models
-from django.db.models.functions import Lower
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Concat, NullIf, Trim
 from django.utils import timezone
 
+from uwcs_auth.permissions import user_is_exec
+
+
+class WarwickGGUserManager(models.Manager):
+    def long_name_expr(self, user='user'):
+        """
+        A database expression for WarwickGGUser.long_name, so it can be selected without loading any models.
+
+        :param user: The path to the User from the model being queried
+        """
+        full_name = Trim(Concat(F(user + '__first_name'), Value(' '), F(user + '__last_name')))
+
+        return Coalesce(NullIf(Trim(F(user + '__warwickgguser__nickname')), Value('')), full_name,
+                        output_field=models.CharField())
+
 
 class WarwickGGUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -15,6 +31,8 @@ class WarwickGGUser(models.Model):
     battle_net_user = models.CharField('Battle.NET user', max_length=32, blank=True)
     league_user = models.CharField('Summoner name', max_length=32, blank=True)
 
+    objects = WarwickGGUserManager()
+
     def __str__(self):
         return '{uni_id} - {nick} for user {id}'.format(uni_id=self.uni_id,
                                                         nick=self.nickname if self.nickname else "no nickname",
@@ -25,10 +43,14 @@ class WarwickGGUser(models.Model):
         """
         Check if the user is part of the exec group
         """
-        return 'exec' in self.user.groups.values_list(Lower('name'), flat=True)
+        return user_is_exec(self.user)
 
     @property
     def long_name(self):
+        """
+        The user's nickname, or their full name if they haven't set one. WarwickGGUser.objects.long_name_expr works
+        this out in the database.
+        """
         if self.nickname.strip():
             return self.nickname.strip()
         else:
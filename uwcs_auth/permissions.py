@@ -0,0 +1,23 @@
+from django.contrib.auth.mixins import UserPassesTestMixin
+
+EXEC_GROUP_NAME = 'exec'
+
+
+def user_is_exec(user):
+    """
+    Check if a user is part of the exec group. This always asks the database, use `request.is_exec` in views to only
+    ask once per request.
+    """
+    if not user.is_authenticated:
+        return False
+
+    return user.groups.filter(name__iexact=EXEC_GROUP_NAME).exists()
+
+
+class ExecRequiredMixin(UserPassesTestMixin):
+    """
+    Only allow members of the exec group to use a view
+    """
+
+    def test_func(self):
+        return self.request.is_exec
@@ -0,0 +1,18 @@
+from avatar.models import Avatar
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from uwcs_auth.avatars import invalidate_avatar_urls
+
+
+@receiver(post_save, sender=Avatar)
+@receiver(post_delete, sender=Avatar)
+def avatar_changed(sender, instance, **kwargs):
+    invalidate_avatar_urls(instance.user)
+
+
+@receiver(post_save, sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    # Gravatar URLs are made from the user's email address
+    invalidate_avatar_urls(instance)
@@ -0,0 +1,33 @@
+from avatar.conf import settings
+from django import template
+from django.template.loader import render_to_string
+
+from uwcs_auth.avatars import avatar_urls
+
+register = template.Library()
+
+
+@register.simple_tag()
+def avatar_urls_for(items, size=settings.AVATAR_DEFAULT_SIZE):
+    """
+    Resolve the avatar URLs for a list of users (or of anything with a user, like signups) at once, for batched_avatar
+    """
+    return avatar_urls([getattr(item, 'user', item) for item in items], size)
+
+
+@register.simple_tag()
+def batched_avatar(user, urls, size=settings.AVATAR_DEFAULT_SIZE, **kwargs):
+    """
+    The same <img> as django-avatar's avatar tag, using a URL from avatar_urls_for if there is one
+    """
+    url = urls.get(user.id) if urls else None
+    if url is None:
+        url = avatar_urls([user], size)[user.id]
+
+    kwargs['alt'] = str(user)
+    return render_to_string('avatar/avatar_tag.html', {
+        'user': user,
+        'url': url,
+        'size': size,
+        'kwargs': kwargs
+    })
@@ -58,6 +58,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'uwcs_auth.middleware.ExecStatusMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -184,6 +185,21 @@ BOWER_INSTALLED_APPS = [
     'bulma~0.6.2',
 ]
 
+# How long (in seconds) serialised seating plans are cached for, they're keyed by version so never go stale
+SEATING_SNAPSHOT_TTL = 60 * 60
+
+# Fan-out backend for pushing seating plan updates, and how often (in seconds) idle streams send a keepalive.
+# Every open seating page holds a stream (and the worker serving it) open, so the site should be run on async
+# workers (e.g. gunicorn -k gevent) rather than a fixed pool of sync ones.
+# The in-process broker only reaches pages streaming from the process that saved the change. With more than one
+# process the pages still catch up by re-syncing every minute (RESYNC_INTERVAL in seating.js) and whenever their
+# stream reconnects, but a backend shared between processes is needed for changes to show up straight away.
+SEATING_PUSH_BACKEND = 'seating.push.InProcessBroker'
+SEATING_PUSH_KEEPALIVE = 15
+
+# Every nth seating revision stores the whole plan, the rest only store the changes since the previous revision
+SEATING_KEYFRAME_INTERVAL = 20
+
 # Django-avatar
 AVATAR_AUTO_GENERATE_SIZES = (80, 64, 128, 256)
 AVATAR_CLEANUP_DELETED = True
@@ -206,12 +222,39 @@ ANYMAIL = {
 UWCS_API_KEY = os.environ.get('UWCS_API_KEY')
 ESPORTS_API_KEY = os.environ.get('ESPORTS_API_KEY')
 
+# SU member lists synced by `manage.py sync_memberships`, keyed by the society codes in Event.SOCIETY_CHOICES.
+# UWCS membership comes from the UWCS OAuth account instead so it isn't synced.
+SU_MEMBERSHIP_API_KEYS = {
+    'WE': ESPORTS_API_KEY,
+}
+# How long (in seconds) a synced member list is trusted for. Run sync_memberships more often than this, otherwise
+# members are told their membership couldn't be checked and are asked to pay the non-member price.
+SU_MEMBERSHIP_SYNC_MAX_AGE = 60 * 60 * 24 * 2
+
 # Stripe API keys
 STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY')
 STRIPE_PRIVATE_KEY = os.environ.get('STRIPE_PRIVATE_KEY')
 STRIPE_WEBHOOK_KEY = os.environ.get('STRIPE_WEBHOOK_KEY')
 
+# The module used to talk to Stripe. events.stripe_stub stands in for it without going over the network.
+STRIPE_CLIENT = 'stripe'
+# How many times the webhook worker tries an event before giving up on it, and how long (in seconds) it waits
+# between checks for new events when run with --forever
+STRIPE_WEBHOOK_MAX_ATTEMPTS = 5
+STRIPE_WEBHOOK_POLL_INTERVAL = 5
+# How long (in seconds) an event that arrived before the events it depends on waits for them. Stripe retries
+# webhooks for up to three days.
+STRIPE_WEBHOOK_DEFER_FOR = 3 * 24 * 60 * 60
+
+# How long (in seconds) a Stripe checkout session lasts, and how long it must have left to be reused when the user
+# comes back to the signup page
+STRIPE_CHECKOUT_SESSION_TTL = 24 * 60 * 60
+CHECKOUT_REUSE_MARGIN = 10 * 60
+
 # Stripe checkout URL
 CHECKOUT_BASE_URL = os.environ.get('CHECKOUT_BASE_URL')
 
+# How long (in seconds) a space is held for someone who has started paying for a ticket
+SIGNUP_RESERVATION_TTL = 60 * 60
+
 stripe.api_key = STRIPE_PRIVATE_KEY